@@ -0,0 +1,319 @@
+import hashlib
+from functools import wraps
+
+from quart import Quart, Response, request, jsonify, g
+
+import credenciais
+import respostas
+from dao import assincrono as dao
+
+# Parte das rotas /api/* de app.py, servidas por um event loop (asyncpg + Quart):
+# login, logout, produtos (listagem, ?since=, busca por id, inclusão, alteração
+# e exclusão de um produto), cadastro e usuários. Ficam só em app.py: o stream
+# SSE, bulk, export, batch PUT/DELETE, gráfico, tarefas e as rotas de
+# diagnóstico (/api/pool, /api/senhas, /api/cache, /api/perfilador).
+# Tokens emitidos por qualquer uma das duas aplicações valem nas duas (credenciais).
+# Para rodar: hypercorn api_async:app --bind 0.0.0.0:5001
+
+app = Quart(__name__)
+app.secret_key = '123chave'
+app.config["JWT_SECRET_KEY"] = app.secret_key
+credenciais.configurar(app.config)
+if respostas.orjson is not None:
+    app.json = respostas.ProvedorJSONRapido(app)
+
+@app.before_serving
+async def iniciar_pool():
+    await dao.configurarPool(app.config)
+
+@app.after_serving
+async def fechar_pool():
+    await dao.fecharPool()
+
+def jwt_required():
+    def decorador(rota):
+        @wraps(rota)
+        async def verificar(*args, **kwargs):
+            cabecalho = request.headers.get("Authorization", "")
+            if not cabecalho.startswith("Bearer "):
+                return jsonify({"msg": "Missing Authorization Header"}), 401
+            try:
+                claims = credenciais.verificarToken(app.config, cabecalho[7:])
+            except credenciais.TokenInvalido as ex:
+                return jsonify({"msg": str(ex)}), ex.status
+            g.jwt_claims = claims
+            return await rota(*args, **kwargs)
+        return verificar
+    return decorador
+
+def _produto_para_dict(p):
+    return {"id": p[0], "nome": p[1], "loginuser": p[2], "qtde": p[3], "preco": p[4]}
+
+def _usuario_para_dict(u):
+    return {"loginuser": u[0], "senha": u[1], "tipouser": u[2]}
+
+def _formato_streaming():
+    formato = request.args.get('stream')
+    if formato in ('ndjson', 'json'):
+        return formato
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return 'ndjson'
+    return None
+
+def _resposta_streaming(formato, linhas, para_dict, tamanho_lote=500):
+    async def gerar():
+        if formato == 'json':
+            yield '['
+        separador = '\n' if formato == 'ndjson' else ','
+        inicio = ''
+        bloco = []
+        async for linha in linhas:
+            bloco.append(app.json.dumps(para_dict(linha)))
+            if len(bloco) >= tamanho_lote:
+                yield inicio + separador.join(bloco)
+                inicio = separador
+                bloco = []
+        if bloco:
+            yield inicio + separador.join(bloco)
+        yield '\n' if formato == 'ndjson' else ']'
+
+    mimetype = 'application/x-ndjson' if formato == 'ndjson' else 'application/json'
+    return Response(gerar(), mimetype=mimetype)
+
+def _limite_pagina(padrao, maximo):
+    limite = request.args.get('limite', padrao, type=int)
+    return max(1, min(limite, maximo))
+
+CACHE_CONTROL_PRODUTOS = 'private, no-cache'
+
+async def _validadores_produtos(*chaves):
+    estado = await dao.versaoProdutos()
+    if estado is None:
+        return None, None
+    versao, atualizado_em = estado
+    etag = hashlib.sha1(repr((versao,) + chaves).encode()).hexdigest()
+    return etag, atualizado_em.replace(microsecond=0)
+
+def _com_validadores(resposta, etag=None, ultima_modificacao=None):
+    if etag is not None:
+        resposta.set_etag(etag)
+    if ultima_modificacao is not None:
+        resposta.last_modified = ultima_modificacao
+    resposta.headers['Cache-Control'] = CACHE_CONTROL_PRODUTOS
+    return resposta
+
+async def _nao_modificado(etag, ultima_modificacao):
+    if etag is None:
+        return None
+    resposta = _com_validadores(Response(''), etag, ultima_modificacao)
+    await resposta.make_conditional(request)
+    return resposta if resposta.status_code == 304 else None
+
+@app.route('/api/login', methods=['POST'])
+async def login():
+    dados = await request.get_json()
+    login = dados.get("login")
+    senha = dados.get("senha")
+
+    try:
+        if not await dao.verificarLogin(login, senha):
+            return jsonify({"erro": "Login ou senha incorretos"}), 401
+    except dao.SenhasSobrecarregadas as ex:
+        return jsonify({"erro": str(ex)}), 503, {"Retry-After": "1"}
+
+    claims = await dao.buscarClaimsUsuario(login)
+    adicionais = {"tipouser": claims['tipouser'], "versao": claims['versao_token']} if claims else {}
+    access_token = credenciais.criarToken(app.config, login, adicionais)
+    return jsonify(access_token=access_token), 200
+
+@app.route('/api/logout', methods=['POST'])
+@jwt_required()
+async def logout_api():
+    login = credenciais.identidade(app.config, g.jwt_claims)
+    if not await dao.revogarToken(g.jwt_claims["jti"], login, g.jwt_claims.get("exp", 0)):
+        return jsonify({"erro": "Não foi possível revogar o token."}), 503, {"Retry-After": "1"}
+    return jsonify({"mensagem": "Token revogado."}), 200
+
+@app.route('/api/produtos', methods=['GET'])
+@jwt_required()
+async def listar_produtos_api():
+    formato = _formato_streaming()
+    if formato:
+        return _resposta_streaming(formato, dao.iterarProdutos(), _produto_para_dict)
+
+    etag, ultima_modificacao = await _validadores_produtos(request.path, sorted(request.args.items(multi=True)))
+    resposta = await _nao_modificado(etag, ultima_modificacao)
+    if resposta is not None:
+        return resposta
+
+    if request.args.get('since') is not None:
+        return await _alteracoes_produtos_api(request.args['since'], etag, ultima_modificacao)
+
+    try:
+        pagina = await dao.buscarProdutosPagina(
+            limite=_limite_pagina(20, 100),
+            depois=request.args.get('cursor'),
+            antes=request.args.get('antes'),
+            busca=request.args.get('busca'),
+            prefixo=request.args.get('prefixo') == '1',
+            ordem=request.args.get('ordem', 'id')
+        )
+    except ValueError as ex:
+        return jsonify({"erro": str(ex)}), 400
+
+    if pagina is None:
+        return jsonify({"erro": "Nenhum produto encontrado"}), 404
+
+    produtos, cursor_anterior, proximo_cursor = pagina
+    return _com_validadores(jsonify({
+        "produtos": [_produto_para_dict(p) for p in produtos],
+        "next_cursor": proximo_cursor,
+        "prev_cursor": cursor_anterior
+    }), etag, ultima_modificacao)
+
+async def _alteracoes_produtos_api(since, etag, ultima_modificacao):
+    try:
+        desde = int(since)
+    except ValueError:
+        return jsonify({"erro": "since deve ser uma versão (inteiro)."}), 400
+
+    try:
+        resultado = await dao.buscarAlteracoesProdutos(desde)
+    except dao.AlteracoesIndisponiveis as ex:
+        return jsonify({"erro": str(ex)}), 410
+    if resultado is None:
+        return jsonify({"erro": "Erro ao buscar alterações de produtos."}), 500
+
+    versao, alterados, excluidos = resultado
+    return _com_validadores(jsonify({
+        "versao": versao,
+        "alterados": [_produto_para_dict(p) for p in alterados],
+        "excluidos": excluidos
+    }), etag, ultima_modificacao)
+
+@app.route('/api/produtos/<int:id>', methods=['PUT'])
+@jwt_required()
+async def atualizar_produto(id):
+    dados = await request.get_json()
+
+    nome = dados.get("nome")
+    qtde = dados.get("qtde")
+    preco = dados.get("preco")
+
+    if not all([nome, qtde, preco]):
+        return jsonify({"erro": "Dados incompletos. Certifique-se de enviar nome, qtde e preco."}), 400
+
+    try:
+        async with dao.transacao():
+            produto = await dao.buscarProdutoPorId(id)
+            if produto is None:
+                return jsonify({"erro": "Produto não encontrado"}), 404
+
+            await dao.atualizarProduto(id, nome, qtde, preco)
+        return jsonify({"mensagem": "Produto atualizado com sucesso."}), 200
+    except Exception as ex:
+        return jsonify({"erro": f"Erro ao atualizar produto: {ex}"}), 500
+
+@app.route('/api/produtos/<int:id>', methods=['GET'])
+@jwt_required()
+async def buscar_produto_por_id(id):
+    produto = await dao.buscarProdutoPorId(id)
+    if produto is None:
+        return jsonify({"erro": "Produto não encontrado"}), 404
+
+    resposta = _com_validadores(jsonify(_produto_para_dict(produto)))
+    await resposta.add_etag()
+    return await resposta.make_conditional(request)
+
+@app.route('/api/produtos', methods=['POST'])
+@jwt_required()
+async def inserir_produto():
+    dados = await request.get_json()
+
+    nome = dados.get("nome")
+    loginuser = dados.get("loginuser")
+    qtde = dados.get("qtde")
+    preco = dados.get("preco")
+
+    if not all([nome, loginuser, qtde, preco]):
+        return jsonify({"erro": "Dados incompletos. Certifique-se de enviar nome, loginuser, qtde e preco."}), 400
+
+    try:
+        id = await dao.adicionarProduto(nome, loginuser, qtde, preco)
+    except dao.LimiteProdutosAtingido as ex:
+        return jsonify({"erro": str(ex)}), 403
+    except Exception as ex:
+        return jsonify({"erro": f"Erro ao inserir produto: {ex}"}), 500
+    if id is None:
+        return jsonify({"erro": "Erro ao inserir produto."}), 500
+    return jsonify({"mensagem": "Produto inserido com sucesso.", "id": id}), 201
+
+@app.route('/api/produtos/<int:id>', methods=['DELETE'])
+@jwt_required()
+async def excluir_produto_api(id):
+    try:
+        await dao.excluirProduto(id)
+        return jsonify({"mensagem": "Produto excluído com sucesso."}), 200
+    except Exception as ex:
+        return jsonify({"erro": f"Erro ao excluir produto: {ex}"}), 500
+
+@app.route('/api/cadastrarUsuario', methods=['POST'])
+async def criar_usuario_api():
+    dados = await request.get_json()
+    login = dados.get("loginuser")
+    senha = dados.get("senha")
+    tipo_user = dados.get("tipouser", "normal")
+
+    if not all([login, senha]):
+        return jsonify({"erro": "Dados incompletos. Certifique-se de enviar login e senha."}), 400
+
+    if await dao.verificarSeLoginExiste(login):
+        return jsonify({"erro": "Este login ja esta em uso. Tente outro."}), 400
+
+    try:
+        await dao.criarUsuario(login, senha, tipo_user)
+        return jsonify({"mensagem": "Usuario criado com sucesso."}), 201
+    except dao.SenhasSobrecarregadas as ex:
+        return jsonify({"erro": str(ex)}), 503, {"Retry-After": "1"}
+    except Exception as ex:
+        return jsonify({"erro": f"Erro ao criar usuario: {ex}"}), 500
+
+@app.route('/api/usuarios', methods=['GET'])
+@jwt_required()
+async def listar_usuarios_api():
+    formato = _formato_streaming()
+    if formato:
+        return _resposta_streaming(formato, dao.iterarUsuarios(), _usuario_para_dict)
+
+    usuarios = await dao.buscarUsuarios()
+    if usuarios is None:
+        return jsonify({"erro": "Nenhum usuário encontrado"}), 404
+
+    return jsonify([_usuario_para_dict(u) for u in usuarios])
+
+@app.route('/api/usuarios/<login>', methods=['GET'])
+@jwt_required()
+async def buscar_usuario_por_login_api(login):
+    usuario = await dao.buscarUsuarioPorLogin(login)
+    if usuario is None:
+        return jsonify({"erro": "Usuário não encontrado"}), 404
+
+    return jsonify(_usuario_para_dict(usuario))
+
+@app.route('/api/usuarios/<login>', methods=['PUT'])
+@jwt_required()
+async def atualizar_usuario_api(login):
+    dados = await request.get_json()
+    novo_tipo = dados.get("tipouser")
+
+    if not novo_tipo:
+        return jsonify({"erro": "Tipo de usuário não fornecido."}), 400
+
+    try:
+        await dao.atualizarTipoUsuario(login, novo_tipo)
+        return jsonify({"mensagem": "Usuário atualizado com sucesso."}), 200
+    except Exception as ex:
+        return jsonify({"erro": f"Erro ao atualizar usuário: {str(ex)}"}), 500
+
+if __name__ == '__main__':
+    app.run(port=5001, debug=True)
@@ -1,15 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from markupsafe import Markup
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token
-import pandas as pd
+import csv
+import hashlib
+import io
+import itertools
+import json
 import os
-import plotly.express as px
+import autenticacao
 import dao
+import grafico
+import monitoramento
+import perfilador
+import renderizacao
+import respostas
+import tarefas
 
 app = Flask(__name__)
 app.secret_key = '123chave'
 app.config["JWT_SECRET_KEY"] = app.secret_key
-jwt = JWTManager(app)
+app.config["GRAFICO_HABILITADO"] = os.environ.get("GRAFICO_HABILITADO", "1") != "0"
+# Atualização da listagem HTML: "polling" (padrão) consulta /api/produtos/stream
+# a cada PRODUTOS_PAGINA_INTERVALO segundos sem prender a conexão; "sse" mantém
+# o stream aberto enquanto a página estiver aberta, o que ocupa uma thread por
+# aba: só com worker assíncrono (gevent/eventlet) ou hypercorn, nunca com
+# "gunicorn --threads"; "desligado" não acompanha.
+app.config["PRODUTOS_PAGINA_AO_VIVO"] = os.environ.get("PRODUTOS_PAGINA_AO_VIVO", "polling")
+app.config["PRODUTOS_PAGINA_INTERVALO"] = int(os.environ.get("PRODUTOS_PAGINA_INTERVALO", 30))
+jwt = autenticacao.init_app(app)
+dao.init_app(app)
+monitoramento.init_app(app)
+grafico.init_app(app)
+tarefas.init_app(app)
+respostas.init_app(app)
+renderizacao.init_app(app)
+perfilador.init_app(app)
 
 #API routes
 
@@ -19,24 +44,222 @@ def login():
     login = dados.get("login")
     senha = dados.get("senha")
 
-    if not dao.verificarLogin(login, senha):
-        return jsonify({"erro": "Login ou senha incorretos"}), 401
+    try:
+        if not dao.verificarLogin(login, senha):
+            return jsonify({"erro": "Login ou senha incorretos"}), 401
+    except dao.SenhasSobrecarregadas as ex:
+        return jsonify({"erro": str(ex)}), 503, {"Retry-After": "1"}
 
-    access_token = create_access_token(identity=login)
+    access_token = autenticacao.criarToken(login)
     return jsonify(access_token=access_token), 200
 
+@app.route('/api/logout', methods=['POST'])
+@jwt_required()
+def logout_api():
+    if not autenticacao.revogarTokenAtual():
+        return jsonify({"erro": "Não foi possível revogar o token."}), 503, {"Retry-After": "1"}
+    return jsonify({"mensagem": "Token revogado."}), 200
+
+def _produto_para_dict(p):
+    return {"id": p[0], "nome": p[1], "loginuser": p[2], "qtde": p[3], "preco": p[4]}
+
+def _usuario_para_dict(u):
+    return {"loginuser": u[0], "senha": u[1], "tipouser": u[2]}
+
+def _formato_streaming():
+    formato = request.args.get('stream')
+    if formato in ('ndjson', 'json'):
+        return formato
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return 'ndjson'
+    return None
+
+def _resposta_streaming(formato, linhas, para_dict, tamanho_lote=500):
+    # Envia os registros em blocos à medida que chegam do cursor do servidor,
+    # sem montar a lista inteira em memória.
+    def gerar_ndjson():
+        bloco = []
+        for linha in linhas:
+            bloco.append(app.json.dumps(para_dict(linha)))
+            if len(bloco) >= tamanho_lote:
+                yield '\n'.join(bloco) + '\n'
+                bloco = []
+        if bloco:
+            yield '\n'.join(bloco) + '\n'
+
+    def gerar_json():
+        yield '['
+        separador = ''
+        bloco = []
+        for linha in linhas:
+            bloco.append(app.json.dumps(para_dict(linha)))
+            if len(bloco) >= tamanho_lote:
+                yield separador + ','.join(bloco)
+                separador = ','
+                bloco = []
+        if bloco:
+            yield separador + ','.join(bloco)
+        yield ']'
+
+    if formato == 'ndjson':
+        return Response(gerar_ndjson(), mimetype='application/x-ndjson')
+    return Response(gerar_json(), mimetype='application/json')
+
+def _limite_pagina(padrao, maximo):
+    limite = request.args.get('limite', padrao, type=int)
+    return max(1, min(limite, maximo))
+
+# Respostas de produtos podem ser guardadas pelo cliente, mas sempre revalidadas
+# (If-None-Match/If-Modified-Since); proxies compartilhados não as armazenam.
+CACHE_CONTROL_PRODUTOS = 'private, no-cache'
+
+def _validadores_produtos(estado, *chaves):
+    # ETag forte derivado da versão da tabela produtos (dao.versaoProdutos) e de
+    # tudo mais que define o corpo da resposta (parâmetros, usuário etc.).
+    if estado is None:
+        return None, None
+    versao, atualizado_em = estado
+    etag = hashlib.sha1(repr((versao,) + chaves).encode()).hexdigest()
+    return etag, atualizado_em.replace(microsecond=0)
+
+def _com_validadores(resposta, etag=None, ultima_modificacao=None):
+    if etag is not None:
+        resposta.set_etag(etag)
+    if ultima_modificacao is not None:
+        resposta.last_modified = ultima_modificacao
+    resposta.headers['Cache-Control'] = CACHE_CONTROL_PRODUTOS
+    return resposta
+
+def _nao_modificado(etag, ultima_modificacao):
+    # 304 antes de consultar os produtos, quando o cliente já tem esta versão.
+    if etag is None:
+        return None
+    resposta = _com_validadores(Response(), etag, ultima_modificacao)
+    resposta.make_conditional(request)
+    return resposta if resposta.status_code == 304 else None
+
 @app.route('/api/produtos', methods=['GET'])
 @jwt_required()
 def listar_produtos_api():
-    produtos = dao.buscarProdutos()
-    if produtos is None:
+    formato = _formato_streaming()
+    if formato:
+        return _resposta_streaming(formato, dao.iterarProdutos(), _produto_para_dict)
+
+    estado = dao.versaoProdutos()
+    etag, ultima_modificacao = _validadores_produtos(
+        estado, request.path, sorted(request.args.items(multi=True))
+    )
+    resposta = _nao_modificado(etag, ultima_modificacao)
+    if resposta is not None:
+        return resposta
+
+    if request.args.get('since') is not None:
+        return _alteracoes_produtos_api(request.args['since'], etag, ultima_modificacao)
+
+    try:
+        pagina = dao.buscarProdutosPagina(
+            limite=_limite_pagina(20, 100),
+            depois=request.args.get('cursor'),
+            antes=request.args.get('antes'),
+            busca=request.args.get('busca'),
+            prefixo=request.args.get('prefixo') == '1',
+            ordem=request.args.get('ordem', 'id')
+        )
+    except ValueError as ex:
+        return jsonify({"erro": str(ex)}), 400
+
+    if pagina is None:
         return jsonify({"erro": "Nenhum produto encontrado"}), 404
 
-    produtos_list = [
-        {"id": p[0], "nome": p[1], "loginuser": p[2], "qtde": p[3], "preco": p[4]}
-        for p in produtos
-    ]
-    return jsonify(produtos_list)
+    produtos, cursor_anterior, proximo_cursor = pagina
+    resposta = _com_validadores(jsonify({
+        "produtos": [_produto_para_dict(p) for p in produtos],
+        "next_cursor": proximo_cursor,
+        "prev_cursor": cursor_anterior
+    }), etag, ultima_modificacao)
+    if estado is not None:
+        # Lida antes da página: ?since= com esta versão traz tudo o que mudou depois.
+        resposta.headers['X-Produtos-Versao'] = str(estado[0])
+    return resposta
+
+def _alteracoes_produtos_api(since, etag, ultima_modificacao):
+    try:
+        desde = int(since)
+    except ValueError:
+        return jsonify({"erro": "since deve ser uma versão (inteiro)."}), 400
+
+    try:
+        resultado = dao.buscarAlteracoesProdutos(desde)
+    except dao.AlteracoesIndisponiveis as ex:
+        return jsonify({"erro": str(ex)}), 410
+    if resultado is None:
+        return jsonify({"erro": "Erro ao buscar alterações de produtos."}), 500
+
+    versao, alterados, excluidos = resultado
+    return _com_validadores(jsonify({
+        "versao": versao,
+        "alterados": [_produto_para_dict(p) for p in alterados],
+        "excluidos": excluidos
+    }), etag, ultima_modificacao)
+
+def _evento_sse(evento):
+    dados = dict(evento)
+    tipo = dados.pop('tipo')
+    identificador = f"id: {dados['versao']}\n" if 'versao' in dados else ''
+    return f"{identificador}event: {tipo}\ndata: {json.dumps(dados)}\n\n"
+
+def _eventos_iniciais(ultimo):
+    # Sem Last-Event-ID/since, só a versão atual; com ele, o que mudou desde então
+    # (ou "reiniciar", se o delta não estiver disponível).
+    if ultimo is None:
+        estado = dao.versaoProdutos()
+        return [{"tipo": "conectado", "versao": estado[0]}] if estado is not None else []
+    try:
+        versao, alterados, excluidos = dao.buscarAlteracoesProdutos(int(ultimo))
+    except (TypeError, ValueError, dao.AlteracoesIndisponiveis):
+        return [{"tipo": "reiniciar"}]
+    if not alterados and not excluidos:
+        return [{"tipo": "conectado", "versao": versao}]
+    return [dict(dao.eventoProdutos(versao, [p[0] for p in alterados], excluidos), tipo="produtos")]
+
+@app.route('/api/produtos/stream', methods=['GET'])
+def stream_produtos_api():
+    # EventSource não envia cabeçalhos: vale a sessão da página ou o token JWT.
+    if 'usuario_logado' not in session:
+        verify_jwt_in_request()
+
+    if request.args.get('polling') == '1':
+        # Responde o que mudou e encerra; o EventSource reconecta após o retry
+        # com Last-Event-ID, sem ocupar uma thread entre as consultas.
+        iniciais = _eventos_iniciais(request.headers.get('Last-Event-ID') or request.args.get('since'))
+        espera = app.config['PRODUTOS_PAGINA_INTERVALO'] * 1000
+        corpo = f'retry: {espera}\n\n' + ''.join(_evento_sse(evento) for evento in iniciais)
+        return Response(corpo, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    # Stream contínuo: uma thread por conexão, ver PRODUTOS_PAGINA_AO_VIVO.
+    try:
+        assinatura = dao.assinarAlteracoesProdutos()
+    except dao.AssinaturasEsgotadas:
+        return jsonify({"erro": "Limite de conexões de stream atingido."}), 503, {"Retry-After": "5"}
+    # Assinado antes de ler o delta: nada que mude entre os dois fica de fora.
+    iniciais = _eventos_iniciais(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    intervalo = app.config.get('PRODUTOS_STREAM_PING', 15)
+
+    def gerar():
+        try:
+            yield 'retry: 3000\n\n'
+            for evento in iniciais:
+                yield _evento_sse(evento)
+            while True:
+                evento = assinatura.proximo(timeout=intervalo)
+                yield ': ping\n\n' if evento is None else _evento_sse(evento)
+        finally:
+            assinatura.cancelar()
+
+    return Response(gerar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/api/produtos/<int:id>', methods=['PUT'])
 @jwt_required()
@@ -51,11 +274,12 @@ def atualizar_produto(id):
         return jsonify({"erro": "Dados incompletos. Certifique-se de enviar nome, qtde e preco."}), 400
 
     try:
-        produto = dao.buscarProdutoPorId(id)
-        if produto is None:
-            return jsonify({"erro": "Produto não encontrado"}), 404
+        with dao.transacao():
+            produto = dao.buscarProdutoPorId(id)
+            if produto is None:
+                return jsonify({"erro": "Produto não encontrado"}), 404
 
-        dao.atualizarProduto(id, nome, qtde, preco)
+            dao.atualizarProduto(id, nome, qtde, preco)
         return jsonify({"mensagem": "Produto atualizado com sucesso."}), 200
     except Exception as ex:
         return jsonify({"erro": f"Erro ao atualizar produto: {ex}"}), 500
@@ -67,14 +291,11 @@ def buscar_produto_por_id(id):
     if produto is None:
         return jsonify({"erro": "Produto não encontrado"}), 404
 
-    produto_dict = {
-        "id": produto[0],
-        "nome": produto[1],
-        "loginuser": produto[2],
-        "qtde": produto[3],
-        "preco": produto[4]
-    }
-    return jsonify(produto_dict)
+    # Um produto vem do cache de leitura; o ETag é o hash do próprio corpo, então
+    # só muda quando este produto muda.
+    resposta = _com_validadores(jsonify(_produto_para_dict(produto)))
+    resposta.add_etag()
+    return resposta.make_conditional(request)
 
 @app.route('/api/produtos', methods=['POST'])
 @jwt_required()
@@ -90,10 +311,143 @@ def inserir_produto():
         return jsonify({"erro": "Dados incompletos. Certifique-se de enviar nome, loginuser, qtde e preco."}), 400
 
     try:
-        dao.adicionarProduto(nome, loginuser, qtde, preco)
-        return jsonify({"mensagem": "Produto inserido com sucesso."}), 201
+        id = dao.adicionarProduto(nome, loginuser, qtde, preco)
+    except dao.LimiteProdutosAtingido as ex:
+        return jsonify({"erro": str(ex)}), 403
     except Exception as ex:
         return jsonify({"erro": f"Erro ao inserir produto: {ex}"}), 500
+    if id is None:
+        return jsonify({"erro": "Erro ao inserir produto."}), 500
+    return jsonify({"mensagem": "Produto inserido com sucesso.", "id": id}), 201
+
+def _ler_csv(stream):
+    leitor = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    faltando = {'nome', 'qtde', 'preco'} - set(leitor.fieldnames or [])
+    if faltando:
+        raise ValueError(f"Cabeçalho CSV sem as colunas: {', '.join(sorted(faltando))}")
+    for dados in leitor:
+        yield leitor.line_num, dados
+
+def _ler_ndjson(stream):
+    for numero, linha in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), 1):
+        if not linha.strip():
+            continue
+        try:
+            dados = json.loads(linha)
+        except ValueError:
+            dados = None
+        yield numero, dados
+
+@app.route('/api/produtos/bulk', methods=['POST'])
+@jwt_required()
+def importar_produtos_api():
+    if request.mimetype == 'text/csv':
+        leitor = _ler_csv
+    elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        leitor = _ler_ndjson
+    else:
+        return jsonify({"erro": "Envie o corpo como text/csv ou application/x-ndjson."}), 415
+
+    registros = leitor(request.stream)
+    try:
+        # Lê o primeiro registro já aqui para validar o cabeçalho do CSV.
+        primeiro = next(registros, None)
+    except ValueError as ex:
+        return jsonify({"erro": str(ex)}), 400
+    if primeiro is None:
+        return jsonify({"erro": "Nenhum produto enviado."}), 400
+
+    tamanho_lote = max(1, min(request.args.get('lote', 5000, type=int), 50000))
+    resultado = dao.importarProdutos(
+        itertools.chain([primeiro], registros),
+        loginuser_padrao=get_jwt_identity(),
+        tamanho_lote=tamanho_lote
+    )
+    return jsonify(resultado), 201 if resultado['inseridos'] else 200
+
+@app.route('/api/produtos/export', methods=['GET'])
+@jwt_required()
+def exportar_produtos_api():
+    # ?assincrono=1: o CSV é gerado por uma tarefa; a resposta (202) traz a URL dela.
+    if request.args.get('assincrono') == '1' and tarefas.habilitadas():
+        estado = dao.versaoProdutos()
+        return tarefas.enfileirar('exportar_produtos_csv', chave=f'csv:{estado[0]}' if estado else None)
+
+    resposta = Response(dao.exportarProdutosCsv(), mimetype='text/csv')
+    resposta.headers['Content-Disposition'] = 'attachment; filename=produtos.csv'
+    return resposta
+
+def _itens_lote(dados, chave):
+    itens = dados.get(chave) if isinstance(dados, dict) else dados
+    if not isinstance(itens, list) or not itens:
+        raise ValueError(f"Envie uma lista não vazia em '{chave}'.")
+    if len(itens) > dao.MAX_ITENS_LOTE:
+        raise ValueError(f"No máximo {dao.MAX_ITENS_LOTE} itens por requisição.")
+    return itens
+
+@app.route('/api/produtos/batch', methods=['PUT'])
+@jwt_required()
+def atualizar_produtos_lote_api():
+    try:
+        itens = _itens_lote(request.get_json(silent=True), 'produtos')
+    except ValueError as ex:
+        return jsonify({"erro": str(ex)}), 400
+
+    resultados = []
+    alteracoes = []
+    vistos = set()
+    for item in itens:
+        try:
+            alteracao = dao.validarAlteracaoProduto(item)
+        except ValueError as ex:
+            resultados.append({"id": item.get("id") if isinstance(item, dict) else None, "status": "invalido", "erro": str(ex)})
+            continue
+        if alteracao[0] in vistos:
+            resultados.append({"id": alteracao[0], "status": "invalido", "erro": "id repetido no lote"})
+            continue
+        vistos.add(alteracao[0])
+        alteracoes.append(alteracao)
+        resultados.append({"id": alteracao[0], "status": None})
+
+    atualizados = set()
+    erro = None
+    if alteracoes:
+        try:
+            atualizados = dao.atualizarProdutosEmLote(alteracoes)
+        except Exception as ex:
+            erro = f"Erro ao atualizar produtos: {ex}"
+
+    for resultado in resultados:
+        if resultado["status"] is None:
+            if erro:
+                resultado.update(status="erro", erro=erro)
+            else:
+                resultado["status"] = "atualizado" if resultado["id"] in atualizados else "nao_encontrado"
+
+    return jsonify({"atualizados": len(atualizados), "resultados": resultados}), 500 if erro else 200
+
+@app.route('/api/produtos/batch', methods=['DELETE'])
+@jwt_required()
+def excluir_produtos_lote_api():
+    try:
+        ids = _itens_lote(request.get_json(silent=True), 'ids')
+    except ValueError as ex:
+        return jsonify({"erro": str(ex)}), 400
+    try:
+        ids = [int(id) for id in ids]
+    except (TypeError, ValueError):
+        return jsonify({"erro": "Os ids devem ser números inteiros."}), 400
+
+    try:
+        excluidos = dao.excluirProdutosEmLote(set(ids))
+    except Exception as ex:
+        return jsonify({"erro": f"Erro ao excluir produtos: {ex}"}), 500
+
+    resultados = [
+        {"id": id, "status": "excluido" if id in excluidos else "nao_encontrado"}
+        for id in dict.fromkeys(ids)
+    ]
+    return jsonify({"excluidos": len(excluidos), "resultados": resultados})
 
 @app.route('/api/produtos/<int:id>', methods=['DELETE'])
 @jwt_required()
@@ -120,21 +474,23 @@ def criar_usuario_api():
     try:
         dao.criarUsuario(login, senha, tipo_user)
         return jsonify({"mensagem": "Usuario criado com sucesso."}), 201
+    except dao.SenhasSobrecarregadas as ex:
+        return jsonify({"erro": str(ex)}), 503, {"Retry-After": "1"}
     except Exception as ex:
         return jsonify({"erro": f"Erro ao criar usuario: {ex}"}), 500
 
 @app.route('/api/usuarios', methods=['GET'])
 @jwt_required()
 def listar_usuarios_api():
+    formato = _formato_streaming()
+    if formato:
+        return _resposta_streaming(formato, dao.iterarUsuarios(), _usuario_para_dict)
+
     usuarios = dao.buscarUsuarios()
     if usuarios is None:
         return jsonify({"erro": "Nenhum usuário encontrado"}), 404
 
-    usuarios_list = [
-        {"loginuser": u[0], "senha": u[1], "tipouser": u[2]}
-        for u in usuarios
-    ]
-    return jsonify(usuarios_list)
+    return jsonify([_usuario_para_dict(u) for u in usuarios])
 
 @app.route('/api/usuarios/<login>', methods=['GET'])
 @jwt_required()
@@ -143,12 +499,7 @@ def buscar_usuario_por_login_api(login):
     if usuario is None:
         return jsonify({"erro": "Usuário não encontrado"}), 404
 
-    usuario_dict = {
-        "loginuser": usuario[0],
-        "senha": usuario[1],
-        "tipouser": usuario[2]
-    }
-    return jsonify(usuario_dict)
+    return jsonify(_usuario_para_dict(usuario))
 
 @app.route('/api/usuarios/<login>', methods=['PUT'])
 @jwt_required()
@@ -166,6 +517,27 @@ def atualizar_usuario_api(login):
         return jsonify({"erro": f"Erro ao atualizar usuário: {str(ex)}"}), 500
 
 
+@app.route('/api/pool', methods=['GET'])
+@autenticacao.papelRequerido('super')
+def estatisticas_pool_api():
+    return jsonify(dao.estatisticasPool())
+
+@app.route('/api/senhas', methods=['GET'])
+@autenticacao.papelRequerido('super')
+def estatisticas_senhas_api():
+    return jsonify(dao.estatisticasSenhas())
+
+@app.route('/api/cache', methods=['GET'])
+@autenticacao.papelRequerido('super')
+def estatisticas_cache_api():
+    return jsonify({
+        "perfis": dao.estatisticasCachePerfis(),
+        "produtos": dao.estatisticasCacheProdutos(),
+        "fragmentos": renderizacao.estatisticasFragmentos(),
+        "tokens": autenticacao.estatisticas()
+    })
+
+
 ##################################################################################################################################
 
 @app.route('/', methods=['GET', 'POST'])
@@ -176,11 +548,14 @@ def index():
     if request.method == 'POST':
         login = request.form['login']
         senha = request.form['senha']
-        if dao.verificarLogin(login, senha):
-            session['usuario_logado'] = login
-            return redirect(url_for('listar_produtos'))
-        else:
-            flash("Login ou senha incorretos.")
+        try:
+            if dao.verificarLogin(login, senha):
+                session['usuario_logado'] = login
+                return redirect(url_for('listar_produtos'))
+            else:
+                flash("Login ou senha incorretos.")
+        except dao.SenhasSobrecarregadas:
+            flash("Servidor ocupado. Tente novamente em instantes.")
 
     return render_template('index.html')
 
@@ -191,14 +566,12 @@ def listar_usuarios():
         return redirect(url_for('index'))
 
     login = session['usuario_logado']
-    usuario = dao.buscarUsuarioPorLogin(login)
+    tipo_usuario = dao.buscarTipoUsuario(login)
 
-    if usuario is None:
+    if tipo_usuario is None:
         flash("Usuário não encontrado.")
         return redirect(url_for('index'))
 
-    tipo_usuario = usuario[2]
-
     if tipo_usuario != 'super':
         flash("Você não tem permissão para acessar esta página.")
         return redirect(url_for('listar_produtos'))
@@ -234,17 +607,60 @@ def listar_produtos():
         return redirect(url_for('index'))
 
     loginuser = session['usuario_logado']
-    usuario = dao.buscarUsuarioPorLogin(loginuser)
+    tipo_usuario = dao.buscarTipoUsuario(loginuser)
 
-    if not usuario:
+    if not tipo_usuario:
         flash("Usuário não encontrado.")
         return redirect(url_for('index'))
+    busca = request.args.get('busca') or None
+    ordem = request.args.get('ordem', 'id')
+
+    # Mensagens de flash pendentes entram na página e não fazem parte do ETag.
+    estado = dao.versaoProdutos()
+    etag = ultima_modificacao = None
+    if '_flashes' not in session:
+        etag, ultima_modificacao = _validadores_produtos(
+            estado, request.path, loginuser, tipo_usuario, sorted(request.args.items(multi=True))
+        )
+        resposta = _nao_modificado(etag, ultima_modificacao)
+        if resposta is not None:
+            return resposta
+
+    depois = request.args.get('depois')
+    antes = request.args.get('antes')
+
+    def montar_pagina():
+        pagina = dao.buscarProdutosPagina(limite=5, depois=depois, antes=antes, busca=busca, ordem=ordem)
+        if pagina is None:
+            return None
+        produtos, cursor_anterior, proximo_cursor = pagina
+        tabela = render_template('tabelaProdutos.html', produtos=produtos,
+                                 url_detalhes=renderizacao.prefixoUrl('detalhes_produto'),
+                                 url_editar=renderizacao.prefixoUrl('editar_produto'),
+                                 url_excluir=renderizacao.prefixoUrl('excluir_produto'))
+        return produtos, cursor_anterior, proximo_cursor, Markup(tabela)
+
+    # A página (linhas e corpo da tabela já renderizado) fica em cache por versão
+    # dos produtos, perfil e parâmetros; um acerto não consulta nem renderiza o laço.
+    chave = None
+    if estado is not None:
+        chave = repr(('listarProdutos', estado[0], tipo_usuario, request.script_root,
+                      depois, antes, busca, ordem))
+    try:
+        pagina = renderizacao.fragmento(chave, montar_pagina)
+    except ValueError:
+        return redirect(url_for('listar_produtos', busca=busca))
 
-    tipo_usuario = usuario[2]
-    produtos = dao.buscarProdutos()
-
-    return render_template('listarProdutos.html', produtos=produtos, tipo_usuario=tipo_usuario)
+    if pagina is None:
+        etag = ultima_modificacao = None
+    produtos, cursor_anterior, proximo_cursor, tabela = pagina or ([], None, None, Markup())
 
+    html = render_template('listarProdutos.html', produtos=produtos, tabela_produtos=tabela,
+                           tipo_usuario=tipo_usuario, busca=busca, ordem=ordem,
+                           cursor_anterior=cursor_anterior, proximo_cursor=proximo_cursor,
+                           versao_produtos=estado[0] if estado is not None else None,
+                           ao_vivo=app.config['PRODUTOS_PAGINA_AO_VIVO'])
+    return _com_validadores(app.make_response(html), etag, ultima_modificacao)
 
 @app.route('/adicionarProduto', methods=['GET', 'POST'])
 def adicionar_produto():
@@ -254,16 +670,15 @@ def adicionar_produto():
 
     loginuser = session['usuario_logado']
 
-    usuario = dao.buscarUsuarioPorLogin(loginuser)
-    if not usuario:
+    tipo_usuario = dao.buscarTipoUsuario(loginuser)
+    if not tipo_usuario:
         flash("Usuário não encontrado.")
         return redirect(url_for('index'))
 
-    tipo_usuario = usuario[2]
-    num_produtos = dao.contarProdutos(loginuser)
-
-    if tipo_usuario == 'normal' and num_produtos >= 3:
-        flash("Você não pode adicionar mais produtos. O limite de 3 produtos foi atingido.")
+    limite = f"Você não pode adicionar mais produtos. O limite de {dao.LIMITE_PRODUTOS_NORMAL} produtos foi atingido."
+    # Só evita mostrar o formulário; quem garante o limite é o INSERT de adicionarProduto.
+    if tipo_usuario == 'normal' and dao.contarProdutos(loginuser) >= dao.LIMITE_PRODUTOS_NORMAL:
+        flash(limite)
         return redirect(url_for('listar_produtos'))
 
     if request.method == 'POST':
@@ -271,8 +686,12 @@ def adicionar_produto():
         qtde = request.form['qtde']
         preco = request.form['preco']
 
-        dao.adicionarProduto(nome, loginuser, qtde, preco)
-        flash("Produto adicionado com sucesso.")
+        try:
+            id = dao.adicionarProduto(nome, loginuser, qtde, preco)
+        except dao.LimiteProdutosAtingido:
+            flash(limite)
+            return redirect(url_for('listar_produtos'))
+        flash("Produto adicionado com sucesso." if id is not None else "Erro ao adicionar produto.")
         return redirect(url_for('listar_produtos'))
 
     return render_template('adicionarProduto.html')
@@ -342,82 +761,15 @@ def cadastro():
         if dao.verificarSeLoginExiste(login):
             flash("Este login já está em uso. Tente outro.")
         else:
-            dao.criarUsuario(login, senha, tipo_usuario)
-            flash("Cadastro realizado com sucesso. Faça login para continuar.")
-            return redirect(url_for('index'))
+            try:
+                dao.criarUsuario(login, senha, tipo_usuario)
+                flash("Cadastro realizado com sucesso. Faça login para continuar.")
+                return redirect(url_for('index'))
+            except dao.SenhasSobrecarregadas:
+                flash("Servidor ocupado. Tente novamente em instantes.")
 
     return render_template('cadastrarUsuario.html')
 
-@app.route('/grafico', methods=['GET'])
-def visualizacao():
-    if 'usuario_logado' not in session:
-        flash("Você precisa estar logado para acessar esta página.")
-        return redirect(url_for('index'))
-
-    produtos = dao.buscarProdutos()
-
-    if not produtos:
-        flash("Não há produtos cadastrados para serem exibidos ainda.")
-        return redirect(url_for('listar_produtos'))
-
-    df = pd.DataFrame(produtos, columns=["id", "nome", "loginuser", "qtde", "preco"])
-
-    fig = px.bar(df, x="nome", y="qtde", title="Quantidade de Produtos por Nome",
-                 labels={"qtde": "Quantidade", "nome": "Nome do Produto"})
-
-    fig.update_traces(
-        marker=dict(
-            color='pink',
-            line=dict(
-                color='rgb(119,67,22)',
-                width=1
-            )
-        )
-    )
-
-    fig.update_layout(
-        title="Quantidade de Produtos por Nome",
-        title_x=0.5,
-        title_font=dict(size=32, color="rgb(119,67,22)", family="Dancing Script, cursive"),
-        xaxis=dict(
-            tickangle=45,
-            title="Nome do Produto",
-            title_font=dict(size=20, color="#703c15", family="Dancing Script, cursive"),
-            tickfont=dict(size=20, color="#703c15", family="Dancing Script, cursive")
-        ),
-        yaxis=dict(
-            title="Quantidade",
-            title_font=dict(size=20, color="#703c15", family="Dancing Script, cursive"),
-            tickfont=dict(size=20, color="#703c15", family="Dancing Script, cursive")
-        ),
-        plot_bgcolor="#c8f3f5",
-        paper_bgcolor="#fd92c6",
-        showlegend=False,
-        images=[{
-            'source': '/static/images/kitty.webp',
-            'xref': 'paper',
-            'yref': 'paper',
-            'x': 0.3,
-            'y': 1,
-            'sizex': 1.0,
-            'sizey': 1.0,
-            'opacity': 0.5,
-            'layer': 'below'
-        }]
-    )
-
-    graph_html = fig.to_html(full_html=False)
-
-    return f"""
-    <html>
-    <head>
-        <link href="https://fonts.googleapis.com/css2?family=Dancing+Script&display=swap" rel="stylesheet">
-    </head>
-    <body>
-        {Markup(graph_html)}
-    </body>
-    </html>
-    """
 
 if __name__ == '__main__':
 
@@ -0,0 +1,80 @@
+import os
+import time
+from functools import wraps
+
+from flask import current_app, jsonify
+from flask_jwt_extended import JWTManager, get_jwt, get_jwt_identity, verify_jwt_in_request
+
+import credenciais
+import dao
+from dao.cache import AUSENTE, CacheLRU
+from dao.tokens import revogacoes
+
+# Tokens da API carregam o tipo do usuário e a versão de token dele, então a
+# autorização nas rotas /api/* não consulta o banco.
+
+_claims = CacheLRU(capacidade=10000)
+
+class GerenciadorJWT(JWTManager):
+    # Guarda as claims já verificadas de cada token até ele expirar; as próximas
+    # requisições com o mesmo token não refazem decodificação e assinatura.
+    # A revogação continua conferida a cada requisição (token_in_blocklist_loader).
+    # _decode_jwt_from_config é privado no flask_jwt_extended (nenhum loader
+    # público permite pular a decodificação), por isso a versão fica presa em
+    # 4.6.* no requeriments.txt; ao subir de versão, confira a assinatura dele.
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if csrf_value is not None or allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        claims = _claims.obter(encoded_token)
+        if claims is not AUSENTE:
+            return claims
+
+        claims = super()._decode_jwt_from_config(encoded_token)
+        restante = claims.get('exp', 0) - time.time()
+        if restante > 0:
+            _claims.definir(encoded_token, claims, ttl=restante)
+        return claims
+
+def init_app(app):
+    app.config.setdefault('CACHE_CLAIMS_MAX', int(os.environ.get('CACHE_CLAIMS_MAX', 10000)))
+    _claims.configurar(capacidade=app.config['CACHE_CLAIMS_MAX'])
+
+    credenciais.configurar(app.config)
+    jwt = GerenciadorJWT(app)
+
+    @jwt.token_in_blocklist_loader
+    def token_revogado(jwt_header, jwt_payload):
+        return credenciais.tokenRevogado(app.config, jwt_payload)
+
+    return jwt
+
+def criarToken(login):
+    claims = dao.buscarClaimsUsuario(login)
+    adicionais = {"tipouser": claims[0], "versao": claims[1]} if claims else {}
+    return credenciais.criarToken(current_app.config, login, adicionais)
+
+def tipoUsuarioToken():
+    # Tokens emitidos antes da claim tipouser caem no cache de perfis do dao.
+    tipo = get_jwt().get('tipouser')
+    return tipo if tipo is not None else dao.buscarTipoUsuario(get_jwt_identity())
+
+def papelRequerido(*tipos):
+    def decorador(rota):
+        @wraps(rota)
+        def verificar(*args, **kwargs):
+            verify_jwt_in_request()
+            if tipoUsuarioToken() not in tipos:
+                return jsonify({"erro": "Você não tem permissão para acessar este recurso."}), 403
+            return rota(*args, **kwargs)
+        return verificar
+    return decorador
+
+def revogarTokenAtual():
+    # False se a revogação não pôde ser gravada no banco (vale só neste processo).
+    claims = get_jwt()
+    return dao.revogarToken(claims['jti'], get_jwt_identity(), claims.get('exp', time.time()))
+
+def estatisticas():
+    return {"claims": _claims.estatisticas(), "revogacoes": revogacoes.estatisticas()}
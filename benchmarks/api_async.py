@@ -0,0 +1,91 @@
+"""Compara a API síncrona (app.py) com a assíncrona (api_async.py) sob carga.
+
+Suba as duas aplicações contra o mesmo banco, por exemplo:
+
+    gunicorn -w 4 --threads 8 -b 127.0.0.1:5000 app:app
+    hypercorn -w 1 -b 127.0.0.1:5001 api_async:app
+
+e rode:
+
+    python benchmarks/api_async.py --concorrencia 200 --requisicoes 5000
+
+O resultado (JSON) traz vazão e latências p50/p95/p99 de cada alvo.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from comum import Cliente, obterToken, percentil
+
+
+def medir(url, caminhos, token, concorrencia, requisicoes):
+    cliente = Cliente(url)
+    cabecalhos = {'Authorization': f'Bearer {token}'}
+    latencias = []
+    erros = 0
+    trava = threading.Lock()
+
+    def uma(indice):
+        nonlocal erros
+        caminho = caminhos[indice % len(caminhos)]
+        inicio = time.perf_counter()
+        try:
+            status, _, _ = cliente.requisitar('GET', caminho, cabecalhos=cabecalhos)
+            ok = status < 400
+        except Exception:
+            ok = False
+        duracao = time.perf_counter() - inicio
+        with trava:
+            if ok:
+                latencias.append(duracao)
+            else:
+                erros += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(uma, range(requisicoes)))
+    total = time.perf_counter() - inicio
+
+    return {
+        'url': url,
+        'concorrencia': concorrencia,
+        'requisicoes': requisicoes,
+        'erros': erros,
+        'duracao_s': round(total, 3),
+        'req_por_s': round(len(latencias) / total, 1) if total else None,
+        'latencia_ms': {
+            'media': round(statistics.mean(latencias) * 1000, 2) if latencias else None,
+            'p50': round(percentil(latencias, 50) * 1000, 2) if latencias else None,
+            'p95': round(percentil(latencias, 95) * 1000, 2) if latencias else None,
+            'p99': round(percentil(latencias, 99) * 1000, 2) if latencias else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sync-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--async-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--login', default='admin')
+    parser.add_argument('--senha', default='123')
+    parser.add_argument('--concorrencia', type=int, default=100)
+    parser.add_argument('--requisicoes', type=int, default=2000)
+    parser.add_argument('--aquecimento', type=int, default=100)
+    parser.add_argument('--produto-id', type=int, default=1)
+    args = parser.parse_args()
+
+    caminhos = ['/api/produtos?limite=20', f'/api/produtos/{args.produto_id}']
+    resultados = {}
+    for nome, url in (('sync', args.sync_url), ('async', args.async_url)):
+        token = obterToken(url, args.login, args.senha)
+        medir(url, caminhos, token, min(args.concorrencia, 10), args.aquecimento)
+        resultados[nome] = medir(url, caminhos, token, args.concorrencia, args.requisicoes)
+
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""Teste de carga repetível das rotas de app.py, com semeadura do banco.
+
+Semeia o Postgres configurado (DB_HOST, DB_NAME...) com usuários e produtos
+de teste (todos com o prefixo --prefixo, removidos e recriados a cada
+--semear), dispara as rotas escolhidas com a concorrência pedida e imprime
+vazão e latências p50/p95/p99 em JSON, junto com o commit atual, para comparar
+execuções:
+
+    python benchmarks/carga.py --semear --usuarios 200 --produtos 20000 \\
+        --concorrencia 16 --requisicoes 2000 --saida carga-antes.json
+    python benchmarks/carga.py --concorrencia 16 --requisicoes 2000 \\
+        --comparar carga-antes.json
+
+Sem --url a aplicação roda neste mesmo processo (servidor threaded do
+werkzeug), o que é cômodo mas divide a GIL com o gerador de carga; para
+números próximos de produção suba o app à parte e passe --url:
+
+    gunicorn -w 4 --threads 8 -b 127.0.0.1:5000 app:app
+    python benchmarks/carga.py --url http://127.0.0.1:5000
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import dao
+from dao import senhas
+from psycopg2.extras import execute_values
+
+from comum import Cliente, obterToken, percentil
+
+# nome -> (método, caminhos alternados entre as requisições, autenticação, corpo)
+CENARIOS = {
+    'login': ('POST', ['/api/login'], None, 'login'),
+    'api_produtos': ('GET', ['/api/produtos?limite=20', '/api/produtos?limite=20&busca={busca}',
+                             '/api/produtos?limite=20&ordem=nome'], 'token', None),
+    'api_produto': ('GET', ['/api/produtos/{id}'], 'token', None),
+    'listar_produtos': ('GET', ['/listarProdutos', '/listarProdutos?busca={busca}',
+                                '/listarProdutos?ordem=nome'], 'sessao', None),
+    'grafico': ('GET', ['/grafico'], 'sessao', None),
+}
+
+
+def semear(prefixo, usuarios, produtos, senha, semente):
+    # Usuários: <prefixo>_admin (super) e <prefixo>_0001... (normal), todos com
+    # a mesma senha. Produtos distribuídos entre os normais até o limite de cada
+    # um e o restante para o admin.
+    aleatorio = random.Random(semente)
+    armazenada = senhas.gerarHash(senha)
+    admin = f'{prefixo}_admin'
+    normais = [f'{prefixo}_{i:04d}' for i in range(1, usuarios + 1)]
+
+    inicio = time.perf_counter()
+    with dao.transacao() as conn:
+        cursor = conn.cursor()
+        padrao = f'{prefixo}\\_%'
+        cursor.execute('DELETE FROM produtos WHERE loginuser LIKE %s RETURNING id', (padrao,))
+        removidos = [linha[0] for linha in cursor.fetchall()]
+        cursor.execute('DELETE FROM usuario WHERE loginuser LIKE %s', (padrao,))
+        execute_values(cursor, 'INSERT INTO usuario (loginuser, senha, tipouser) VALUES %s',
+                       [(admin, armazenada, 'super')] + [(login, armazenada, 'normal') for login in normais])
+
+        vagas = len(normais) * dao.LIMITE_PRODUTOS_NORMAL
+        dados = io.StringIO()
+        escritor = csv.writer(dados)
+        for i in range(produtos):
+            dono = normais[i % len(normais)] if i < vagas else admin
+            escritor.writerow((f'{prefixo} produto {i:06d}', dono, aleatorio.randint(0, 500),
+                               Decimal(aleatorio.randint(100, 100000)) / 100))
+        dados.seek(0)
+        cursor.copy_expert('COPY produtos (nome, loginuser, qtde, preco) FROM STDIN WITH (FORMAT csv)', dados)
+        cursor.execute('SELECT id FROM produtos WHERE loginuser LIKE %s ORDER BY id', (padrao,))
+        novos = [linha[0] for linha in cursor.fetchall()]
+        # Caches, ETags e clientes do feed de alterações passam a ver os dados novos.
+        dao._incrementarVersaoProdutos(cursor, alterados=novos, excluidos=removidos)
+        cursor.execute('ANALYZE produtos')
+        cursor.close()
+
+    return {
+        'usuarios': len(normais) + 1,
+        'produtos': produtos,
+        'ids': [novos[0], novos[-1]] if novos else [None, None],
+        'segundos': round(time.perf_counter() - inicio, 3),
+    }
+
+
+def dadosSemeados(prefixo):
+    # Faixa de ids e quantidade de usuários normais de uma semeadura anterior.
+    padrao = f'{prefixo}\\_%'
+    with dao.transacao() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT min(id), max(id) FROM produtos WHERE loginuser LIKE %s', (padrao,))
+        ids = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) FROM usuario WHERE loginuser LIKE %s AND tipouser = 'normal'", (padrao,))
+        usuarios = cursor.fetchone()[0]
+        cursor.close()
+    if ids[0] is None or not usuarios:
+        raise SystemExit(f'Nenhum dado com o prefixo {prefixo!r}; rode com --semear.')
+    return list(ids), usuarios
+
+
+def obterCookieSessao(url, login, senha):
+    status, _, cabecalhos = Cliente(url).requisitar('POST', '/', formulario={'login': login, 'senha': senha})
+    for valor in cabecalhos.get_all('Set-Cookie') or ():
+        if status == 302 and valor.startswith('session='):
+            return valor.split(';', 1)[0]
+    raise SystemExit(f'Falha no login da sessão: {status}')
+
+
+def medir(url, nome, credenciais, senha, prefixo, usuarios, ids, concorrencia, requisicoes, semente):
+    metodo, caminhos, autenticacao, corpo = CENARIOS[nome]
+    cliente = Cliente(url, credenciais['sessao'] if autenticacao == 'sessao' else None)
+    cabecalhos = {}
+    if autenticacao == 'token':
+        cabecalhos['Authorization'] = f"Bearer {credenciais['token']}"
+    aleatorio = random.Random(semente)
+    # Sorteados antes, para que todas as execuções façam as mesmas requisições.
+    plano = []
+    for indice in range(requisicoes):
+        caminho = caminhos[indice % len(caminhos)].format(
+            id=aleatorio.randint(ids[0], ids[1]), busca=f'{prefixo} produto {aleatorio.randint(0, 99):02d}')
+        plano.append(caminho.replace(' ', '+'))
+    logins = [f'{prefixo}_{aleatorio.randint(1, usuarios):04d}' for _ in range(requisicoes)]
+
+    latencias = []
+    status = {}
+    trava = threading.Lock()
+
+    def uma(indice):
+        dados = {'login': logins[indice], 'senha': senha} if corpo == 'login' else None
+        inicio = time.perf_counter()
+        try:
+            codigo, _, _ = cliente.requisitar(metodo, plano[indice], dados, cabecalhos=cabecalhos)
+        except Exception:
+            codigo = 'erro'
+        duracao = time.perf_counter() - inicio
+        with trava:
+            status[codigo] = status.get(codigo, 0) + 1
+            if codigo != 'erro' and codigo < 400:
+                latencias.append(duracao)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(uma, range(requisicoes)))
+    total = time.perf_counter() - inicio
+
+    return {
+        'concorrencia': concorrencia,
+        'requisicoes': requisicoes,
+        'status': {str(codigo): quantidade for codigo, quantidade in sorted(status.items(), key=str)},
+        'erros': requisicoes - len(latencias),
+        'duracao_s': round(total, 3),
+        'req_por_s': round(len(latencias) / total, 1) if total else None,
+        'latencia_ms': {
+            'media': round(statistics.mean(latencias) * 1000, 2) if latencias else None,
+            'p50': round(percentil(latencias, 50) * 1000, 2) if latencias else None,
+            'p95': round(percentil(latencias, 95) * 1000, 2) if latencias else None,
+            'p99': round(percentil(latencias, 99) * 1000, 2) if latencias else None,
+        },
+    }
+
+
+def comparar(atual, anterior):
+    # Variação percentual em relação a uma execução anterior (positivo = maior).
+    variacoes = {}
+    for nome, resultado in atual.items():
+        base = anterior.get(nome)
+        if not base:
+            continue
+        pares = [('req_por_s', resultado['req_por_s'], base['req_por_s'])]
+        pares += [(p, resultado['latencia_ms'][p], base['latencia_ms'][p]) for p in ('p50', 'p95', 'p99')]
+        variacoes[nome] = {
+            chave: round((novo - velho) / velho * 100, 1) if novo is not None and velho else None
+            for chave, novo, velho in pares
+        }
+    return variacoes
+
+
+def commitAtual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def servirLocalmente():
+    from werkzeug.serving import make_server
+
+    from app import app
+    # O log de cada requisição no terminal pesaria na medição.
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='aplicação já em execução; sem ela, sobe app.py neste processo')
+    parser.add_argument('--semear', action='store_true', help='recria os usuários e produtos de teste')
+    parser.add_argument('--prefixo', default='carga')
+    parser.add_argument('--usuarios', type=int, default=100)
+    parser.add_argument('--produtos', type=int, default=10000)
+    parser.add_argument('--senha', default='carga123')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--cenarios', nargs='+', choices=sorted(CENARIOS), default=sorted(CENARIOS))
+    parser.add_argument('--concorrencia', type=int, default=16)
+    parser.add_argument('--requisicoes', type=int, default=1000)
+    parser.add_argument('--aquecimento', type=int, default=50)
+    parser.add_argument('--saida', help='também grava o resultado neste arquivo')
+    parser.add_argument('--comparar', help='resultado anterior (JSON) para calcular as variações')
+    args = parser.parse_args()
+
+    resultado = {
+        'commit': commitAtual(),
+        'python': platform.python_version(),
+        'parametros': {chave: valor for chave, valor in vars(args).items() if chave not in ('saida', 'comparar')},
+    }
+    if args.semear:
+        resultado['semeadura'] = semear(args.prefixo, args.usuarios, args.produtos, args.senha, args.semente)
+        ids, usuarios = resultado['semeadura']['ids'], args.usuarios
+    else:
+        ids, usuarios = dadosSemeados(args.prefixo)
+
+    servidor = None
+    url = args.url
+    if url is None:
+        servidor, url = servirLocalmente()
+    resultado['url'] = url
+
+    admin = f'{args.prefixo}_admin'
+    try:
+        credenciais = {
+            'token': obterToken(url, admin, args.senha),
+            'sessao': obterCookieSessao(url, admin, args.senha),
+        }
+        resultado['cenarios'] = {}
+        for nome in args.cenarios:
+            comuns = (credenciais, args.senha, args.prefixo, usuarios, ids)
+            medir(url, nome, *comuns, min(args.concorrencia, 4), args.aquecimento, args.semente)
+            resultado['cenarios'][nome] = medir(url, nome, *comuns, args.concorrencia, args.requisicoes, args.semente)
+    finally:
+        if servidor is not None:
+            servidor.shutdown()
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            anterior = json.load(arquivo)
+        resultado['comparado_com'] = anterior.get('commit')
+        resultado['variacao_pct'] = comparar(resultado['cenarios'], anterior.get('cenarios', {}))
+
+    texto = json.dumps(resultado, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto + '\n')
+    print(texto)
+
+
+if __name__ == '__main__':
+    main()
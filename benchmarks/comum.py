@@ -0,0 +1,61 @@
+"""Partes comuns aos benchmarks: percentis e o cliente HTTP keep-alive."""
+import http.client
+import json
+import threading
+from urllib.parse import urlencode, urlsplit
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+class Cliente:
+    # Uma conexão keep-alive por thread; o cookie de sessão (assinado, sem estado
+    # no servidor) é o mesmo para todas.
+
+    def __init__(self, url, cookie=None):
+        partes = urlsplit(url)
+        self.host = partes.hostname
+        self.porta = partes.port or 80
+        self.cookie = cookie
+        self.local = threading.local()
+
+    def _conexao(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.porta, timeout=60)
+            self.local.conn = conn
+        return conn
+
+    def requisitar(self, metodo, caminho, corpo=None, formulario=None, cabecalhos=None):
+        cabecalhos = dict(cabecalhos or {})
+        dados = None
+        if corpo is not None:
+            dados = json.dumps(corpo).encode()
+            cabecalhos['Content-Type'] = 'application/json'
+        elif formulario is not None:
+            dados = urlencode(formulario).encode()
+            cabecalhos['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            cabecalhos['Cookie'] = self.cookie
+        conn = self._conexao()
+        try:
+            conn.request(metodo, caminho, body=dados, headers=cabecalhos)
+            resposta = conn.getresponse()
+            conteudo = resposta.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self.local.conn = None
+            raise
+        return resposta.status, conteudo, resposta.msg
+
+
+def obterToken(url, login, senha):
+    status, corpo, _ = Cliente(url).requisitar('POST', '/api/login', {'login': login, 'senha': senha})
+    if status != 200:
+        raise SystemExit(f'Falha no login em {url}: {status} {corpo!r}')
+    return json.loads(corpo)['access_token']
@@ -0,0 +1,103 @@
+"""Mede a latência por consulta de buscarUsuarioPorLogin/buscarProdutoPorId com e sem PREPARE.
+
+Roda as duas funções do dao contra o Postgres configurado (DB_HOST, DB_NAME...)
+com DB_PREPARAR=0 (texto enviado, parse e plano a cada chamada) e
+DB_PREPARAR=1 (EXECUTE das consultas de dao.consultas), alternando os modos a
+cada rodada para diluir variações do servidor. Todas as chamadas de uma rodada
+usam a mesma conexão (dentro de dao.transacao), então o número medido é só o
+da consulta. buscarProdutoPorId é medido sem o cache de produtos.
+
+    python benchmarks/consultas.py --repeticoes 5000 --rodadas 3
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import dao
+
+
+MODOS = {'texto': '0', 'preparada': '1'}
+
+
+def alvos(login, produto_id):
+    return {
+        'buscarUsuarioPorLogin': lambda: dao.buscarUsuarioPorLogin(login),
+        'buscarProdutoPorId': lambda: dao._buscarProdutoPorIdNoBanco(produto_id),
+    }
+
+
+def medir(funcao, repeticoes, aquecimento):
+    for _ in range(aquecimento):
+        funcao()
+    amostras = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        amostras.append(time.perf_counter() - inicio)
+    return amostras
+
+
+def resumo(amostras):
+    ordenadas = sorted(amostras)
+    return {
+        'media_us': round(statistics.fmean(ordenadas) * 1e6, 1),
+        'p50_us': round(ordenadas[len(ordenadas) // 2] * 1e6, 1),
+        'p95_us': round(ordenadas[int(len(ordenadas) * 0.95)] * 1e6, 1),
+        'amostras': len(ordenadas),
+    }
+
+
+def escolherDados(login, produto_id):
+    with dao.transacao():
+        with dao._cursor() as cursor:
+            if login is None:
+                cursor.execute('SELECT loginuser FROM usuario ORDER BY loginuser LIMIT 1')
+                login = cursor.fetchone()[0]
+            if produto_id is None:
+                cursor.execute('SELECT id FROM produtos ORDER BY id LIMIT 1')
+                produto_id = cursor.fetchone()[0]
+    return login, produto_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=2000, help='Chamadas medidas por função, modo e rodada.')
+    parser.add_argument('--aquecimento', type=int, default=200)
+    parser.add_argument('--rodadas', type=int, default=3)
+    parser.add_argument('--login', help='Login buscado (padrão: o primeiro da tabela).')
+    parser.add_argument('--produto', type=int, help='Id buscado (padrão: o menor da tabela).')
+    args = parser.parse_args()
+
+    config = {'DB_POOL_MIN': '1', 'DB_POOL_MAX': '1'}
+    dao.configurarPool(config)
+    login, produto_id = escolherDados(args.login, args.produto)
+
+    amostras = {modo: {nome: [] for nome in alvos(login, produto_id)} for modo in MODOS}
+    for _ in range(args.rodadas):
+        for modo, preparar in MODOS.items():
+            dao.configurarPool(dict(config, DB_PREPARAR=preparar))
+            with dao.transacao():
+                for nome, funcao in alvos(login, produto_id).items():
+                    amostras[modo][nome] += medir(funcao, args.repeticoes, args.aquecimento)
+
+    resultados = {'login': login, 'produto_id': produto_id, 'rodadas': args.rodadas, 'funcoes': {}}
+    for nome in alvos(login, produto_id):
+        texto = resumo(amostras['texto'][nome])
+        preparada = resumo(amostras['preparada'][nome])
+        resultados['funcoes'][nome] = {
+            'texto': texto,
+            'preparada': preparada,
+            'economia_media_us': round(texto['media_us'] - preparada['media_us'], 1),
+            'economia_p50_us': round(texto['p50_us'] - preparada['p50_us'], 1),
+        }
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Mede o tempo de importação de app.py e a memória residente do processo.
+
+Cada medição roda em um processo novo, então o cache de imports não interfere.
+Com --max-segundos/--max-rss-mb o script sai com código 1 se algum limite for
+ultrapassado, e sempre falha se pandas, numpy ou plotly forem importados na
+inicialização (devem ser carregados só quando usados).
+
+    python benchmarks/inicializacao.py --repeticoes 5 --max-rss-mb 120
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PESADOS = ('pandas', 'numpy', 'plotly')
+
+MEDICAO = r"""
+import json, resource, sys, time
+inicio = time.perf_counter()
+import app
+duracao = time.perf_counter() - inicio
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'segundos': duracao,
+    'rss_mb': rss_kb / 1024,
+    'pesados': sorted(m for m in %r if m in sys.modules),
+}))
+"""
+
+
+def medirUma(ambiente):
+    saida = subprocess.run(
+        [sys.executable, '-c', MEDICAO % (PESADOS,)],
+        cwd=RAIZ, env=ambiente, capture_output=True, text=True, check=True
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--max-segundos', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    parser.add_argument('--sem-grafico', action='store_true', help='mede com GRAFICO_HABILITADO=0')
+    args = parser.parse_args()
+
+    ambiente = dict(os.environ)
+    if args.sem_grafico:
+        ambiente['GRAFICO_HABILITADO'] = '0'
+
+    medicoes = [medirUma(ambiente) for _ in range(args.repeticoes)]
+    segundos = [m['segundos'] for m in medicoes]
+    rss = [m['rss_mb'] for m in medicoes]
+    pesados = sorted({p for m in medicoes for p in m['pesados']})
+
+    resultado = {
+        'repeticoes': args.repeticoes,
+        'import_segundos': {
+            'mediana': round(statistics.median(segundos), 4),
+            'min': round(min(segundos), 4),
+            'max': round(max(segundos), 4),
+        },
+        'rss_mb': {
+            'mediana': round(statistics.median(rss), 1),
+            'max': round(max(rss), 1),
+        },
+        'modulos_pesados_importados': pesados,
+    }
+    print(json.dumps(resultado, indent=2))
+
+    falhas = []
+    if pesados:
+        falhas.append(f'módulos pesados importados na inicialização: {", ".join(pesados)}')
+    if args.max_segundos is not None and resultado['import_segundos']['mediana'] > args.max_segundos:
+        falhas.append(f'importação levou {resultado["import_segundos"]["mediana"]}s (limite {args.max_segundos}s)')
+    if args.max_rss_mb is not None and resultado['rss_mb']['max'] > args.max_rss_mb:
+        falhas.append(f'RSS de {resultado["rss_mb"]["max"]} MB (limite {args.max_rss_mb} MB)')
+    for falha in falhas:
+        print(f'REGRESSÃO: {falha}', file=sys.stderr)
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == '__main__':
+    main()
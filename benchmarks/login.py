@@ -0,0 +1,95 @@
+"""Mede logins por segundo e latência da verificação de senha sob concorrência.
+
+Cada login é a verificação feita por dao.verificarLogin (dao.senhas.conferir)
+passando pelo VerificadorSenhas, com o mesmo limite de fila da aplicação. Roda
+sem banco, para escolher SENHA_METODO e SENHA_TRABALHADORES a partir do
+orçamento de latência:
+
+    python benchmarks/login.py --metodos scrypt:32768:8:1 scrypt:16384:8:1 \\
+        --trabalhadores 2 4 --concorrencia 32 --logins 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from dao import senhas
+
+from comum import percentil
+
+
+def medir(metodo, trabalhadores, fila_maxima, espera_maxima, concorrencia, logins):
+    senhas.configurar({
+        'SENHA_METODO': metodo,
+        'SENHA_TRABALHADORES': trabalhadores,
+        'SENHA_FILA_MAX': fila_maxima,
+        'SENHA_ESPERA_MAX': espera_maxima,
+    })
+    armazenada = senhas.gerarHash('senha-de-teste')
+    senhas.verificarSenha(armazenada, 'senha-de-teste')
+
+    latencias = []
+    recusados = 0
+    trava = threading.Lock()
+
+    def um(_):
+        nonlocal recusados
+        inicio = time.perf_counter()
+        try:
+            confere, _ = senhas.verificarSenha(armazenada, 'senha-de-teste')
+            assert confere
+        except senhas.SenhasSobrecarregadas:
+            with trava:
+                recusados += 1
+            return
+        with trava:
+            latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(um, range(logins)))
+    total = time.perf_counter() - inicio
+
+    return {
+        'metodo': metodo,
+        'trabalhadores': trabalhadores,
+        'concorrencia': concorrencia,
+        'logins': logins,
+        'recusados': recusados,
+        'logins_por_s': round(len(latencias) / total, 1) if total else None,
+        'latencia_ms': {
+            'media': round(statistics.mean(latencias) * 1000, 1) if latencias else None,
+            'p50': round(percentil(latencias, 50) * 1000, 1) if latencias else None,
+            'p95': round(percentil(latencias, 95) * 1000, 1) if latencias else None,
+            'p99': round(percentil(latencias, 99) * 1000, 1) if latencias else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--metodos', nargs='+', default=['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000'])
+    parser.add_argument('--trabalhadores', type=int, nargs='+', default=[os.cpu_count() or 1])
+    parser.add_argument('--fila-max', type=int, default=64)
+    parser.add_argument('--espera-max', type=float, default=5.0)
+    parser.add_argument('--concorrencia', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=100)
+    args = parser.parse_args()
+
+    resultados = [
+        medir(metodo, trabalhadores, args.fila_max, args.espera_max, args.concorrencia, args.logins)
+        for metodo in args.metodos
+        for trabalhadores in args.trabalhadores
+    ]
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Mede a renderização da tabela de listarProdutos, em ms por 1k linhas.
+
+Compara o laço antigo (url_for por linha em cada link), o template
+tabelaProdutos.html com prefixos de URL pré-calculados e um acerto no cache de
+fragmentos. Mede também o carregamento dos templates sem cache e com o cache de
+bytecode do Jinja. Importa app.py, então precisa do banco configurado.
+
+    python benchmarks/renderizacao.py --linhas 1000 --repeticoes 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from flask import render_template
+from jinja2 import FileSystemBytecodeCache
+
+import renderizacao
+from app import app
+
+LACO_ANTIGO = """
+{% for produto in produtos %}
+                    <tr>
+                        <td class="product-name">{{ produto[1] }}</td>
+                        <td>{{ produto[3] }}</td>
+                        <td>R$ {{ produto[4] }}</td>
+                        <td>
+                            <a href="{{ url_for('detalhes_produto', id=produto[0]) }}" title="Detalhes"><i class="fas fa-info-circle"></i></a>
+                            <a href="{{ url_for('editar_produto', id=produto[0]) }}" title="Editar"><i class="fas fa-edit"></i></a>
+                            <a href="{{ url_for('excluir_produto', id=produto[0]) }}" class="delete-link" title="Excluir"><i class="fas fa-trash"></i></a>
+                        </td>
+                    </tr>
+{% endfor %}
+"""
+
+
+def cronometrar(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos)
+
+
+def carregarTemplates(bytecode_cache):
+    # Ambiente novo a cada chamada, como em um worker recém-iniciado.
+    ambiente = app.create_jinja_environment()
+    ambiente.bytecode_cache = bytecode_cache
+    for nome in ambiente.list_templates(extensions=['html']):
+        ambiente.get_template(nome)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--linhas', type=int, default=1000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    produtos = [
+        (i, f'produto {i}', 'admin', i % 1000, Decimal(f'{i % 10000}.{i % 100:02d}'))
+        for i in range(1, args.linhas + 1)
+    ]
+    por_mil = 1000 / args.linhas
+
+    with app.test_request_context('/listarProdutos'):
+        laco_antigo = app.jinja_env.from_string(LACO_ANTIGO)
+
+        def com_url_for():
+            return laco_antigo.render(produtos=produtos)
+
+        def com_prefixos():
+            return render_template('tabelaProdutos.html', produtos=produtos,
+                                   url_detalhes=renderizacao.prefixoUrl('detalhes_produto'),
+                                   url_editar=renderizacao.prefixoUrl('editar_produto'),
+                                   url_excluir=renderizacao.prefixoUrl('excluir_produto'))
+
+        if com_url_for().split() != com_prefixos().split():
+            raise SystemExit('Os dois templates não geram o mesmo HTML')
+
+        chave = ('benchmark', args.linhas)
+        renderizacao.fragmento(chave, com_prefixos)
+
+        resultados = {
+            'linhas': args.linhas,
+            'ms_por_1k_linhas': {
+                'url_for_por_linha': round(cronometrar(com_url_for, args.repeticoes) * 1000 * por_mil, 3),
+                'prefixos': round(cronometrar(com_prefixos, args.repeticoes) * 1000 * por_mil, 3),
+                'fragmento_em_cache': round(cronometrar(
+                    lambda: renderizacao.fragmento(chave, com_prefixos), args.repeticoes) * 1000 * por_mil, 3),
+            },
+        }
+
+    with tempfile.TemporaryDirectory() as pasta:
+        cache = FileSystemBytecodeCache(pasta)
+        carregarTemplates(cache)
+        resultados['carregamento_templates_ms'] = {
+            'sem_cache': round(cronometrar(lambda: carregarTemplates(None), args.repeticoes) * 1000, 2),
+            'bytecode_cache': round(cronometrar(lambda: carregarTemplates(cache), args.repeticoes) * 1000, 2),
+        }
+
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Mede a serialização do payload de listar_produtos_api com 1k/10k/100k linhas.
+
+Compara o provider JSON padrão do Flask com o ProvedorJSONRapido (orjson) e
+mostra o custo e o tamanho da compressão gzip/brotli do corpo gerado. Não
+precisa de banco: as linhas são sintéticas, no formato devolvido pelo psycopg2.
+
+    python benchmarks/serializacao.py --linhas 1000 10000 100000 --repeticoes 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import respostas
+
+
+def gerarLinhas(quantidade):
+    return [
+        (i, f'produto {i}', f'usuario{i % 50}', i % 1000, Decimal(f'{i % 10000}.{i % 100:02d}'))
+        for i in range(1, quantidade + 1)
+    ]
+
+
+def payload(linhas):
+    # Mesmo corpo montado por listar_produtos_api.
+    return {
+        "produtos": [
+            {"id": p[0], "nome": p[1], "loginuser": p[2], "qtde": p[3], "preco": p[4]}
+            for p in linhas
+        ],
+        "next_cursor": "eyJpZCI6IDEwMDB9",
+        "prev_cursor": None,
+    }
+
+
+def cronometrar(funcao, repeticoes):
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return round(statistics.median(tempos) * 1000, 2), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--linhas', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    provedores = {'padrao': DefaultJSONProvider(app)}
+    if respostas.orjson is not None:
+        provedores['orjson'] = respostas.ProvedorJSONRapido(app)
+    config = {'COMPRESSAO_NIVEL_GZIP': 6, 'COMPRESSAO_NIVEL_BROTLI': 4}
+    codificacoes = ['gzip'] + (['br'] if respostas.brotli is not None else [])
+
+    resultados = []
+    with app.app_context():
+        for quantidade in args.linhas:
+            dados = payload(gerarLinhas(quantidade))
+            item = {'linhas': quantidade, 'serializacao_ms': {}, 'compressao': {}}
+            corpo = None
+            for nome, provedor in provedores.items():
+                ms, resposta = cronometrar(lambda: provedor.response(dados), args.repeticoes)
+                item['serializacao_ms'][nome] = ms
+                corpo = resposta.get_data()
+                item['bytes'] = len(corpo)
+            for codificacao in codificacoes:
+                ms, comprimido = cronometrar(
+                    lambda: respostas._comprimir(corpo, codificacao, config), args.repeticoes
+                )
+                item['compressao'][codificacao] = {'ms': ms, 'bytes': len(comprimido)}
+            if 'orjson' in item['serializacao_ms'] and item['serializacao_ms']['orjson']:
+                item['ganho_orjson'] = round(item['serializacao_ms']['padrao'] / item['serializacao_ms']['orjson'], 1)
+            resultados.append(item)
+
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import jwt
+
+from dao.tokens import revogacoes
+
+# Formato, configuração e verificação dos tokens JWT da API, num lugar só para
+# as duas aplicações: app.py emite com criarToken e verifica pelo
+# flask_jwt_extended (que lê as mesmas chaves de configuração); api_async.py
+# emite e verifica só por aqui. As claims seguem o layout do
+# flask_jwt_extended (sub, type, fresh, jti...), então um token vale nas duas.
+
+CONFIGURACAO_PADRAO = {
+    'JWT_ALGORITHM': 'HS256',
+    'JWT_ACCESS_TOKEN_EXPIRES': timedelta(minutes=15),
+    'JWT_IDENTITY_CLAIM': 'sub',
+    'JWT_DECODE_LEEWAY': 0,
+}
+
+
+class TokenInvalido(Exception):
+    # status e mensagem iguais aos das respostas do flask_jwt_extended.
+
+    def __init__(self, mensagem, status=422):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def configurar(config):
+    # Antes do JWTManager: os valores daqui prevalecem sobre os padrões dele.
+    for chave, valor in CONFIGURACAO_PADRAO.items():
+        config.setdefault(chave, valor)
+
+def identidade(config, claims):
+    return claims.get(config['JWT_IDENTITY_CLAIM'])
+
+def criarToken(config, login, adicionais=None):
+    agora = datetime.now(timezone.utc)
+    claims = dict(adicionais or {})
+    claims.update({
+        'fresh': False,
+        'iat': agora,
+        'jti': str(uuid.uuid4()),
+        'type': 'access',
+        config['JWT_IDENTITY_CLAIM']: login,
+        'nbf': agora,
+        'exp': agora + config['JWT_ACCESS_TOKEN_EXPIRES'],
+    })
+    return jwt.encode(claims, config['JWT_SECRET_KEY'], algorithm=config['JWT_ALGORITHM'])
+
+def tokenRevogado(config, claims):
+    return revogacoes.tokenRevogado(claims, identidade(config, claims))
+
+def verificarToken(config, token):
+    # Claims do token de acesso; levanta TokenInvalido.
+    try:
+        claims = jwt.decode(token, config['JWT_SECRET_KEY'], algorithms=[config['JWT_ALGORITHM']],
+                            leeway=config['JWT_DECODE_LEEWAY'])
+    except jwt.ExpiredSignatureError:
+        raise TokenInvalido("Token has expired", 401)
+    except jwt.InvalidTokenError as ex:
+        raise TokenInvalido(str(ex))
+    if claims.get('type') != 'access':
+        raise TokenInvalido("Only non-refresh tokens are allowed")
+    if tokenRevogado(config, claims):
+        raise TokenInvalido("Token has been revoked", 401)
+    return claims
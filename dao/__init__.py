@@ -1,226 +1,1098 @@
-import psycopg2
-from psycopg2 import pool
+import base64
+import csv
+import io
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation
 
+from psycopg2.extras import execute_values
+from flask import g, has_app_context
 
-db_pool = psycopg2.pool.SimpleConnectionPool(
-    1,
-    10,
-    host='localhost',
-    database='atvd1bcc',
-    user='postgres',
-    password='12345678'
-)
+from dao import consultas, metricas, migracoes, notificacoes, senhas
+from dao.cache import AUSENTE, CacheLRU
+from dao.consultas import COLUNAS_PRODUTO, COLUNAS_USUARIO
+from dao.notificacoes import CANAL_PRODUTOS, AssinaturasEsgotadas
+from dao.pool import PoolConexoes, lerConfiguracao
+from dao.senhas import SenhasSobrecarregadas
+from dao.tokens import revogacoes
+
+
+db_pool = None
+_pool_lock = threading.Lock()
+
+def _criarPool(config=None):
+    opcoes = lerConfiguracao(config)
+    if opcoes.pop('preparar'):
+        opcoes.update(connection_factory=consultas.ConexaoPreparada, ao_conectar=consultas.preparar)
+    return PoolConexoes(**opcoes, cursor_factory=metricas.CursorMedido)
+
+def configurarPool(config=None):
+    global db_pool
+    with _pool_lock:
+        antigo = db_pool
+        db_pool = _criarPool(config)
+    if antigo is not None:
+        antigo.closeall()
+    return db_pool
+
+def obterPool():
+    global db_pool
+    if db_pool is None:
+        with _pool_lock:
+            if db_pool is None:
+                db_pool = _criarPool()
+    return db_pool
+
+def estatisticasPool():
+    return obterPool().estatisticas()
+
+def estatisticasSenhas():
+    return senhas.estatisticas()
 
 def get_connection():
-    return db_pool.getconn()
+    return obterPool().getconn()
 
 def put_connection(conn):
-    db_pool.putconn(conn)
+    obterPool().putconn(conn)
+
+class TransacaoAbortada(Exception):
+    pass
+
+_local = threading.local()
+
+def _contexto():
+    # Dentro de uma requisição o estado fica em flask.g; fora dela, na thread atual.
+    return g if has_app_context() else _local
+
+@contextmanager
+def conexao():
+    contexto = _contexto()
+    conn = getattr(contexto, 'db_conn', None)
+    if conn is not None:
+        yield conn
+        return
 
-def verificarLogin(login, senha):
     conn = get_connection()
+    if contexto is g:
+        # Devolvida ao pool por fecharConexao, no teardown da requisição.
+        g.db_conn = conn
+        yield conn
+        return
+
     try:
+        yield conn
+    finally:
+        put_connection(conn)
+
+def emTransacao():
+    return getattr(_contexto(), 'db_transacao', 0) > 0
+
+@contextmanager
+def transacao():
+    contexto = _contexto()
+    if emTransacao():
+        contexto.db_transacao += 1
+        try:
+            yield contexto.db_conn
+        finally:
+            contexto.db_transacao -= 1
+        return
+
+    with conexao() as conn:
+        contexto.db_conn = conn
+        contexto.db_transacao = 1
+        contexto.db_falhou = False
+        contexto.db_apos_commit = []
+        try:
+            yield conn
+            if contexto.db_falhou:
+                raise TransacaoAbortada("Uma operação falhou dentro da transação.")
+            conn.commit()
+            for funcao in contexto.db_apos_commit:
+                funcao()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            contexto.db_transacao = 0
+            contexto.db_apos_commit = []
+            contexto.db_produtos_pendentes = False
+            if contexto is _local:
+                contexto.db_conn = None
+
+@contextmanager
+def _cursor():
+    with conexao() as conn:
         cursor = conn.cursor()
-        query = 'SELECT * FROM usuario WHERE loginuser = %s AND senha = %s'
-        cursor.execute(query, (login, senha))
-        usuario = cursor.fetchone()
-        return usuario is not None
+        try:
+            yield cursor
+        except Exception:
+            if emTransacao():
+                _contexto().db_falhou = True
+            else:
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+def _confirmar(cursor):
+    # Dentro de transacao() o commit acontece uma única vez, ao final do bloco.
+    if not emTransacao():
+        cursor.connection.commit()
+
+def _aoConfirmar(funcao):
+    # Fora de transacao() o commit já aconteceu; dentro, funcao roda após o commit final.
+    if emTransacao():
+        _contexto().db_apos_commit.append(funcao)
+    else:
+        funcao()
+
+# Contador de alterações da tabela produtos, guardado no próprio banco para
+# valer entre processos. As funções de escrita o incrementam na mesma transação
+# da alteração; ETags e caches derivados usam o par (versao, atualizado_em).
+# produtos_alteracoes guarda a última versão em que cada id mudou (ou foi
+# excluído), para as consultas incrementais (?since=), e cada alteração é
+# publicada com NOTIFY no canal CANAL_PRODUTOS. As tabelas vêm da migração 4
+# (dao.migracoes).
+SQL_INCREMENTAR_VERSAO = """
+    UPDATE produtos_versao SET versao = versao + 1, atualizado_em = clock_timestamp() WHERE id = 1
+    RETURNING versao
+"""
+
+SQL_REGISTRAR_ALTERACOES = """
+    INSERT INTO produtos_alteracoes (id, versao, excluido)
+    SELECT id, %s::bigint, excluido FROM unnest(%s::integer[], %s::boolean[]) AS a (id, excluido)
+    ON CONFLICT (id) DO UPDATE SET versao = EXCLUDED.versao, excluido = EXCLUDED.excluido
+"""
+
+# O payload de NOTIFY tem limite de 8000 bytes; acima disso o evento vai sem os
+# ids ("parcial") e o cliente busca o delta com ?since=. Os nomes (anteriores e
+# novos) servem ao cache de produtos de cada processo; sem eles ("nomes": null)
+# o cache é limpo inteiro.
+MAX_IDS_NOTIFICACAO = 500
+MAX_BYTES_NOTIFICACAO = 7500
+MAX_ALTERACOES_DELTA = 1000
+
+class AlteracoesIndisponiveis(Exception):
+    pass
+
+def eventoProdutos(versao, alterados=(), excluidos=(), nomes=None):
+    alterados, excluidos = sorted(set(alterados)), sorted(set(excluidos))
+    parcial = len(alterados) + len(excluidos) > MAX_IDS_NOTIFICACAO
+    evento = {
+        "versao": versao,
+        "alterados": [] if parcial else alterados,
+        "excluidos": [] if parcial else excluidos,
+        "parcial": parcial,
+        "nomes": None if parcial or nomes is None else sorted(set(nomes)),
+    }
+    if evento["nomes"] and len(json.dumps(evento).encode()) > MAX_BYTES_NOTIFICACAO:
+        evento["nomes"] = None
+    return evento
+
+def versaoProdutos():
+    try:
+        with _cursor() as cursor:
+            consultas.executar(cursor, 'versao_produtos')
+            return cursor.fetchone()
+    except Exception as ex:
+        print(f"Erro ao buscar versão dos produtos: {ex}")
+        return None
+
+SQL_ALTERACOES_DESDE = """
+    SELECT a.id, a.excluido, p.id, p.nome, p.loginuser, p.qtde, p.preco
+    FROM produtos_alteracoes a
+    LEFT JOIN produtos p ON p.id = a.id AND NOT a.excluido
+    WHERE a.versao > %s AND a.versao <= %s
+    ORDER BY a.versao, a.id
+    LIMIT %s
+"""
+
+def _montarAlteracoes(estado, desde, linhas):
+    versao, alteracoes_desde = estado
+    if desde < (alteracoes_desde or 0) or desde > versao:
+        raise AlteracoesIndisponiveis(f"Versão {desde} fora do intervalo disponível; refaça a listagem completa.")
+    if len(linhas) > MAX_ALTERACOES_DELTA:
+        raise AlteracoesIndisponiveis(f"Alterações demais desde a versão {desde}; refaça a listagem completa.")
+    alterados = [tuple(linha[2:]) for linha in linhas if not linha[1] and linha[2] is not None]
+    excluidos = [linha[0] for linha in linhas if linha[1]]
+    return versao, alterados, excluidos
+
+def buscarAlteracoesProdutos(desde):
+    # (versao_atual, produtos alterados, ids excluídos) entre desde e a versão atual.
+    try:
+        with _cursor() as cursor:
+            cursor.execute('SELECT versao, alteracoes_desde FROM produtos_versao WHERE id = 1')
+            estado = cursor.fetchone()
+            cursor.execute(SQL_ALTERACOES_DESDE, (desde, estado[0], MAX_ALTERACOES_DELTA + 1))
+            linhas = cursor.fetchall()
+    except Exception as ex:
+        print(f"Erro ao buscar alterações de produtos: {ex}")
+        return None
+    return _montarAlteracoes(estado, desde, linhas)
+
+def assinarAlteracoesProdutos():
+    return notificacoes.ouvinte.assinar()
+
+def estatisticasNotificacoes():
+    return notificacoes.ouvinte.estatisticas()
+
+def _incrementarVersaoProdutos(cursor, alterados=(), excluidos=(), nomes=None):
+    # Depois da escrita: a trava na linha de produtos_versao vai até o commit,
+    # então as versões ficam na ordem dos commits. O NOTIFY só é entregue no commit.
+    cursor.execute(SQL_INCREMENTAR_VERSAO)
+    versao = cursor.fetchone()[0]
+    ids = list(alterados) + list(excluidos)
+    marcas = [False] * len(alterados) + [True] * len(excluidos)
+    if ids:
+        cursor.execute(SQL_REGISTRAR_ALTERACOES, (versao, ids, marcas))
+    evento = json.dumps(eventoProdutos(versao, alterados, excluidos, nomes))
+    cursor.execute('SELECT pg_notify(%s, %s)', (CANAL_PRODUTOS, evento))
+    return versao
+
+def _chavesProdutos(ids=(), nomes=()):
+    return [f'produto:id:{id}' for id in ids] + [f'produto:nome:{nome}' for nome in nomes]
+
+def _produtosAlterados(chaves=()):
+    for chave in chaves:
+        _cache_produtos.remover(chave)
+
+def _registrarAlteracaoProdutos(ids=(), nomes=()):
+    # Neste processo, logo após o commit; nos demais, pelo NOTIFY (_invalidarPorEvento).
+    chaves = _chavesProdutos(ids, nomes)
+    if emTransacao():
+        # Até o commit, as leituras desta transação não passam pelo cache.
+        _contexto().db_produtos_pendentes = True
+    _aoConfirmar(lambda: _produtosAlterados(chaves))
+
+def _invalidarPorEvento(evento):
+    # Alterações feitas por qualquer processo (workers, api_async), recebidas
+    # pelo canal de produtos. REINICIAR (LISTEN reconectado) e eventos sem os
+    # nomes limpam o cache inteiro.
+    if evento.get('parcial') or evento.get('nomes') is None:
+        _cache_produtos.limpar()
+        return
+    _produtosAlterados(_chavesProdutos(evento['alterados'] + evento['excluidos'], evento['nomes']))
+
+_assinatura_produtos = None
+
+def assinarInvalidacaoProdutos():
+    global _assinatura_produtos
+    if _assinatura_produtos is None:
+        _assinatura_produtos = notificacoes.ouvinte.assinar(_invalidarPorEvento)
+
+# Leitura de produtos por id e por nome, invalidada pelas alterações de todos os
+# processos (assinarInvalidacaoProdutos). Escritas feitas fora do dao (SQL
+# direto no banco) não publicam nada: valem após CACHE_PRODUTOS_TTL. O backend
+# pode ser trocado por um CacheCompartilhado (configurarCacheProdutos).
+_cache_produtos = CacheLRU(capacidade=4096, ttl=30)
+
+def configurarCacheProdutos(backend):
+    global _cache_produtos
+    _cache_produtos = backend
+
+def estatisticasCacheProdutos():
+    return _cache_produtos.estatisticas()
+
+def _lerComCache(chave, carregar):
+    if emTransacao() and getattr(_contexto(), 'db_produtos_pendentes', False):
+        return carregar()
+
+    cache = _cache_produtos
+    valor = cache.obter(chave)
+    if valor is not AUSENTE:
+        return valor
+
+    geracao = cache.geracao()
+    valor = carregar()
+    if valor is not None:
+        cache.definir(chave, valor, geracao=geracao)
+    return valor
+
+def fecharConexao(exc=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        put_connection(conn)
+
+def _liberarConexao():
+    # Devolve já a conexão da requisição, antes de um trabalho demorado sem banco.
+    if has_app_context() and not emTransacao():
+        fecharConexao()
+
+def _opcao(config, chave, padrao):
+    valor = config.get(chave)
+    return os.environ.get(chave, padrao) if valor is None else valor
+
+def init_app(app):
+    metricas.configurar(limite_lento_ms=_opcao(app.config, 'DB_CONSULTA_LENTA_MS', 500))
+    # Antes do pool: as conexões dele já preparam as consultas sobre o esquema final.
+    migracoes.aplicarNaInicializacao(app.config)
+    configurarPool(app.config)
+    _perfis.configurar(
+        capacidade=int(_opcao(app.config, 'CACHE_PERFIL_MAX', 1024)),
+        ttl=float(_opcao(app.config, 'CACHE_PERFIL_TTL', 60))
+    )
+    _cache_produtos.configurar(
+        capacidade=int(_opcao(app.config, 'CACHE_PRODUTOS_MAX', 4096)),
+        ttl=float(_opcao(app.config, 'CACHE_PRODUTOS_TTL', 30))
+    )
+    senhas.configurar(app.config)
+    notificacoes.ouvinte.configurar(
+        app.config,
+        tamanho_fila=int(_opcao(app.config, 'PRODUTOS_STREAM_FILA', 256)),
+        max_assinaturas=int(_opcao(app.config, 'PRODUTOS_STREAM_MAX', 100))
+    )
+    notificacoes.ouvinte_tokens.configurar(app.config)
+    assinarInvalidacaoProdutos()
+    assinarRevogacoes(carregarRevogacoes)
+    carregarRevogacoes()
+    app.teardown_appcontext(fecharConexao)
+
+# Revogações de token (dao.tokens): o banco é a fonte, a lista em memória de
+# cada processo é atualizada pelo canal tokens (gatilhos da migração 10).
+SQL_VERSOES_TOKEN = 'SELECT loginuser, versao_token FROM usuario WHERE versao_token > 0'
+SQL_LIMPAR_REVOGADOS = 'DELETE FROM tokens_revogados WHERE expira_em < now()'
+SQL_TOKENS_REVOGADOS = 'SELECT jti, extract(epoch FROM expira_em) FROM tokens_revogados'
+SQL_REVOGAR_TOKEN = '''
+    INSERT INTO tokens_revogados (jti, loginuser, expira_em) VALUES (%s, %s, to_timestamp(%s))
+    ON CONFLICT (jti) DO NOTHING
+'''
+
+_assinatura_revogacoes = None
+
+def assinarRevogacoes(recarregar):
+    # Uma vez por processo, antes da carga inicial: uma revogação feita entre
+    # as duas não se perde. recarregar roda de novo quando o LISTEN reconecta.
+    global _assinatura_revogacoes
+    if _assinatura_revogacoes is not None:
+        return
+    def tratar(evento):
+        if not revogacoes.aplicarEvento(evento):
+            recarregar()
+    _assinatura_revogacoes = notificacoes.ouvinte_tokens.assinar(tratar)
+
+def carregarRevogacoes():
+    # Preenche a lista de revogação em memória com as versões já incrementadas
+    # e os logouts ainda não expirados.
+    try:
+        with _cursor() as cursor:
+            cursor.execute(SQL_VERSOES_TOKEN)
+            for login, versao in cursor.fetchall():
+                revogacoes.definirVersaoMinima(login, versao)
+            cursor.execute(SQL_LIMPAR_REVOGADOS)
+            cursor.execute(SQL_TOKENS_REVOGADOS)
+            for jti, expira_em in cursor.fetchall():
+                revogacoes.revogar(jti, float(expira_em))
+            _confirmar(cursor)
+    except Exception as ex:
+        print(f"Erro ao carregar revogações de token: {ex}")
+
+def revogarToken(jti, login, expira_em):
+    # Vale de imediato neste processo; os outros recebem pelo canal tokens.
+    # False se não foi possível gravar (o logout não chegaria aos outros processos).
+    revogacoes.revogar(jti, expira_em)
+    try:
+        with _cursor() as cursor:
+            cursor.execute(SQL_REVOGAR_TOKEN, (jti, login, expira_em))
+            _confirmar(cursor)
+        return True
+    except Exception as ex:
+        print(f"Erro ao revogar token: {ex}")
+        return False
+
+def buscarClaimsUsuario(login):
+    # (tipouser, versao_token), gravados no token emitido no login.
+    try:
+        with _cursor() as cursor:
+            consultas.executar(cursor, 'claims_usuario', (login,))
+            return cursor.fetchone()
+    except Exception as ex:
+        print(f"Erro ao buscar claims do usuário: {ex}")
+        return None
+
+def _revogarTokensAnteriores(login, linhas):
+    for (versao,) in linhas:
+        _aoConfirmar(lambda versao=versao: revogacoes.definirVersaoMinima(login, versao))
+
+def verificarLogin(login, senha):
+    # A senha é conferida no pool de dao.senhas; pode levantar SenhasSobrecarregadas.
+    if not isinstance(senha, str):
+        return False
+    try:
+        with _cursor() as cursor:
+            consultas.executar(cursor, 'senha_usuario', (login,))
+            usuario = cursor.fetchone()
     except Exception as ex:
         print(f"Erro ao verificar login: {ex}")
         return False
-    finally:
-        cursor.close()
-        put_connection(conn)
+
+    _liberarConexao()
+    armazenada = usuario[0] if usuario else None
+    confere, novo_hash = senhas.verificarSenha(armazenada, senha)
+    if confere and novo_hash:
+        _migrarSenha(login, armazenada, novo_hash)
+    return confere
+
+def _migrarSenha(login, anterior, novo_hash):
+    # Senha em texto puro (ou hash com custo antigo) trocada no primeiro login que confere.
+    try:
+        with _cursor() as cursor:
+            query = 'UPDATE usuario SET senha = %s WHERE loginuser = %s AND senha = %s'
+            cursor.execute(query, (novo_hash, login, anterior))
+            _confirmar(cursor)
+    except Exception as ex:
+        print(f"Erro ao migrar senha: {ex}")
 
 def verificarSeLoginExiste(login):
-    conn = get_connection()
     try:
-        cursor = conn.cursor()
-        query = 'SELECT * FROM usuario WHERE loginuser = %s'
-        cursor.execute(query, (login,))
-        usuario = cursor.fetchone()
-        return usuario is not None
+        with _cursor() as cursor:
+            consultas.executar(cursor, 'usuario_existe', (login,))
+            usuario = cursor.fetchone()
+            return usuario is not None
     except Exception as ex:
         print(f"Erro ao verificar se o login existe: {ex}")
         return False
-    finally:
-        cursor.close()
-        put_connection(conn)
 
 def criarUsuario(login, senha, tipo_user):
-    conn = get_connection()
+    senha = senhas.hashSenha(senha)
     try:
-        cursor = conn.cursor()
-        query = 'INSERT INTO usuario (loginuser, senha, tipouser) VALUES (%s, %s, %s)'
-        cursor.execute(query, (login, senha, tipo_user))
-        conn.commit()
-        print("Usuário criado com sucesso.")
+        with _cursor() as cursor:
+            query = 'INSERT INTO usuario (loginuser, senha, tipouser) VALUES (%s, %s, %s)'
+            cursor.execute(query, (login, senha, tipo_user))
+            _confirmar(cursor)
+            print("Usuário criado com sucesso.")
     except Exception as ex:
         print(f"Erro ao criar usuário: {ex}")
-    finally:
-        cursor.close()
-        put_connection(conn)
 
 def buscarUsuarios():
-    conn = get_connection()
     try:
-        cursor = conn.cursor()
-        query = 'SELECT * FROM usuario'
-        cursor.execute(query)
-        usuarios = cursor.fetchall()
-        return usuarios
+        with _cursor() as cursor:
+            query = f'SELECT {COLUNAS_USUARIO} FROM usuario'
+            cursor.execute(query)
+            usuarios = cursor.fetchall()
+            return usuarios
     except Exception as ex:
         print(f"Erro ao buscar usuários: {ex}")
         return None
+
+def _iterarConsulta(nome_cursor, query, tamanho_lote):
+    conn = get_connection()
+    cursor = None
+    try:
+        # Cursor nomeado: o servidor mantém o resultado e entrega tamanho_lote linhas por vez.
+        cursor = conn.cursor(name=nome_cursor)
+        cursor.itersize = tamanho_lote
+        cursor.execute(query)
+        for linha in cursor:
+            yield linha
+    except Exception as ex:
+        # Relançada: a resposta em streaming é abortada em vez de terminar
+        # bem formada e incompleta.
+        print(f"Erro ao iterar consulta {nome_cursor}: {ex}")
+        raise
     finally:
-        cursor.close()
+        if cursor is not None and not cursor.closed:
+            cursor.close()
+        conn.rollback()
         put_connection(conn)
 
+def iterarUsuarios(tamanho_lote=1000):
+    return _iterarConsulta('iterar_usuarios', f'SELECT {COLUNAS_USUARIO} FROM usuario ORDER BY loginuser', tamanho_lote)
+
 def buscarUsuarioPorLogin(login):
-    conn = get_connection()
     try:
-        cursor = conn.cursor()
-        query = 'SELECT * FROM usuario WHERE loginuser = %s'
-        cursor.execute(query, (login,))
-        usuarios = cursor.fetchone()
-        return usuarios
+        with _cursor() as cursor:
+            consultas.executar(cursor, 'usuario_por_login', (login,))
+            usuarios = cursor.fetchone()
+            return usuarios
     except Exception as ex:
         print(f"Erro ao buscar usuário: {ex}")
         return None
-    finally:
-        cursor.close()
-        put_connection(conn)
+
+# Tipo de usuário por login, para as checagens de permissão das páginas. As
+# alterações feitas por este processo invalidam a entrada na hora; o TTL limita
+# por quanto tempo uma alteração feita por outro processo pode demorar a aparecer.
+_perfis = CacheLRU(capacidade=1024, ttl=60)
+
+def buscarTipoUsuario(login):
+    tipo = _perfis.obter(login)
+    if tipo is not AUSENTE:
+        return tipo
+
+    geracao = _perfis.geracao()
+    usuario = buscarUsuarioPorLogin(login)
+    if usuario is None:
+        return None
+    _perfis.definir(login, usuario[2], geracao=geracao)
+    return usuario[2]
+
+def estatisticasCachePerfis():
+    return _perfis.estatisticas()
+
+def _invalidarPerfil(login):
+    _aoConfirmar(lambda: _perfis.remover(login))
 
 def atualizarUsuario(login, nova_senha, novo_tipo):
-    conn = get_connection()
+    nova_senha = senhas.hashSenha(nova_senha)
     try:
-        cursor = conn.cursor()
-        query = 'UPDATE usuario SET senha = %s, tipouser = %s WHERE loginuser = %s'
-        cursor.execute(query, (nova_senha, novo_tipo, login))
-        conn.commit()
-        registros = cursor.rowcount
-        print(f'Registros atualizados: {registros}')
+        with _cursor() as cursor:
+            # Troca de senha ou de tipo invalida os tokens já emitidos para o usuário.
+            query = '''
+                UPDATE usuario SET senha = %s, tipouser = %s, versao_token = versao_token + 1
+                WHERE loginuser = %s RETURNING versao_token
+            '''
+            cursor.execute(query, (nova_senha, novo_tipo, login))
+            linhas = cursor.fetchall()
+            _confirmar(cursor)
+            _invalidarPerfil(login)
+            _revogarTokensAnteriores(login, linhas)
+            registros = cursor.rowcount
+            print(f'Registros atualizados: {registros}')
     except Exception as ex:
         print(f"Erro ao atualizar usuário: {ex}")
-    finally:
-        cursor.close()
-        put_connection(conn)
 
 def atualizarTipoUsuario(login, novo_tipo):
-    conn = get_connection()
     try:
-        cursor = conn.cursor()
-        query = 'UPDATE usuario SET tipouser = %s WHERE loginuser = %s'
-        cursor.execute(query, (novo_tipo, login))
-        conn.commit()
-        registros = cursor.rowcount
-        print(f'Registros atualizados: {registros}')
+        with _cursor() as cursor:
+            query = '''
+                UPDATE usuario SET tipouser = %s,
+                    versao_token = versao_token + CASE WHEN tipouser IS DISTINCT FROM %s THEN 1 ELSE 0 END
+                WHERE loginuser = %s RETURNING versao_token
+            '''
+            cursor.execute(query, (novo_tipo, novo_tipo, login))
+            linhas = cursor.fetchall()
+            _confirmar(cursor)
+            _invalidarPerfil(login)
+            _revogarTokensAnteriores(login, linhas)
+            registros = cursor.rowcount
+            print(f'Registros atualizados: {registros}')
     except Exception as ex:
         print(f"Erro ao atualizar usuário: {ex}")
-    finally:
-        cursor.close()
-        put_connection(conn)
 
 def buscarProdutos():
-    conn = get_connection()
     try:
-        cursor = conn.cursor()
-        query = 'SELECT * FROM produtos'
-        cursor.execute(query)
-        produtos = cursor.fetchall()
-        return produtos
+        with _cursor() as cursor:
+            query = f'SELECT {COLUNAS_PRODUTO} FROM produtos'
+            cursor.execute(query)
+            produtos = cursor.fetchall()
+            return produtos
     except Exception as ex:
         print(f"Erro ao buscar produtos: {ex}")
         return None
-    finally:
-        cursor.close()
-        put_connection(conn)
+
+def iterarProdutos(tamanho_lote=1000):
+    return _iterarConsulta('iterar_produtos', f'SELECT {COLUNAS_PRODUTO} FROM produtos ORDER BY id', tamanho_lote)
+
+ORDENACOES_PRODUTOS = {
+    'id': (('id',), False),
+    '-id': (('id',), True),
+    'nome': (('nome', 'id'), False),
+    '-nome': (('nome', 'id'), True),
+}
+
+# Tipo de cada coluna de ordenação no cursor; id é integer (int4) no banco.
+TIPOS_CURSOR = {'id': int, 'nome': str}
+LIMITES_INTEIRO = (-2 ** 31, 2 ** 31 - 1)
+
+def _codificarCursor(valores):
+    dados = json.dumps(valores, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(dados).decode().rstrip('=')
+
+def _decodificarCursor(cursor, colunas):
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + preenchimento))
+    except (ValueError, TypeError):
+        raise ValueError(f"Cursor inválido: {cursor}")
+    if not isinstance(valores, list) or len(valores) != len(colunas):
+        raise ValueError(f"Cursor inválido: {cursor}")
+    # Um valor de outro tipo chegaria ao banco e viraria erro de consulta (404), não 400.
+    for coluna, valor in zip(colunas, valores):
+        tipo = TIPOS_CURSOR[coluna]
+        if type(valor) is not tipo or (tipo is int and not LIMITES_INTEIRO[0] <= valor <= LIMITES_INTEIRO[1]):
+            raise ValueError(f"Cursor inválido: {cursor}")
+    return valores
+
+def _escaparLike(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _consultaPaginaProdutos(limite, depois, antes, busca, prefixo, ordem):
+    if ordem not in ORDENACOES_PRODUTOS:
+        raise ValueError(f"Ordenação inválida: {ordem}")
+
+    colunas, decrescente = ORDENACOES_PRODUTOS[ordem]
+    voltando = antes is not None
+    referencia = antes if voltando else depois
+
+    condicoes = []
+    parametros = []
+    if busca:
+        padrao = _escaparLike(busca)
+        condicoes.append('nome ILIKE %s')
+        parametros.append(padrao + '%' if prefixo else '%' + padrao + '%')
+
+    # Voltar uma página é a mesma busca por chave com a ordem invertida.
+    invertida = decrescente != voltando
+    if referencia is not None:
+        valores = _decodificarCursor(referencia, colunas)
+        operador = '<' if invertida else '>'
+        condicoes.append(f"({', '.join(colunas)}) {operador} ({', '.join(['%s'] * len(colunas))})")
+        parametros.extend(valores)
+
+    direcao = 'DESC' if invertida else 'ASC'
+    query = f'SELECT {COLUNAS_PRODUTO} FROM produtos'
+    if condicoes:
+        query += ' WHERE ' + ' AND '.join(condicoes)
+    query += ' ORDER BY ' + ', '.join(f'{coluna} {direcao}' for coluna in colunas) + ' LIMIT %s'
+    parametros.append(limite + 1)
+    return query, parametros
+
+# migrar.py verificar: a página seguinte por chave tem de usar produtos_nome_id_idx / a chave primária.
+migracoes.registrarVerificacao('pagina_por_nome', *_consultaPaginaProdutos(
+    20, _codificarCursor(['verificacao', 1]), None, None, False, 'nome'))
+migracoes.registrarVerificacao('pagina_por_id', *_consultaPaginaProdutos(
+    20, _codificarCursor([1]), None, None, False, 'id'))
+
+def _montarPaginaProdutos(produtos, limite, depois, antes, ordem):
+    colunas, _ = ORDENACOES_PRODUTOS[ordem]
+    voltando = antes is not None
+
+    tem_mais = len(produtos) > limite
+    produtos = list(produtos[:limite])
+    if voltando:
+        produtos.reverse()
+    if not produtos:
+        return produtos, None, None
+
+    def chave(produto):
+        return _codificarCursor([produto[1], produto[0]] if 'nome' in colunas else [produto[0]])
+
+    if voltando:
+        cursor_anterior = chave(produtos[0]) if tem_mais else None
+        proximo_cursor = chave(produtos[-1])
+    else:
+        cursor_anterior = chave(produtos[0]) if depois is not None else None
+        proximo_cursor = chave(produtos[-1]) if tem_mais else None
+    return produtos, cursor_anterior, proximo_cursor
+
+def buscarProdutosPagina(limite=5, depois=None, antes=None, busca=None, prefixo=False, ordem='id'):
+    query, parametros = _consultaPaginaProdutos(limite, depois, antes, busca, prefixo, ordem)
+    try:
+        with _cursor() as cursor:
+            cursor.execute(query, parametros)
+            produtos = cursor.fetchall()
+    except Exception as ex:
+        print(f"Erro ao buscar página de produtos: {ex}")
+        return None
+
+    return _montarPaginaProdutos(produtos, limite, depois, antes, ordem)
+
+def agregarEstoquePorNome(loginuser=None, limite=None, rotulo_outros='Outros'):
+    condicao = 'WHERE loginuser = %s' if loginuser is not None else ''
+    parametros = [loginuser] if loginuser is not None else []
+
+    if limite is None:
+        query = f'SELECT nome, SUM(qtde)::bigint FROM produtos {condicao} GROUP BY nome ORDER BY nome'
+    else:
+        # Mantém os `limite` nomes com mais estoque e soma o restante em um único grupo.
+        query = f"""
+            WITH totais AS (
+                SELECT nome, SUM(qtde) AS total FROM produtos {condicao} GROUP BY nome
+            ), ranqueados AS (
+                SELECT nome, total, ROW_NUMBER() OVER (ORDER BY total DESC, nome) AS posicao FROM totais
+            )
+            SELECT CASE WHEN posicao <= %s THEN nome ELSE %s END, SUM(total)::bigint
+            FROM ranqueados
+            GROUP BY 1
+            ORDER BY MIN(posicao)
+        """
+        parametros += [limite, rotulo_outros]
+
+    try:
+        with _cursor() as cursor:
+            cursor.execute(query, parametros)
+            return cursor.fetchall()
+    except Exception as ex:
+        print(f"Erro ao agregar estoque: {ex}")
+        return None
 
 def buscarProdutoPorId(produto_id):
-    conn = get_connection()
+    return _lerComCache(f'produto:id:{produto_id}', lambda: _buscarProdutoPorIdNoBanco(produto_id))
+
+def _buscarProdutoPorIdNoBanco(produto_id):
     try:
-        cursor = conn.cursor()
-        query = 'SELECT * FROM produtos WHERE id = %s'
-        cursor.execute(query, (produto_id,))
-        produto = cursor.fetchone()
-        return produto
+        with _cursor() as cursor:
+            consultas.executar(cursor, 'produto_por_id', (produto_id,))
+            produto = cursor.fetchone()
+            return produto
     except Exception as ex:
         print(f"Erro ao buscar produto: {ex}")
         return None
-    finally:
-        cursor.close()
-        put_connection(conn)
 
 def buscarProdutoPorNome(nome):
-    conn = get_connection()
+    return _lerComCache(f'produto:nome:{nome}', lambda: _buscarProdutoPorNomeNoBanco(nome))
+
+def _buscarProdutoPorNomeNoBanco(nome):
     try:
-        cursor = conn.cursor()
-        query = 'SELECT * FROM produtos WHERE nome = %s'
-        cursor.execute(query, (nome,))
-        produto = cursor.fetchone()
-        return produto
+        with _cursor() as cursor:
+            consultas.executar(cursor, 'produto_por_nome', (nome,))
+            produto = cursor.fetchone()
+            return produto
     except Exception as ex:
         print(f"Erro ao buscar produto por nome: {ex}")
         return None
-    finally:
-        cursor.close()
-        put_connection(conn)
 
 def contarProdutos(loginuser):
-    conn = get_connection()
+    # Contador mantido por gatilho em usuario.qtde_produtos (migração 9).
     try:
-        cursor = conn.cursor()
-        query = 'SELECT COUNT(*) FROM produtos WHERE loginuser = %s'
-        cursor.execute(query, (loginuser,))
-        count = cursor.fetchone()[0]
-        return count
+        with _cursor() as cursor:
+            consultas.executar(cursor, 'contar_produtos', (loginuser,))
+            linha = cursor.fetchone()
+            return linha[0] if linha else 0
     except Exception as ex:
         print(f"Erro ao contar produtos: {ex}")
         return 0
-    finally:
-        cursor.close()
-        put_connection(conn)
+
+LIMITE_PRODUTOS_NORMAL = 3
+
+class LimiteProdutosAtingido(Exception):
+    pass
+
+# Limite e inserção num único comando: o FOR UPDATE trava o dono, e uma inserção
+# concorrente para o mesmo usuário espera e reavalia o WHERE com o qtde_produtos
+# já atualizado pelo gatilho da primeira.
+SQL_INSERIR_PRODUTO = """
+    INSERT INTO produtos (nome, loginuser, qtde, preco)
+    SELECT %s, loginuser, %s::integer, %s::numeric FROM usuario
+    WHERE loginuser = %s AND (tipouser IS DISTINCT FROM 'normal' OR qtde_produtos < %s)
+    FOR UPDATE
+    RETURNING id
+"""
 
 def adicionarProduto(nome, loginuser, qtde, preco):
-    conn = get_connection()
+    # Devolve o id do produto (None se falhar); levanta LimiteProdutosAtingido.
     try:
-        cursor = conn.cursor()
-        query = 'INSERT INTO produtos (nome, loginuser, qtde, preco) VALUES (%s, %s, %s, %s)'
-        cursor.execute(query, (nome, loginuser, qtde, preco))
-        conn.commit()
-        print("Produto adicionado com sucesso.")
+        with _cursor() as cursor:
+            cursor.execute(SQL_INSERIR_PRODUTO, (nome, qtde, preco, loginuser, LIMITE_PRODUTOS_NORMAL))
+            linha = cursor.fetchone()
+            if linha is None:
+                consultas.executar(cursor, 'usuario_existe', (loginuser,))
+                if cursor.fetchone() is not None:
+                    raise LimiteProdutosAtingido(f"Limite de {LIMITE_PRODUTOS_NORMAL} produtos atingido para {loginuser}.")
+                print(f"Erro ao adicionar produto: usuário {loginuser} não encontrado.")
+                return None
+            _incrementarVersaoProdutos(cursor, alterados=[linha[0]], nomes=[nome])
+            _confirmar(cursor)
+            _registrarAlteracaoProdutos(nomes=[nome])
+            print("Produto adicionado com sucesso.")
+            return linha[0]
+    except LimiteProdutosAtingido:
+        raise
     except Exception as ex:
         print(f"Erro ao adicionar produto: {ex}")
-    finally:
-        cursor.close()
-        put_connection(conn)
+        return None
+
+# Devolve o nome anterior para invalidar também a entrada do cache por nome.
+SQL_ATUALIZAR_PRODUTO = """
+    UPDATE produtos p SET nome = %s, qtde = %s, preco = %s
+    FROM (SELECT id, nome FROM produtos WHERE id = %s FOR UPDATE) anterior
+    WHERE p.id = anterior.id
+    RETURNING anterior.nome
+"""
 
 def atualizarProduto(id, nome, qtde, preco):
-    conn = get_connection()
     try:
-        cursor = conn.cursor()
-        query = 'UPDATE produtos SET nome = %s, qtde = %s, preco = %s WHERE id = %s'
-        cursor.execute(query, (nome, qtde, preco, id))
-        conn.commit()
-        print("Produto atualizado com sucesso.")
+        with _cursor() as cursor:
+            cursor.execute(SQL_ATUALIZAR_PRODUTO, (nome, qtde, preco, id))
+            anteriores = [linha[0] for linha in cursor.fetchall()]
+            if anteriores:
+                _incrementarVersaoProdutos(cursor, alterados=[id], nomes=anteriores + [nome])
+            _confirmar(cursor)
+            _registrarAlteracaoProdutos(ids=[id], nomes=anteriores + [nome])
+            print("Produto atualizado com sucesso.")
     except Exception as ex:
         print(f"Erro ao atualizar produto: {ex}")
-    finally:
-        cursor.close()
-        put_connection(conn)
 
 def excluirProduto(id):
-    conn = get_connection()
     try:
-        cursor = conn.cursor()
-        query = 'DELETE FROM produtos WHERE id = %s'
-        cursor.execute(query, (id,))
-        conn.commit()
-        print("Produto excluído com sucesso.")
+        with _cursor() as cursor:
+            query = 'DELETE FROM produtos WHERE id = %s RETURNING nome'
+            cursor.execute(query, (id,))
+            nomes = [linha[0] for linha in cursor.fetchall()]
+            if nomes:
+                _incrementarVersaoProdutos(cursor, excluidos=[id], nomes=nomes)
+            _confirmar(cursor)
+            _registrarAlteracaoProdutos(ids=[id], nomes=nomes)
+            print("Produto excluído com sucesso.")
     except Exception as ex:
         print(f"Erro ao excluir produto: {ex}")
-    finally:
-        cursor.close()
-        put_connection(conn)
 
+MAX_ITENS_LOTE = 1000
+
+def validarAlteracaoProduto(item):
+    if not isinstance(item, dict):
+        raise ValueError("item deve ser um objeto com id e os campos a alterar")
+    try:
+        id = int(item.get('id'))
+    except (TypeError, ValueError):
+        raise ValueError(f"id inválido: {item.get('id')!r}")
+
+    nome = item.get('nome')
+    qtde = item.get('qtde')
+    preco = item.get('preco')
+    if nome is None and qtde is None and preco is None:
+        raise ValueError("informe ao menos um de nome, qtde ou preco")
+    if nome is not None and (not isinstance(nome, str) or not nome.strip()):
+        raise ValueError("nome inválido")
+    try:
+        qtde = int(qtde) if qtde is not None else None
+        preco = Decimal(str(preco)) if preco is not None else None
+    except (ValueError, InvalidOperation):
+        raise ValueError("qtde ou preco inválido")
+    if (qtde is not None and qtde < 0) or (preco is not None and (not preco.is_finite() or preco < 0)):
+        raise ValueError("qtde e preco não podem ser negativos")
+
+    return id, nome.strip() if nome is not None else None, qtde, preco
+
+def atualizarProdutosEmLote(alteracoes):
+    # alteracoes: lista de (id, nome, qtde, preco); None mantém o valor atual.
+    # Todas vão em um único UPDATE ... FROM (VALUES ...), ou seja, uma transação.
+    query = """
+        WITH v (id, nome, qtde, preco) AS (VALUES %s),
+        anterior AS (
+            SELECT p.id, p.nome FROM produtos p JOIN v ON v.id = p.id FOR UPDATE OF p
+        )
+        UPDATE produtos p SET
+            nome = COALESCE(v.nome, p.nome),
+            qtde = COALESCE(v.qtde, p.qtde),
+            preco = COALESCE(v.preco, p.preco)
+        FROM v JOIN anterior ON anterior.id = v.id
+        WHERE p.id = v.id
+        RETURNING p.id, anterior.nome, p.nome
+    """
+    try:
+        with _cursor() as cursor:
+            atualizados = execute_values(
+                cursor, query, alteracoes,
+                template='(%s::integer, %s::text, %s::integer, %s::numeric)',
+                page_size=len(alteracoes), fetch=True
+            )
+            nomes = {nome for _, anterior, novo in atualizados for nome in (anterior, novo)}
+            if atualizados:
+                _incrementarVersaoProdutos(cursor, alterados=[linha[0] for linha in atualizados], nomes=nomes)
+            _confirmar(cursor)
+            _registrarAlteracaoProdutos(ids=[linha[0] for linha in atualizados], nomes=nomes)
+            print(f"Produtos atualizados em lote: {len(atualizados)}")
+            return {linha[0] for linha in atualizados}
+    except Exception as ex:
+        print(f"Erro ao atualizar produtos em lote: {ex}")
+        raise
+
+def excluirProdutosEmLote(ids):
+    try:
+        with _cursor() as cursor:
+            query = 'DELETE FROM produtos WHERE id = ANY(%s) RETURNING id, nome'
+            cursor.execute(query, (list(ids),))
+            excluidos = cursor.fetchall()
+            if excluidos:
+                _incrementarVersaoProdutos(cursor, excluidos=[linha[0] for linha in excluidos],
+                                           nomes=[linha[1] for linha in excluidos])
+            _confirmar(cursor)
+            _registrarAlteracaoProdutos(ids=[linha[0] for linha in excluidos], nomes={linha[1] for linha in excluidos})
+            print(f"Produtos excluídos em lote: {len(excluidos)}")
+            return {linha[0] for linha in excluidos}
+    except Exception as ex:
+        print(f"Erro ao excluir produtos em lote: {ex}")
+        raise
+
+MAX_ERROS_IMPORTACAO = 1000
+
+def _validarProduto(dados, loginuser_padrao):
+    if not isinstance(dados, dict):
+        raise ValueError("registro deve ser um objeto com nome, loginuser, qtde e preco")
+
+    nome = dados.get('nome')
+    loginuser = dados.get('loginuser') or loginuser_padrao
+    if not isinstance(nome, str) or not nome.strip():
+        raise ValueError("nome ausente")
+    if not isinstance(loginuser, str) or not loginuser.strip():
+        raise ValueError("loginuser ausente")
+
+    try:
+        qtde = int(str(dados.get('qtde')).strip())
+    except ValueError:
+        raise ValueError(f"qtde inválida: {dados.get('qtde')!r}")
+    try:
+        preco = Decimal(str(dados.get('preco')).strip())
+    except InvalidOperation:
+        raise ValueError(f"preco inválido: {dados.get('preco')!r}")
+    if qtde < 0 or not preco.is_finite() or preco < 0:
+        raise ValueError("qtde e preco não podem ser negativos")
+
+    return nome.strip(), loginuser.strip(), qtde, preco
+
+def _importarLote(cursor, lote):
+    logins = sorted({produto[2] for produto in lote})
+
+    # Trava os usuários do lote para que importações simultâneas não furem o limite.
+    cursor.execute('SELECT loginuser, tipouser, qtde_produtos FROM usuario WHERE loginuser = ANY(%s) FOR UPDATE',
+                   (logins,))
+    usuarios = cursor.fetchall()
+    tipos = {loginuser: tipo for loginuser, tipo, _ in usuarios}
+    quantidades = {loginuser: quantidade for loginuser, _, quantidade in usuarios}
+
+    aceitos = []
+    erros = []
+    for linha, nome, loginuser, qtde, preco in lote:
+        if loginuser not in tipos:
+            erros.append((linha, f"usuário {loginuser} não encontrado"))
+        elif tipos[loginuser] == 'normal' and quantidades.get(loginuser, 0) >= LIMITE_PRODUTOS_NORMAL:
+            erros.append((linha, f"limite de {LIMITE_PRODUTOS_NORMAL} produtos atingido para {loginuser}"))
+        else:
+            quantidades[loginuser] = quantidades.get(loginuser, 0) + 1
+            aceitos.append((nome, loginuser, qtde, preco))
+
+    if aceitos:
+        # COPY não tem RETURNING: os ids saem da sequência antes, para o registro de alterações.
+        cursor.execute("SELECT nextval(pg_get_serial_sequence('produtos', 'id')) FROM generate_series(1, %s)",
+                       (len(aceitos),))
+        ids = [linha[0] for linha in cursor.fetchall()]
+        dados = io.StringIO()
+        csv.writer(dados).writerows((id,) + produto for id, produto in zip(ids, aceitos))
+        dados.seek(0)
+        cursor.copy_expert('COPY produtos (id, nome, loginuser, qtde, preco) FROM STDIN WITH (FORMAT csv)', dados)
+        _incrementarVersaoProdutos(cursor, alterados=ids, nomes=[produto[0] for produto in aceitos])
+    return aceitos, erros
+
+def _registrarErroImportacao(resultado, linha, erro):
+    resultado['rejeitados'] += 1
+    if len(resultado['erros']) < MAX_ERROS_IMPORTACAO:
+        resultado['erros'].append({"linha": linha, "erro": erro})
+
+def importarProdutos(registros, loginuser_padrao=None, tamanho_lote=5000):
+    # registros: iterável de (numero_da_linha, dict). Cada lote vai ao banco com
+    # um único COPY dentro de um savepoint; um lote com erro é desfeito sozinho.
+    resultado = {"inseridos": 0, "rejeitados": 0, "lotes": [], "erros": []}
 
+    def processar(lote, primeira, ultima):
+        relatorio = {"lote": len(resultado['lotes']) + 1, "linhas": [primeira, ultima],
+                     "inseridos": 0, "erro": None}
+        resultado['lotes'].append(relatorio)
+        if not lote:
+            return
+        try:
+            with _cursor() as cursor:
+                cursor.execute('SAVEPOINT importacao')
+                try:
+                    aceitos, erros = _importarLote(cursor, lote)
+                except Exception as ex:
+                    cursor.execute('ROLLBACK TO SAVEPOINT importacao')
+                    aceitos, erros = [], []
+                    relatorio['erro'] = str(ex).strip()
+                cursor.execute('RELEASE SAVEPOINT importacao')
+                _confirmar(cursor)
+        except Exception as ex:
+            aceitos, erros = [], []
+            relatorio['erro'] = str(ex).strip()
+
+        if relatorio['erro']:
+            print(f"Erro ao importar lote {relatorio['lote']}: {relatorio['erro']}")
+            resultado['rejeitados'] += len(lote)
+            return
+        for linha, erro in erros:
+            _registrarErroImportacao(resultado, linha, erro)
+        relatorio['inseridos'] = len(aceitos)
+        resultado['inseridos'] += len(aceitos)
+        if aceitos:
+            _registrarAlteracaoProdutos(nomes={produto[0] for produto in aceitos})
+
+    lote = []
+    primeira = ultima = None
+    for linha, dados in registros:
+        if primeira is None:
+            primeira = linha
+        ultima = linha
+        try:
+            lote.append((linha,) + _validarProduto(dados, loginuser_padrao))
+        except ValueError as ex:
+            _registrarErroImportacao(resultado, linha, str(ex))
+        if ultima - primeira + 1 >= tamanho_lote:
+            processar(lote, primeira, ultima)
+            lote = []
+            primeira = None
+    if primeira is not None:
+        processar(lote, primeira, ultima)
+    return resultado
+
+class _SaidaCopia(io.RawIOBase):
+    # Arquivo em que o COPY TO escreve; os dados vão em blocos para a fila lida pela resposta.
+
+    def __init__(self, fila, cancelado, tamanho_bloco):
+        self.fila = fila
+        self.cancelado = cancelado
+        self.tamanho_bloco = tamanho_bloco
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.buffer += dados
+        if len(self.buffer) >= self.tamanho_bloco:
+            self.enviar()
+        return len(dados)
+
+    def enviar(self, item=None):
+        if item is None:
+            item, self.buffer = bytes(self.buffer), bytearray()
+        while True:
+            if self.cancelado.is_set():
+                raise IOError("Exportação cancelada pelo cliente.")
+            try:
+                self.fila.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+_FIM_COPIA = object()
+
+def exportarProdutosCsv(tamanho_bloco=65536):
+    query = 'COPY (SELECT id, nome, loginuser, qtde, preco FROM produtos ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)'
+    fila = queue.Queue(maxsize=16)
+    cancelado = threading.Event()
+    saida = _SaidaCopia(fila, cancelado, tamanho_bloco)
+
+    def copiar():
+        # Conexão própria: a resposta continua sendo lida depois do fim da requisição.
+        conn = get_connection()
+        fim = _FIM_COPIA
+        try:
+            with conn.cursor() as cursor:
+                cursor.copy_expert(query, saida)
+            if saida.buffer:
+                saida.enviar()
+        except Exception as ex:
+            print(f"Erro ao exportar produtos: {ex}")
+            fim = ex
+        finally:
+            put_connection(conn)
+            try:
+                saida.enviar(fim)
+            except IOError:
+                pass
+
+    threading.Thread(target=copiar, daemon=True).start()
+    try:
+        while True:
+            bloco = fila.get()
+            if bloco is _FIM_COPIA:
+                break
+            if isinstance(bloco, Exception):
+                # Na thread da resposta: aborta o download em vez de entregar um CSV cortado.
+                raise bloco
+            yield bloco
+    finally:
+        cancelado.set()
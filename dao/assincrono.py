@@ -0,0 +1,376 @@
+import asyncio
+import contextvars
+import json
+import re
+from contextlib import asynccontextmanager
+from decimal import Decimal
+
+import asyncpg
+
+from dao import (
+    CANAL_PRODUTOS, LIMITE_PRODUTOS_NORMAL, MAX_ALTERACOES_DELTA, SQL_ALTERACOES_DESDE,
+    SQL_ATUALIZAR_PRODUTO, SQL_INCREMENTAR_VERSAO, SQL_INSERIR_PRODUTO, SQL_REGISTRAR_ALTERACOES,
+    AlteracoesIndisponiveis, LimiteProdutosAtingido, TransacaoAbortada,
+    _consultaPaginaProdutos, _montarAlteracoes, _montarPaginaProdutos, eventoProdutos
+)
+from dao import (
+    SQL_LIMPAR_REVOGADOS, SQL_REVOGAR_TOKEN, SQL_TOKENS_REVOGADOS, SQL_VERSOES_TOKEN,
+    assinarRevogacoes, migracoes, notificacoes, senhas
+)
+from dao.consultas import COLUNAS_PRODUTO, COLUNAS_USUARIO
+from dao.pool import lerConfiguracao
+from dao.senhas import SenhasSobrecarregadas
+from dao.tokens import revogacoes
+
+
+# Versão assíncrona (asyncpg) das funções de dao, com os mesmos nomes e retornos.
+# Deve ser usada a partir de um único event loop, como o da api_async.
+
+db_pool = None
+_timeout_checkout = None
+_pool_lock = asyncio.Lock()
+_conexao_atual = contextvars.ContextVar('conexao_atual', default=None)
+_falhou = contextvars.ContextVar('transacao_falhou', default=None)
+
+def _paraAsyncpg(query):
+    contador = iter(range(1, query.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f'${next(contador)}', query)
+
+async def configurarPool(config=None):
+    global db_pool, _timeout_checkout
+    opcoes = lerConfiguracao(config)
+    _timeout_checkout = opcoes['timeout']
+    # Migrações com psycopg2, numa conexão própria: rodam uma vez, na subida.
+    await asyncio.to_thread(migracoes.aplicarNaInicializacao, config)
+    antigo = db_pool
+    db_pool = await asyncpg.create_pool(
+        host=opcoes['host'],
+        port=opcoes['port'],
+        database=opcoes['database'],
+        user=opcoes['user'],
+        password=opcoes['password'],
+        min_size=opcoes['minimo'],
+        max_size=opcoes['maximo'],
+        max_inactive_connection_lifetime=opcoes['ocioso_maximo'],
+    )
+    if antigo is not None:
+        await antigo.close()
+    senhas.configurar(config)
+    notificacoes.ouvinte_tokens.configurar(config)
+    # Os eventos chegam na thread do LISTEN; a recarga roda neste event loop.
+    loop = asyncio.get_running_loop()
+    await asyncio.to_thread(assinarRevogacoes, lambda: asyncio.run_coroutine_threadsafe(carregarRevogacoes(), loop))
+    await carregarRevogacoes()
+    return db_pool
+
+async def obterPool():
+    if db_pool is None:
+        async with _pool_lock:
+            if db_pool is None:
+                await configurarPool()
+    return db_pool
+
+async def fecharPool():
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
+
+@asynccontextmanager
+async def conexao():
+    conn = _conexao_atual.get()
+    if conn is not None:
+        yield conn
+        return
+
+    pool = await obterPool()
+    async with pool.acquire(timeout=_timeout_checkout) as conn:
+        yield conn
+
+def emTransacao():
+    return _falhou.get() is not None
+
+@asynccontextmanager
+async def transacao():
+    if emTransacao():
+        yield _conexao_atual.get()
+        return
+
+    async with conexao() as conn:
+        falhou = [False]
+        token_conn = _conexao_atual.set(conn)
+        token_falhou = _falhou.set(falhou)
+        try:
+            async with conn.transaction():
+                yield conn
+                if falhou[0]:
+                    raise TransacaoAbortada("Uma operação falhou dentro da transação.")
+        finally:
+            _falhou.reset(token_falhou)
+            _conexao_atual.reset(token_conn)
+
+def _marcarFalha():
+    falhou = _falhou.get()
+    if falhou is not None:
+        falhou[0] = True
+
+async def _executar(metodo, query, *parametros):
+    async with conexao() as conn:
+        try:
+            return await getattr(conn, metodo)(_paraAsyncpg(query), *parametros)
+        except Exception:
+            _marcarFalha()
+            raise
+
+def _quantidadePreco(qtde, preco):
+    # asyncpg exige os tipos Python das colunas; o psycopg2 aceitava strings.
+    try:
+        return int(qtde), Decimal(str(preco))
+    except (TypeError, ValueError, ArithmeticError):
+        _marcarFalha()
+        raise
+
+async def versaoProdutos():
+    try:
+        linha = await _executar('fetchrow', 'SELECT versao, atualizado_em FROM produtos_versao WHERE id = 1')
+        return tuple(linha) if linha is not None else None
+    except Exception as ex:
+        print(f"Erro ao buscar versão dos produtos: {ex}")
+        return None
+
+async def _incrementarVersaoProdutos(alterados=(), excluidos=(), nomes=None):
+    # nomes (anteriores e novos) vão no NOTIFY para o cache de produtos dos processos síncronos.
+    versao = await _executar('fetchval', SQL_INCREMENTAR_VERSAO)
+    ids = list(alterados) + list(excluidos)
+    if ids:
+        marcas = [False] * len(alterados) + [True] * len(excluidos)
+        await _executar('execute', SQL_REGISTRAR_ALTERACOES, versao, ids, marcas)
+    await _executar('execute', 'SELECT pg_notify(%s, %s)',
+                    CANAL_PRODUTOS, json.dumps(eventoProdutos(versao, alterados, excluidos, nomes)))
+    return versao
+
+async def buscarAlteracoesProdutos(desde):
+    try:
+        async with transacao():
+            estado = await _executar('fetchrow', 'SELECT versao, alteracoes_desde FROM produtos_versao WHERE id = 1')
+            linhas = await _executar('fetch', SQL_ALTERACOES_DESDE, desde, estado[0], MAX_ALTERACOES_DELTA + 1)
+    except Exception as ex:
+        print(f"Erro ao buscar alterações de produtos: {ex}")
+        return None
+    return _montarAlteracoes(tuple(estado), desde, [tuple(linha) for linha in linhas])
+
+async def carregarRevogacoes():
+    try:
+        for login, versao in await _executar('fetch', SQL_VERSOES_TOKEN):
+            revogacoes.definirVersaoMinima(login, versao)
+        await _executar('execute', SQL_LIMPAR_REVOGADOS)
+        for jti, expira_em in await _executar('fetch', SQL_TOKENS_REVOGADOS):
+            revogacoes.revogar(jti, float(expira_em))
+    except Exception as ex:
+        print(f"Erro ao carregar revogações de token: {ex}")
+
+async def revogarToken(jti, login, expira_em):
+    revogacoes.revogar(jti, expira_em)
+    try:
+        await _executar('execute', SQL_REVOGAR_TOKEN, jti, login, float(expira_em))
+        return True
+    except Exception as ex:
+        print(f"Erro ao revogar token: {ex}")
+        return False
+
+async def buscarClaimsUsuario(login):
+    try:
+        query = 'SELECT tipouser, versao_token FROM usuario WHERE loginuser = %s'
+        return await _executar('fetchrow', query, login)
+    except Exception as ex:
+        print(f"Erro ao buscar claims do usuário: {ex}")
+        return None
+
+def _revogarTokensAnteriores(login, linhas):
+    # Sem ganchos pós-commit aqui: dentro de uma transação desfeita, os tokens
+    # do usuário ficam revogados mesmo assim (o lado seguro).
+    for linha in linhas:
+        revogacoes.definirVersaoMinima(login, linha['versao_token'])
+
+async def _noPoolDeSenhas(funcao, *args):
+    # Sem esperar por vaga: o event loop não pode bloquear; recusa com SenhasSobrecarregadas.
+    return await asyncio.wrap_future(senhas.obterVerificador().submeter(funcao, *args, espera=0))
+
+async def verificarLogin(login, senha):
+    if not isinstance(senha, str):
+        return False
+    try:
+        query = 'SELECT senha FROM usuario WHERE loginuser = %s'
+        usuario = await _executar('fetchrow', query, login)
+    except Exception as ex:
+        print(f"Erro ao verificar login: {ex}")
+        return False
+
+    armazenada = usuario['senha'] if usuario else None
+    confere, novo_hash = await _noPoolDeSenhas(senhas.conferir, armazenada, senha)
+    if confere and novo_hash:
+        try:
+            query = 'UPDATE usuario SET senha = %s WHERE loginuser = %s AND senha = %s'
+            await _executar('execute', query, novo_hash, login, armazenada)
+        except Exception as ex:
+            print(f"Erro ao migrar senha: {ex}")
+    return confere
+
+async def verificarSeLoginExiste(login):
+    try:
+        query = 'SELECT 1 FROM usuario WHERE loginuser = %s'
+        usuario = await _executar('fetchrow', query, login)
+        return usuario is not None
+    except Exception as ex:
+        print(f"Erro ao verificar se o login existe: {ex}")
+        return False
+
+async def criarUsuario(login, senha, tipo_user):
+    senha = await _noPoolDeSenhas(senhas.gerarHash, senha)
+    try:
+        query = 'INSERT INTO usuario (loginuser, senha, tipouser) VALUES (%s, %s, %s)'
+        await _executar('execute', query, login, senha, tipo_user)
+        print("Usuário criado com sucesso.")
+    except Exception as ex:
+        print(f"Erro ao criar usuário: {ex}")
+
+async def buscarUsuarios():
+    try:
+        return await _executar('fetch', f'SELECT {COLUNAS_USUARIO} FROM usuario')
+    except Exception as ex:
+        print(f"Erro ao buscar usuários: {ex}")
+        return None
+
+async def _iterarConsulta(query, tamanho_lote):
+    try:
+        async with conexao() as conn:
+            async with conn.transaction():
+                async for linha in conn.cursor(query, prefetch=tamanho_lote):
+                    yield linha
+    except Exception as ex:
+        # Relançada: a resposta em streaming é abortada em vez de terminar incompleta.
+        print(f"Erro ao iterar consulta: {ex}")
+        raise
+
+def iterarUsuarios(tamanho_lote=1000):
+    return _iterarConsulta(f'SELECT {COLUNAS_USUARIO} FROM usuario ORDER BY loginuser', tamanho_lote)
+
+async def buscarUsuarioPorLogin(login):
+    try:
+        query = f'SELECT {COLUNAS_USUARIO} FROM usuario WHERE loginuser = %s'
+        return await _executar('fetchrow', query, login)
+    except Exception as ex:
+        print(f"Erro ao buscar usuário: {ex}")
+        return None
+
+async def atualizarUsuario(login, nova_senha, novo_tipo):
+    nova_senha = await _noPoolDeSenhas(senhas.gerarHash, nova_senha)
+    try:
+        query = '''
+            UPDATE usuario SET senha = %s, tipouser = %s, versao_token = versao_token + 1
+            WHERE loginuser = %s RETURNING versao_token
+        '''
+        linhas = await _executar('fetch', query, nova_senha, novo_tipo, login)
+        _revogarTokensAnteriores(login, linhas)
+        print(f'Registros atualizados: {len(linhas)}')
+    except Exception as ex:
+        print(f"Erro ao atualizar usuário: {ex}")
+
+async def atualizarTipoUsuario(login, novo_tipo):
+    try:
+        query = '''
+            UPDATE usuario SET tipouser = %s,
+                versao_token = versao_token + CASE WHEN tipouser IS DISTINCT FROM %s THEN 1 ELSE 0 END
+            WHERE loginuser = %s RETURNING versao_token
+        '''
+        linhas = await _executar('fetch', query, novo_tipo, novo_tipo, login)
+        _revogarTokensAnteriores(login, linhas)
+        print(f'Registros atualizados: {len(linhas)}')
+    except Exception as ex:
+        print(f"Erro ao atualizar usuário: {ex}")
+
+async def buscarProdutos():
+    try:
+        return await _executar('fetch', f'SELECT {COLUNAS_PRODUTO} FROM produtos')
+    except Exception as ex:
+        print(f"Erro ao buscar produtos: {ex}")
+        return None
+
+def iterarProdutos(tamanho_lote=1000):
+    return _iterarConsulta(f'SELECT {COLUNAS_PRODUTO} FROM produtos ORDER BY id', tamanho_lote)
+
+async def buscarProdutosPagina(limite=5, depois=None, antes=None, busca=None, prefixo=False, ordem='id'):
+    query, parametros = _consultaPaginaProdutos(limite, depois, antes, busca, prefixo, ordem)
+    try:
+        produtos = await _executar('fetch', query, *parametros)
+    except Exception as ex:
+        print(f"Erro ao buscar página de produtos: {ex}")
+        return None
+
+    return _montarPaginaProdutos(produtos, limite, depois, antes, ordem)
+
+async def buscarProdutoPorId(produto_id):
+    try:
+        query = f'SELECT {COLUNAS_PRODUTO} FROM produtos WHERE id = %s'
+        return await _executar('fetchrow', query, produto_id)
+    except Exception as ex:
+        print(f"Erro ao buscar produto: {ex}")
+        return None
+
+async def buscarProdutoPorNome(nome):
+    try:
+        query = f'SELECT {COLUNAS_PRODUTO} FROM produtos WHERE nome = %s'
+        return await _executar('fetchrow', query, nome)
+    except Exception as ex:
+        print(f"Erro ao buscar produto por nome: {ex}")
+        return None
+
+async def contarProdutos(loginuser):
+    try:
+        query = 'SELECT qtde_produtos FROM usuario WHERE loginuser = %s'
+        return await _executar('fetchval', query, loginuser) or 0
+    except Exception as ex:
+        print(f"Erro ao contar produtos: {ex}")
+        return 0
+
+async def adicionarProduto(nome, loginuser, qtde, preco):
+    try:
+        qtde, preco = _quantidadePreco(qtde, preco)
+        async with transacao():
+            id = await _executar('fetchval', SQL_INSERIR_PRODUTO, nome, qtde, preco, loginuser, LIMITE_PRODUTOS_NORMAL)
+            if id is not None:
+                await _incrementarVersaoProdutos(alterados=[id], nomes=[nome])
+        if id is None:
+            if await verificarSeLoginExiste(loginuser):
+                raise LimiteProdutosAtingido(f"Limite de {LIMITE_PRODUTOS_NORMAL} produtos atingido para {loginuser}.")
+            print(f"Erro ao adicionar produto: usuário {loginuser} não encontrado.")
+            return None
+        print("Produto adicionado com sucesso.")
+        return id
+    except LimiteProdutosAtingido:
+        raise
+    except Exception as ex:
+        print(f"Erro ao adicionar produto: {ex}")
+        return None
+
+async def atualizarProduto(id, nome, qtde, preco):
+    try:
+        qtde, preco = _quantidadePreco(qtde, preco)
+        async with transacao():
+            anteriores = await _executar('fetch', SQL_ATUALIZAR_PRODUTO, nome, qtde, preco, id)
+            if anteriores:
+                await _incrementarVersaoProdutos(alterados=[id], nomes=[linha['nome'] for linha in anteriores] + [nome])
+        print("Produto atualizado com sucesso.")
+    except Exception as ex:
+        print(f"Erro ao atualizar produto: {ex}")
+
+async def excluirProduto(id):
+    try:
+        query = 'DELETE FROM produtos WHERE id = %s RETURNING nome'
+        async with transacao():
+            excluidos = await _executar('fetch', query, id)
+            if excluidos:
+                await _incrementarVersaoProdutos(excluidos=[id], nomes=[linha['nome'] for linha in excluidos])
+        print("Produto excluído com sucesso.")
+    except Exception as ex:
+        print(f"Erro ao excluir produto: {ex}")
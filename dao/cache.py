@@ -0,0 +1,192 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+AUSENTE = object()
+
+
+class CacheLRU:
+    def __init__(self, capacidade=1024, ttl=None):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._acertos = 0
+        self._falhas = 0
+        self._despejos = 0
+        self._expirados = 0
+        self._geracao = 0
+
+    def configurar(self, capacidade=None, ttl=AUSENTE):
+        with self._lock:
+            if capacidade is not None:
+                self.capacidade = capacidade
+            if ttl is not AUSENTE:
+                self.ttl = ttl
+            self._geracao += 1
+            self._itens.clear()
+
+    def obter(self, chave, padrao=AUSENTE):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                valor, expira_em = item
+                if expira_em is None or expira_em > time.monotonic():
+                    self._itens.move_to_end(chave)
+                    self._acertos += 1
+                    return valor
+                del self._itens[chave]
+                self._expirados += 1
+            self._falhas += 1
+            return padrao
+
+    def geracao(self):
+        return self._geracao
+
+    def definir(self, chave, valor, ttl=AUSENTE, geracao=None):
+        # Com geracao (lida antes de buscar o valor na origem), o valor não é
+        # guardado se houve uma invalidação no meio do caminho.
+        ttl = self.ttl if ttl is AUSENTE else ttl
+        expira_em = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if geracao is not None and geracao != self._geracao:
+                return
+            self._itens[chave] = (valor, expira_em)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+                self._despejos += 1
+
+    def remover(self, chave):
+        with self._lock:
+            self._geracao += 1
+            self._itens.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._geracao += 1
+            self._itens.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'itens': len(self._itens),
+                'capacidade': self.capacidade,
+                'acertos': self._acertos,
+                'falhas': self._falhas,
+                'despejos': self._despejos,
+                'expirados': self._expirados,
+            }
+
+
+class ClienteMemoria:
+    # Substituto local de um cache compartilhado (mesma interface get/set/delete/incr
+    # do cliente redis), útil em testes e em desenvolvimento.
+
+    def __init__(self):
+        self._dados = {}
+        self._lock = threading.Lock()
+
+    def _ler(self, chave):
+        # Chamado com o lock adquirido.
+        item = self._dados.get(chave)
+        if item is None:
+            return None
+        valor, expira_em = item
+        if expira_em is not None and expira_em <= time.monotonic():
+            del self._dados[chave]
+            return None
+        return valor
+
+    def get(self, chave):
+        with self._lock:
+            return self._ler(chave)
+
+    def set(self, chave, valor, ex=None):
+        with self._lock:
+            self._dados[chave] = (valor, time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *chaves):
+        with self._lock:
+            return sum(self._dados.pop(chave, None) is not None for chave in chaves)
+
+    def incr(self, chave):
+        with self._lock:
+            valor = int(self._ler(chave) or 0) + 1
+            self._dados[chave] = (str(valor).encode(), None)
+            return valor
+
+
+TTL_COMPARTILHADO_PADRAO = 300
+
+
+class CacheCompartilhado:
+    # Mesma interface de CacheLRU sobre um cliente externo (ex.: redis.Redis),
+    # para que vários processos enxerguem as mesmas entradas e invalidações.
+    # A geração é um contador no próprio cliente (INCR), incrementado a cada
+    # invalidação; toda entrada tem TTL, já que nenhum processo limpa o cache
+    # inteiro.
+
+    def __init__(self, cliente, prefixo='atvd:', ttl=TTL_COMPARTILHADO_PADRAO):
+        self.cliente = cliente
+        self.prefixo = prefixo
+        self.ttl = ttl or TTL_COMPARTILHADO_PADRAO
+        self._chave_geracao = prefixo + 'geracao'
+        self._lock = threading.Lock()
+        self._acertos = 0
+        self._falhas = 0
+        self._descartados = 0
+
+    def configurar(self, capacidade=None, ttl=AUSENTE):
+        if ttl is not AUSENTE:
+            self.ttl = ttl or TTL_COMPARTILHADO_PADRAO
+
+    def obter(self, chave, padrao=AUSENTE):
+        dados = self.cliente.get(self.prefixo + chave)
+        with self._lock:
+            if dados is None:
+                self._falhas += 1
+                return padrao
+            self._acertos += 1
+        return pickle.loads(dados)
+
+    def geracao(self):
+        return int(self.cliente.get(self._chave_geracao) or 0)
+
+    def definir(self, chave, valor, ttl=AUSENTE, geracao=None):
+        ttl = self.ttl if ttl is AUSENTE or not ttl else ttl
+        if geracao is not None and geracao != self.geracao():
+            self._contarDescarte()
+            return
+        self.cliente.set(self.prefixo + chave, pickle.dumps(valor), ex=max(1, int(ttl)))
+        if geracao is not None and geracao != self.geracao():
+            # Invalidação entre a conferência e o set: o valor pode ser anterior a ela.
+            self.cliente.delete(self.prefixo + chave)
+            self._contarDescarte()
+
+    def _contarDescarte(self):
+        with self._lock:
+            self._descartados += 1
+
+    def remover(self, chave):
+        # A geração sobe antes do delete, como em CacheLRU: uma leitura em curso
+        # não grava de volta o valor antigo.
+        self.cliente.incr(self._chave_geracao)
+        self.cliente.delete(self.prefixo + chave)
+
+    def limpar(self):
+        # As entradas dos outros processos não são apagadas (expiram pelo TTL);
+        # só as leituras em curso deixam de gravar.
+        self.cliente.incr(self._chave_geracao)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'acertos': self._acertos,
+                'falhas': self._falhas,
+                'descartados': self._descartados,
+                'ttl': self.ttl,
+            }
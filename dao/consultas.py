@@ -0,0 +1,75 @@
+import re
+
+import psycopg2
+from psycopg2 import extensions
+
+
+# Consultas frequentes preparadas uma vez por conexão (PREPARE, quando o pool a
+# cria) e executadas com EXECUTE: o servidor deixa de refazer parse e
+# planejamento a cada chamada. As colunas são explícitas porque um plano
+# guardado com SELECT * quebra ("cached plan must not change result type")
+# quando uma coluna é adicionada à tabela.
+
+COLUNAS_USUARIO = 'loginuser, senha, tipouser'
+COLUNAS_PRODUTO = 'id, nome, loginuser, qtde, preco'
+
+CONSULTAS = {}
+
+def registrarConsulta(nome, tipos, query):
+    # query no formato do psycopg2 (%s), um parâmetro por tipo, na ordem.
+    if query.count('%s') != len(tipos):
+        raise ValueError(f"Consulta {nome}: {len(tipos)} tipos para {query.count('%s')} parâmetros.")
+    CONSULTAS[nome] = (tipos, query)
+
+registrarConsulta('usuario_por_login', ('text',), f'SELECT {COLUNAS_USUARIO} FROM usuario WHERE loginuser = %s')
+registrarConsulta('usuario_existe', ('text',), 'SELECT 1 FROM usuario WHERE loginuser = %s')
+registrarConsulta('senha_usuario', ('text',), 'SELECT senha FROM usuario WHERE loginuser = %s')
+registrarConsulta('claims_usuario', ('text',), 'SELECT tipouser, versao_token FROM usuario WHERE loginuser = %s')
+registrarConsulta('produto_por_id', ('integer',), f'SELECT {COLUNAS_PRODUTO} FROM produtos WHERE id = %s')
+registrarConsulta('produto_por_nome', ('text',), f'SELECT {COLUNAS_PRODUTO} FROM produtos WHERE nome = %s')
+registrarConsulta('contar_produtos', ('text',), 'SELECT qtde_produtos FROM usuario WHERE loginuser = %s')
+registrarConsulta('versao_produtos', (), 'SELECT versao, atualizado_em FROM produtos_versao WHERE id = 1')
+
+def _textoPrepare(nome):
+    tipos, query = CONSULTAS[nome]
+    contador = iter(range(1, len(tipos) + 1))
+    corpo = re.sub(r'%s', lambda _: f'${next(contador)}', query)
+    return f"PREPARE {nome} ({', '.join(tipos)}) AS {corpo}" if tipos else f'PREPARE {nome} AS {corpo}'
+
+
+class ConexaoPreparada(extensions.connection):
+    # connection_factory do pool: guarda o que já foi preparado nesta sessão.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+
+
+def preparar(conn):
+    # Chamado pelo pool para cada conexão nova. Uma consulta que falhar aqui
+    # (ex.: tabela ainda não criada) é preparada na primeira execução.
+    with conn.cursor() as cursor:
+        for nome in CONSULTAS:
+            try:
+                cursor.execute(_textoPrepare(nome))
+                conn.preparadas.add(nome)
+            except psycopg2.Error:
+                conn.rollback()
+    conn.commit()
+
+def executar(cursor, nome, parametros=()):
+    conn = cursor.connection
+    preparadas = getattr(conn, 'preparadas', None)
+    if preparadas is None:
+        # Conexão sem registro (DB_PREPARAR=0 ou criada fora do pool): texto comum.
+        cursor.execute(CONSULTAS[nome][1], parametros)
+        return cursor
+    if nome not in preparadas:
+        # PREPARE não é desfeito por rollback: vale para o resto da sessão.
+        cursor.execute(_textoPrepare(nome))
+        preparadas.add(nome)
+    if parametros:
+        cursor.execute(f"EXECUTE {nome} ({', '.join(['%s'] * len(parametros))})", parametros)
+    else:
+        cursor.execute(f'EXECUTE {nome}')
+    return cursor
@@ -0,0 +1,200 @@
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+
+from psycopg2 import extensions
+
+from dao.pool import LIMITES_ESPERA, HistogramaEspera
+
+
+# Métricas em memória (histogramas e contadores com rótulos) no formato texto
+# do Prometheus, e o cursor que mede cada consulta feita pelo dao.
+
+logger = logging.getLogger(__name__)
+
+MAX_SERIES_POR_FAMILIA = 1000
+
+
+def _escaparRotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _rotulos(nomes, valores, extra=None):
+    pares = [f'{nome}="{_escaparRotulo(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+def linhasHistograma(nome, nomes_rotulos, valores_rotulos, resumo):
+    # resumo no formato de HistogramaEspera.resumo() (buckets já acumulados).
+    linhas = []
+    for limite, acumulado in resumo['buckets'].items():
+        rotulos = _rotulos(nomes_rotulos, valores_rotulos, f'le="{limite}"')
+        linhas.append(f'{nome}_bucket{rotulos} {acumulado}')
+    rotulos = _rotulos(nomes_rotulos, valores_rotulos)
+    linhas.append(f'{nome}_sum{rotulos} {resumo["soma"]}')
+    linhas.append(f'{nome}_count{rotulos} {resumo["total"]}')
+    return linhas
+
+def linhasValores(nome, nomes_rotulos, amostras):
+    return [f'{nome}{_rotulos(nomes_rotulos, valores)} {valor}' for valores, valor in amostras]
+
+
+class _Familia:
+
+    def __init__(self, nome, ajuda, rotulos):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, valores):
+        # Limita a cardinalidade: séries novas além do máximo vão para "outras".
+        if valores in self._series or len(self._series) < MAX_SERIES_POR_FAMILIA:
+            return valores
+        return tuple('outras' for _ in self.rotulos)
+
+
+class FamiliaHistogramas(_Familia):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_ESPERA):
+        super().__init__(nome, ajuda, rotulos)
+        self.limites = limites
+
+    def registrar(self, valores, segundos):
+        with self._lock:
+            chave = self._chave(valores)
+            histograma = self._series.get(chave)
+            if histograma is None:
+                histograma = self._series[chave] = HistogramaEspera(self.limites)
+            histograma.registrar(segundos)
+
+    def linhas(self):
+        with self._lock:
+            series = [(valores, histograma.resumo()) for valores, histograma in self._series.items()]
+        linhas = []
+        for valores, resumo in series:
+            linhas.extend(linhasHistograma(self.nome, self.rotulos, valores, resumo))
+        return linhas
+
+
+class FamiliaContadores(_Familia):
+    tipo = 'counter'
+
+    def incrementar(self, valores, quantidade=1):
+        with self._lock:
+            chave = self._chave(valores)
+            self._series[chave] = self._series.get(chave, 0) + quantidade
+
+    def linhas(self):
+        with self._lock:
+            amostras = list(self._series.items())
+        return linhasValores(self.nome, self.rotulos, amostras)
+
+
+class Registro:
+
+    def __init__(self):
+        self._familias = []
+        self._coletores = []
+
+    def histograma(self, nome, ajuda, rotulos=(), limites=LIMITES_ESPERA):
+        familia = FamiliaHistogramas(nome, ajuda, rotulos, limites)
+        self._familias.append(familia)
+        return familia
+
+    def contador(self, nome, ajuda, rotulos=()):
+        familia = FamiliaContadores(nome, ajuda, rotulos)
+        self._familias.append(familia)
+        return familia
+
+    def coletor(self, funcao):
+        # funcao() devolve linhas prontas (com # HELP/# TYPE), calculadas na hora da coleta.
+        self._coletores.append(funcao)
+        return funcao
+
+    def formatoPrometheus(self):
+        linhas = []
+        for familia in self._familias:
+            linhas.append(f'# HELP {familia.nome} {familia.ajuda}')
+            linhas.append(f'# TYPE {familia.nome} {familia.tipo}')
+            linhas.extend(familia.linhas())
+        for coletor in self._coletores:
+            linhas.extend(coletor())
+        return '\n'.join(linhas) + '\n'
+
+
+registro = Registro()
+
+_consultas = registro.histograma(
+    'db_consulta_segundos', 'Duração das consultas ao banco, por consulta normalizada.', ('consulta',))
+_linhas = registro.contador(
+    'db_consulta_linhas_total', 'Linhas devolvidas ou afetadas, por consulta normalizada.', ('consulta',))
+
+_limite_lento = {'segundos': 0.5}
+
+def configurar(limite_lento_ms=None):
+    if limite_lento_ms is not None:
+        _limite_lento['segundos'] = float(limite_lento_ms) / 1000
+
+
+_LITERAIS = re.compile(r"'(?:[^']|'')*'|%s|\b\d+(?:\.\d+)?\b")
+_ITEM = r"(?:\?|NULL)(?:::\w+)?"
+_LISTAS = re.compile(rf"\({_ITEM}(?:, ?{_ITEM})*\)(?:, ?\({_ITEM}(?:, ?{_ITEM})*\))*")
+_ARRAYS = re.compile(rf"ARRAY\[{_ITEM}(?:, ?{_ITEM})*\]")
+_ESPACOS = re.compile(r'\s+')
+
+MAX_CONSULTA_EM_CACHE = 4096
+
+def _normalizar(query):
+    # Texto da consulta sem valores: literais e parâmetros viram ?, listas de
+    # VALUES (execute_values) e ARRAY[...] viram uma só entrada.
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    texto = _ESPACOS.sub(' ', _LITERAIS.sub('?', query)).strip()
+    texto = _ARRAYS.sub('ARRAY[...]', _LISTAS.sub('(...)', texto))
+    return texto[:300]
+
+_normalizarComCache = lru_cache(maxsize=2048)(_normalizar)
+
+def impressaoDigital(query):
+    # Consultas já com os valores embutidos (execute_values, lotes) não vão para o cache.
+    if len(query) > MAX_CONSULTA_EM_CACHE:
+        return _normalizar(query)
+    return _normalizarComCache(query)
+
+def registrarConsulta(query, segundos, linhas):
+    consulta = impressaoDigital(query)
+    _consultas.registrar((consulta,), segundos)
+    if linhas > 0:
+        _linhas.incrementar((consulta,), linhas)
+    if segundos >= _limite_lento['segundos']:
+        logger.warning("Consulta lenta (%.1f ms, %d linhas): %s", segundos * 1000, linhas, consulta)
+
+
+class CursorMedido(extensions.cursor):
+    # cursor_factory das conexões do pool: cada execute/copy entra nas métricas.
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            registrarConsulta(query, time.perf_counter() - inicio, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            registrarConsulta(query, time.perf_counter() - inicio, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        inicio = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            registrarConsulta(sql, time.perf_counter() - inicio, self.rowcount)
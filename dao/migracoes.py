@@ -0,0 +1,370 @@
+import json
+import os
+
+import psycopg2
+from psycopg2 import errors
+
+from dao.consultas import CONSULTAS, COLUNAS_PRODUTO
+from dao.pool import parametrosConexao
+
+
+# Esquema do banco em migrações numeradas, aplicadas em ordem e uma única vez
+# (registradas em esquema_migracoes), cada uma na sua própria transação. Um
+# advisory lock impede que dois processos migrem ao mesmo tempo. A migração que
+# depende de algo ausente no servidor (ex.: a extensão pg_trgm) levanta
+# MigracaoAdiada: fica pendente e é tentada de novo na próxima execução.
+#
+#     python migrar.py aplicar | situacao | verificar
+
+TRAVA_MIGRACOES = 4_271_985
+
+SQL_ESQUEMA_MIGRACOES = """
+    CREATE TABLE IF NOT EXISTS esquema_migracoes (
+        versao integer PRIMARY KEY,
+        nome varchar(100) NOT NULL,
+        aplicada_em timestamptz NOT NULL DEFAULT now()
+    )
+"""
+
+
+class MigracaoAdiada(Exception):
+    pass
+
+
+MIGRACOES = []
+
+def migracao(versao, nome):
+    def registrar(funcao):
+        MIGRACOES.append((versao, nome, funcao))
+        MIGRACOES.sort(key=lambda item: item[0])
+        return funcao
+    return registrar
+
+def _coluna(cursor, tabela, coluna):
+    cursor.execute("""
+        SELECT data_type, character_maximum_length, numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+    """, (tabela, coluna))
+    return cursor.fetchone()
+
+def _temIndice(cursor, tabela, coluna, unico=False):
+    # Algum índice (ou restrição) cuja primeira coluna é a pedida.
+    cursor.execute("""
+        SELECT 1 FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = to_regclass(%s) AND a.attname = %s AND (i.indisunique OR NOT %s)
+    """, (tabela, coluna, unico))
+    return cursor.fetchone() is not None
+
+@migracao(1, 'esquema_inicial')
+def _esquemaInicial(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usuario (
+            loginuser varchar(50) PRIMARY KEY,
+            senha varchar(255),
+            tipouser varchar(20)
+        );
+        CREATE TABLE IF NOT EXISTS produtos (
+            id serial PRIMARY KEY,
+            nome varchar(100),
+            loginuser varchar(50) REFERENCES usuario (loginuser),
+            qtde integer,
+            preco numeric(10, 2)
+        );
+    """)
+    # Bancos criados à mão antes das migrações podem não ter a chave em loginuser.
+    if not _temIndice(cursor, 'usuario', 'loginuser', unico=True):
+        cursor.execute('CREATE UNIQUE INDEX usuario_loginuser_key ON usuario (loginuser)')
+
+TAMANHO_COLUNA_SENHA = 255
+
+@migracao(2, 'senhas_scrypt')
+def _senhasScrypt(cursor):
+    # Hashes scrypt têm 162 caracteres; amplia a coluna se ela for menor.
+    coluna = _coluna(cursor, 'usuario', 'senha')
+    if coluna and coluna[1] is not None and coluna[1] < TAMANHO_COLUNA_SENHA:
+        cursor.execute(f'ALTER TABLE usuario ALTER COLUMN senha TYPE varchar({TAMANHO_COLUNA_SENHA})')
+
+@migracao(3, 'versao_token')
+def _versaoToken(cursor):
+    cursor.execute('ALTER TABLE usuario ADD COLUMN IF NOT EXISTS versao_token integer NOT NULL DEFAULT 0')
+
+@migracao(4, 'versao_produtos')
+def _versaoProdutos(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS produtos_versao (
+            id integer PRIMARY KEY CHECK (id = 1),
+            versao bigint NOT NULL DEFAULT 0,
+            atualizado_em timestamptz NOT NULL DEFAULT clock_timestamp()
+        );
+        INSERT INTO produtos_versao (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+        CREATE TABLE IF NOT EXISTS produtos_alteracoes (
+            id integer PRIMARY KEY,
+            versao bigint NOT NULL,
+            excluido boolean NOT NULL DEFAULT false
+        );
+        CREATE INDEX IF NOT EXISTS produtos_alteracoes_versao_idx ON produtos_alteracoes (versao);
+        ALTER TABLE produtos_versao ADD COLUMN IF NOT EXISTS alteracoes_desde bigint;
+        UPDATE produtos_versao SET alteracoes_desde = versao WHERE id = 1 AND alteracoes_desde IS NULL;
+    """)
+
+@migracao(5, 'tarefas')
+def _tarefas(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tarefas (
+            id varchar(32) PRIMARY KEY,
+            tipo varchar(50) NOT NULL,
+            parametros jsonb NOT NULL DEFAULT '{}',
+            dono varchar(50),
+            chave text,
+            estado varchar(20) NOT NULL DEFAULT 'pendente',
+            erro text,
+            resultado bytea,
+            tipo_conteudo varchar(100),
+            criado_em timestamptz NOT NULL DEFAULT now(),
+            iniciado_em timestamptz,
+            concluido_em timestamptz
+        );
+        CREATE INDEX IF NOT EXISTS tarefas_pendentes_idx ON tarefas (criado_em) WHERE estado = 'pendente';
+        CREATE INDEX IF NOT EXISTS tarefas_chave_idx ON tarefas (chave) WHERE chave IS NOT NULL;
+    """)
+
+@migracao(6, 'tipos_produtos')
+def _tiposProdutos(cursor):
+    # Quantidade inteira e preço decimal exato (nada de float/texto), só se diferentes.
+    alteracoes = []
+    if _coluna(cursor, 'produtos', 'qtde')[0] != 'integer':
+        alteracoes.append('ALTER COLUMN qtde TYPE integer USING qtde::integer')
+    if _coluna(cursor, 'produtos', 'preco')[:4] != ('numeric', None, 10, 2):
+        alteracoes.append('ALTER COLUMN preco TYPE numeric(10, 2) USING preco::numeric(10, 2)')
+    if alteracoes:
+        cursor.execute('ALTER TABLE produtos ' + ', '.join(alteracoes))
+
+@migracao(7, 'indices_produtos')
+def _indicesProdutos(cursor):
+    # loginuser: chave estrangeira (produtos de um dono, exclusão de usuários).
+    # (nome, id): buscarProdutoPorNome e a paginação por nome.
+    if not _temIndice(cursor, 'produtos', 'loginuser'):
+        cursor.execute('CREATE INDEX produtos_loginuser_idx ON produtos (loginuser)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS produtos_nome_id_idx ON produtos (nome, id)')
+    cursor.execute('ANALYZE produtos')
+
+@migracao(8, 'busca_trigrama')
+def _buscaTrigrama(cursor):
+    # A busca por nome é ILIKE '%texto%', que só usa índice com trigramas.
+    # Nenhuma migração seguinte depende desta: sem a extensão (ou sem permissão
+    # para criá-la) ela fica adiada e as demais seguem.
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    if cursor.fetchone() is None:
+        raise MigracaoAdiada('extensão pg_trgm indisponível no servidor.')
+    try:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except (errors.InsufficientPrivilege, errors.UndefinedFile, errors.FeatureNotSupported) as ex:
+        raise MigracaoAdiada(f'não foi possível criar a extensão pg_trgm: {ex}'.strip())
+    cursor.execute('CREATE INDEX IF NOT EXISTS produtos_nome_trgm_idx ON produtos USING gin (nome gin_trgm_ops)')
+
+@migracao(9, 'contagem_produtos')
+def _contagemProdutos(cursor):
+    # usuario.qtde_produtos acompanha a tabela produtos por gatilho de comando
+    # (uma atualização por dono, mesmo num COPY de milhares de linhas), então
+    # vale para qualquer escrita, inclusive as feitas fora do dao.
+    cursor.execute("""
+        ALTER TABLE usuario ADD COLUMN IF NOT EXISTS qtde_produtos integer NOT NULL DEFAULT 0;
+
+        CREATE OR REPLACE FUNCTION produtos_contagem_usuario() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                UPDATE usuario SET qtde_produtos = 0 WHERE qtde_produtos <> 0;
+            ELSIF TG_OP = 'INSERT' THEN
+                UPDATE usuario u SET qtde_produtos = u.qtde_produtos + d.total
+                FROM (SELECT loginuser, count(*) AS total FROM novos GROUP BY loginuser) d
+                WHERE u.loginuser = d.loginuser;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE usuario u SET qtde_produtos = u.qtde_produtos - d.total
+                FROM (SELECT loginuser, count(*) AS total FROM antigos GROUP BY loginuser) d
+                WHERE u.loginuser = d.loginuser;
+            ELSE
+                -- Só toca os usuários cujo total mudou (troca de dono).
+                UPDATE usuario u SET qtde_produtos = u.qtde_produtos + d.total
+                FROM (
+                    SELECT loginuser, sum(delta) AS total
+                    FROM (SELECT loginuser, 1 AS delta FROM novos
+                          UNION ALL SELECT loginuser, -1 FROM antigos) m
+                    GROUP BY loginuser HAVING sum(delta) <> 0
+                ) d
+                WHERE u.loginuser = d.loginuser;
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+
+        DROP TRIGGER IF EXISTS produtos_contagem_insercao ON produtos;
+        DROP TRIGGER IF EXISTS produtos_contagem_exclusao ON produtos;
+        DROP TRIGGER IF EXISTS produtos_contagem_alteracao ON produtos;
+        DROP TRIGGER IF EXISTS produtos_contagem_truncate ON produtos;
+        CREATE TRIGGER produtos_contagem_insercao AFTER INSERT ON produtos
+            REFERENCING NEW TABLE AS novos FOR EACH STATEMENT EXECUTE FUNCTION produtos_contagem_usuario();
+        CREATE TRIGGER produtos_contagem_exclusao AFTER DELETE ON produtos
+            REFERENCING OLD TABLE AS antigos FOR EACH STATEMENT EXECUTE FUNCTION produtos_contagem_usuario();
+        CREATE TRIGGER produtos_contagem_alteracao AFTER UPDATE ON produtos
+            REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION produtos_contagem_usuario();
+        CREATE TRIGGER produtos_contagem_truncate AFTER TRUNCATE ON produtos
+            FOR EACH STATEMENT EXECUTE FUNCTION produtos_contagem_usuario();
+
+        -- CREATE TRIGGER já travou as escritas em produtos até o commit: a
+        -- contagem inicial não perde nenhuma alteração concorrente.
+        UPDATE usuario u SET qtde_produtos = (SELECT count(*) FROM produtos p WHERE p.loginuser = u.loginuser);
+    """)
+
+@migracao(10, 'tokens_revogados')
+def _tokensRevogados(cursor):
+    # Logouts sobrevivem a um restart e, como o aumento de versao_token, chegam
+    # a todos os processos pelo canal tokens (dao.notificacoes), escritos por
+    # qualquer caminho.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tokens_revogados (
+            jti varchar(64) PRIMARY KEY,
+            loginuser varchar(50),
+            expira_em timestamptz NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tokens_revogados_expira_em_idx ON tokens_revogados (expira_em);
+
+        CREATE OR REPLACE FUNCTION tokens_notificar_revogacao() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_TABLE_NAME = 'usuario' THEN
+                PERFORM pg_notify('tokens', json_build_object('login', NEW.loginuser, 'versao', NEW.versao_token)::text);
+            ELSE
+                PERFORM pg_notify('tokens', json_build_object(
+                    'jti', NEW.jti, 'expira_em', extract(epoch FROM NEW.expira_em))::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+
+        DROP TRIGGER IF EXISTS usuario_versao_token_notificar ON usuario;
+        DROP TRIGGER IF EXISTS tokens_revogados_notificar ON tokens_revogados;
+        CREATE TRIGGER usuario_versao_token_notificar AFTER UPDATE OF versao_token ON usuario
+            FOR EACH ROW WHEN (NEW.versao_token > OLD.versao_token)
+            EXECUTE FUNCTION tokens_notificar_revogacao();
+        CREATE TRIGGER tokens_revogados_notificar AFTER INSERT ON tokens_revogados
+            FOR EACH ROW EXECUTE FUNCTION tokens_notificar_revogacao();
+    """)
+
+def _versoesAplicadas(cursor):
+    cursor.execute('SELECT versao, nome, aplicada_em FROM esquema_migracoes ORDER BY versao')
+    return {versao: (nome, aplicada_em) for versao, nome, aplicada_em in cursor.fetchall()}
+
+def aplicarMigracoes(config=None, ate=None):
+    conn = psycopg2.connect(**parametrosConexao(config))
+    aplicadas = []
+    try:
+        with conn.cursor() as cursor:
+            # A trava é da sessão: é liberada quando a conexão fecha.
+            cursor.execute('SELECT pg_advisory_lock(%s)', (TRAVA_MIGRACOES,))
+            cursor.execute(SQL_ESQUEMA_MIGRACOES)
+            feitas = _versoesAplicadas(cursor)
+            conn.commit()
+            for versao, nome, funcao in MIGRACOES:
+                if versao in feitas or (ate is not None and versao > ate):
+                    continue
+                try:
+                    funcao(cursor)
+                except MigracaoAdiada as ex:
+                    conn.rollback()
+                    print(f"Migração {versao} ({nome}) adiada: {ex}")
+                    continue
+                except Exception:
+                    conn.rollback()
+                    raise
+                cursor.execute('INSERT INTO esquema_migracoes (versao, nome) VALUES (%s, %s)', (versao, nome))
+                conn.commit()
+                aplicadas.append(versao)
+                print(f"Migração {versao} ({nome}) aplicada.")
+    finally:
+        conn.close()
+    return aplicadas
+
+def aplicarNaInicializacao(config=None):
+    # Com DB_MIGRAR=0 o esquema fica por conta do deploy (python migrar.py aplicar).
+    config = config or {}
+    habilitado = config.get('DB_MIGRAR')
+    if habilitado is None:
+        habilitado = os.environ.get('DB_MIGRAR', '1')
+    if str(habilitado).lower() not in ('1', 'true', 'sim', 'yes'):
+        return []
+    try:
+        return aplicarMigracoes(config)
+    except Exception as ex:
+        print(f"Erro ao aplicar migrações: {ex}")
+        return []
+
+def situacaoMigracoes(config=None):
+    conn = psycopg2.connect(**parametrosConexao(config))
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_ESQUEMA_MIGRACOES)
+            feitas = _versoesAplicadas(cursor)
+            conn.commit()
+    finally:
+        conn.close()
+    return [
+        {
+            'versao': versao,
+            'nome': nome,
+            'aplicada_em': feitas[versao][1].isoformat() if versao in feitas else None,
+        }
+        for versao, nome, _ in MIGRACOES
+    ]
+
+# Consultas frequentes do dao conferidas por verificarIndices, com parâmetros de
+# exemplo: todas as do registro de dao.consultas e a busca por nome.
+VERIFICACOES = {nome: (query, ('verificacao',) * len(tipos)) for nome, (tipos, query) in CONSULTAS.items()}
+VERIFICACOES['produto_por_id'] = (CONSULTAS['produto_por_id'][1], (1,))
+VERIFICACOES['busca_nome'] = (f'SELECT {COLUNAS_PRODUTO} FROM produtos WHERE nome ILIKE %s', ('%verificacao%',))
+VERIFICACOES['produtos_por_usuario'] = (f'SELECT {COLUNAS_PRODUTO} FROM produtos WHERE loginuser = %s', ('verificacao',))
+
+def registrarVerificacao(nome, query, parametros):
+    # Para consultas montadas fora daqui (ex.: a paginação por chave do dao).
+    VERIFICACOES[nome] = (query, tuple(parametros))
+
+TIPOS_BUSCA_INDICE = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+def _buscasIndice(plano):
+    # Nós que usam um índice para o filtro (Index Cond), não só para percorrer a tabela.
+    encontrados = []
+    if plano.get('Node Type') in TIPOS_BUSCA_INDICE and 'Index Cond' in plano:
+        encontrados.append(plano['Index Name'])
+    for filho in plano.get('Plans', ()):
+        encontrados += _buscasIndice(filho)
+    return encontrados
+
+def verificarIndices(config=None, planejador_real=False):
+    # Sem planejador_real, seq scan é desabilitado: em tabelas pequenas o
+    # planejador o prefere mesmo com índice, e o que se quer saber é se existe
+    # um índice que a consulta consegue usar.
+    conn = psycopg2.connect(**parametrosConexao(config))
+    resultados = {}
+    try:
+        with conn.cursor() as cursor:
+            if not planejador_real:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            for nome, (query, parametros) in VERIFICACOES.items():
+                try:
+                    cursor.execute('EXPLAIN (FORMAT JSON) ' + query, parametros)
+                except psycopg2.Error as ex:
+                    conn.rollback()
+                    if not planejador_real:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                    resultados[nome] = {'ok': False, 'erro': str(ex).strip()}
+                    continue
+                plano = cursor.fetchone()[0]
+                if isinstance(plano, str):
+                    plano = json.loads(plano)
+                indices = _buscasIndice(plano[0]['Plan'])
+                resultados[nome] = {'ok': bool(indices), 'indices': indices, 'no_raiz': plano[0]['Plan']['Node Type']}
+        conn.rollback()
+    finally:
+        conn.close()
+    return resultados
@@ -0,0 +1,192 @@
+import json
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions, sql
+
+from dao.pool import parametrosConexao
+
+
+# Um único LISTEN por canal e processo, repassado às assinaturas (ex.: cada
+# conexão SSE de /api/produtos/stream). A conexão do LISTEN é própria, fora do
+# pool, e só existe enquanto houver assinaturas. Uma assinatura com função
+# (ex.: a lista de revogação de tokens) recebe os eventos na thread do LISTEN.
+
+CANAL_PRODUTOS = 'produtos'
+# Publicado pelos gatilhos da migração 10 (logout e aumento de versao_token).
+CANAL_TOKENS = 'tokens'
+# Publicado por dao.tarefas.FilaPostgres a cada tarefa enfileirada.
+CANAL_TAREFAS = 'tarefas'
+REINICIAR = {"tipo": "reiniciar"}
+
+
+class AssinaturasEsgotadas(Exception):
+    pass
+
+
+class Assinatura:
+
+    def __init__(self, ouvinte, tamanho_fila, funcao=None):
+        self._ouvinte = ouvinte
+        self._fila = queue.Queue(maxsize=tamanho_fila)
+        self.funcao = funcao
+
+    def entregar(self, evento):
+        if self.funcao is not None:
+            try:
+                self.funcao(evento)
+            except Exception as ex:
+                print(f"Erro ao tratar evento de {self._ouvinte.canal}: {ex}")
+            return
+        try:
+            self._fila.put_nowait(evento)
+        except queue.Full:
+            # Assinante lento: o acumulado é descartado e ele deve refazer o delta.
+            while True:
+                try:
+                    self._fila.get_nowait()
+                except queue.Empty:
+                    break
+            self._fila.put_nowait(REINICIAR)
+
+    def proximo(self, timeout=None):
+        try:
+            return self._fila.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def cancelar(self):
+        self._ouvinte.cancelar(self)
+
+
+class OuvinteNotificacoes:
+
+    def __init__(self, canal, tamanho_fila=256, max_assinaturas=100, intervalo=5):
+        self.canal = canal
+        self.tamanho_fila = tamanho_fila
+        self.max_assinaturas = max_assinaturas
+        self.intervalo = intervalo
+        self._parametros = None
+        self._assinaturas = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pronto = threading.Event()
+        self._recebidas = 0
+        self._reconexoes = 0
+        self._recarregar = False
+        os.register_at_fork(after_in_child=self._aposFork)
+
+    def configurar(self, config=None, tamanho_fila=None, max_assinaturas=None):
+        parametros = parametrosConexao(config)
+        with self._lock:
+            self._parametros = parametros
+            if tamanho_fila is not None:
+                self.tamanho_fila = tamanho_fila
+            if max_assinaturas is not None:
+                self.max_assinaturas = max_assinaturas
+
+    def assinar(self, funcao=None):
+        with self._lock:
+            if len(self._assinaturas) >= self.max_assinaturas:
+                raise AssinaturasEsgotadas(f"Limite de {self.max_assinaturas} assinaturas atingido.")
+            assinatura = Assinatura(self, self.tamanho_fila, funcao)
+            self._assinaturas.add(assinatura)
+            self._iniciar()
+        # Quem assina em seguida lê o estado atual (delta); o LISTEN precisa estar
+        # ativo antes, senão uma alteração entre as duas coisas se perderia.
+        self._pronto.wait(timeout=self.intervalo)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+    def _iniciar(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._executar, name=f'listen-{self.canal}', daemon=True)
+            self._thread.start()
+
+    def _aposFork(self):
+        # O processo filho (ex.: worker do gunicorn com --preload) não herda a
+        # thread. Só as assinaturas com função continuam valendo; elas recebem
+        # REINICIAR ao conectar, pelo que foi publicado desde a carga no pai.
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pronto = threading.Event()
+        self._assinaturas = {a for a in self._assinaturas if a.funcao is not None}
+        if self._assinaturas:
+            self._recarregar = True
+            self._iniciar()
+
+    def _distribuir(self, evento):
+        with self._lock:
+            assinaturas = list(self._assinaturas)
+        for assinatura in assinaturas:
+            assinatura.entregar(evento)
+
+    def _encerrarSemAssinaturas(self):
+        with self._lock:
+            if self._assinaturas:
+                return False
+            self._thread = None
+            self._pronto.clear()
+            return True
+
+    def _executar(self):
+        espera = 1
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**(self._parametros or parametrosConexao()))
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(sql.SQL('LISTEN {}').format(sql.Identifier(self.canal)))
+                self._pronto.set()
+                if self._recarregar:
+                    # Eventos enviados enquanto a conexão estava caída foram perdidos.
+                    self._recarregar = False
+                    self._distribuir(REINICIAR)
+                espera = 1
+                while True:
+                    if select.select([conn], [], [], self.intervalo) == ([], [], []):
+                        if self._encerrarSemAssinaturas():
+                            return
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notificacao = conn.notifies.pop(0)
+                        self._recebidas += 1
+                        evento = json.loads(notificacao.payload)
+                        evento["tipo"] = self.canal
+                        self._distribuir(evento)
+            except Exception as ex:
+                print(f"Erro no LISTEN {self.canal}: {ex}")
+                self._pronto.clear()
+                self._reconexoes += 1
+                self._recarregar = True
+                if self._encerrarSemAssinaturas():
+                    return
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'assinaturas': len(self._assinaturas),
+                'max_assinaturas': self.max_assinaturas,
+                'ativo': self._thread is not None,
+                'recebidas': self._recebidas,
+                'reconexoes': self._reconexoes,
+            }
+
+
+ouvinte = OuvinteNotificacoes(CANAL_PRODUTOS)
+ouvinte_tokens = OuvinteNotificacoes(CANAL_TOKENS)
+ouvinte_tarefas = OuvinteNotificacoes(CANAL_TAREFAS)
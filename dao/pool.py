@@ -0,0 +1,286 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+
+LIMITES_ESPERA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONFIGURACAO_PADRAO = {
+    'DB_HOST': 'localhost',
+    'DB_PORT': '5432',
+    'DB_NAME': 'atvd1bcc',
+    'DB_USER': 'postgres',
+    'DB_PASSWORD': '12345678',
+    'DB_POOL_MIN': '1',
+    'DB_POOL_MAX': '10',
+    'DB_POOL_TIMEOUT': '30',
+    'DB_POOL_MAX_LIFETIME': '3600',
+    'DB_POOL_MAX_IDLE': '600',
+    'DB_POOL_PRE_PING': '1',
+    'DB_POOL_PING_OCIOSO': '5',
+    'DB_PREPARAR': '1',
+}
+
+
+class PoolEsgotado(PoolError):
+    pass
+
+
+def lerConfiguracao(config=None):
+    # Prioridade: config da aplicação, depois variáveis de ambiente, depois o padrão.
+    config = config or {}
+    valores = {}
+    for chave, padrao in CONFIGURACAO_PADRAO.items():
+        valor = config.get(chave)
+        if valor is None:
+            valor = os.environ.get(chave, padrao)
+        valores[chave] = valor
+
+    return {
+        'minimo': int(valores['DB_POOL_MIN']),
+        'maximo': int(valores['DB_POOL_MAX']),
+        'timeout': float(valores['DB_POOL_TIMEOUT']),
+        'vida_maxima': float(valores['DB_POOL_MAX_LIFETIME']),
+        'ocioso_maximo': float(valores['DB_POOL_MAX_IDLE']),
+        'pre_ping': str(valores['DB_POOL_PRE_PING']).lower() in ('1', 'true', 'sim', 'yes'),
+        'ping_ocioso': float(valores['DB_POOL_PING_OCIOSO']),
+        'preparar': str(valores['DB_PREPARAR']).lower() in ('1', 'true', 'sim', 'yes'),
+        'host': valores['DB_HOST'],
+        'port': int(valores['DB_PORT']),
+        'database': valores['DB_NAME'],
+        'user': valores['DB_USER'],
+        'password': valores['DB_PASSWORD'],
+    }
+
+
+def parametrosConexao(config=None):
+    # Só o necessário para psycopg2.connect, para conexões próprias fora do pool.
+    opcoes = lerConfiguracao(config)
+    return {chave: opcoes[chave] for chave in ('host', 'port', 'database', 'user', 'password')}
+
+
+class HistogramaEspera:
+
+    def __init__(self, limites=LIMITES_ESPERA):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def registrar(self, segundos):
+        self.contagens[bisect_left(self.limites, segundos)] += 1
+        self.soma += segundos
+        self.total += 1
+
+    def resumo(self):
+        acumulado = 0
+        buckets = {}
+        for limite, contagem in zip(self.limites, self.contagens):
+            acumulado += contagem
+            buckets[str(limite)] = acumulado
+        buckets['+Inf'] = self.total
+        return {'buckets': buckets, 'soma': self.soma, 'total': self.total}
+
+
+# Conexões livres são reaproveitadas em ordem LIFO: as que ficam no fundo da pilha
+# envelhecem e são recicladas após ocioso_maximo (sem descer abaixo de minimo).
+# Com o pool cheio, getconn espera até timeout por uma devolução.
+# O pre_ping só testa conexões paradas há mais de ping_ocioso segundos: as que
+# acabaram de voltar ao pool dispensam a ida ao servidor.
+# ao_conectar(conn) roda uma vez para cada conexão criada (ex.: os PREPARE de
+# dao.consultas).
+class PoolConexoes:
+    def __init__(self, minimo=1, maximo=10, timeout=30.0, vida_maxima=3600.0,
+                 ocioso_maximo=600.0, pre_ping=True, ping_ocioso=5.0, ao_conectar=None, **parametros_conexao):
+        if minimo < 0 or maximo < 1 or minimo > maximo:
+            raise ValueError(f"Limites de pool inválidos: minimo={minimo}, maximo={maximo}")
+
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout = timeout
+        self.vida_maxima = vida_maxima
+        self.ocioso_maximo = ocioso_maximo
+        self.pre_ping = pre_ping
+        self.ping_ocioso = ping_ocioso
+        self.ao_conectar = ao_conectar
+        self.parametros_conexao = parametros_conexao
+
+        self._condicao = threading.Condition()
+        self._livres = []
+        self._criadas_em = {}
+        self._em_uso = set()
+        self._abertas = 0
+        self._aguardando = 0
+        self._fechado = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._quebradas = 0
+        self._recicladas = 0
+        self._conexoes_criadas = 0
+        self._espera = HistogramaEspera()
+
+        for _ in range(minimo):
+            with self._condicao:
+                self._abertas += 1
+            conn = self._conectar()
+            with self._condicao:
+                self._livres.append((conn, time.monotonic()))
+
+    def _conectar(self):
+        conn = None
+        try:
+            conn = psycopg2.connect(**self.parametros_conexao)
+            if self.ao_conectar is not None:
+                self.ao_conectar(conn)
+        except Exception:
+            if conn is not None:
+                conn.close()
+            with self._condicao:
+                self._abertas -= 1
+                self._condicao.notify()
+            raise
+        with self._condicao:
+            self._criadas_em[id(conn)] = time.monotonic()
+            self._conexoes_criadas += 1
+        return conn
+
+    def _descartar(self, conn):
+        # Chamado com o lock adquirido.
+        self._criadas_em.pop(id(conn), None)
+        self._abertas -= 1
+        self._condicao.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expirada(self, conn, devolvida_em, agora):
+        if agora - self._criadas_em.get(id(conn), agora) > self.vida_maxima:
+            return True
+        return self._abertas > self.minimo and agora - devolvida_em > self.ocioso_maximo
+
+    def _ping(self, conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            # Em autocommit o SELECT não abre transação: nada a desfazer.
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        inicio = time.monotonic()
+        limite = inicio + timeout
+
+        while True:
+            conn = None
+            criar = False
+            ociosa = 0.0
+            with self._condicao:
+                while True:
+                    if self._fechado:
+                        raise PoolError("O pool de conexões está fechado.")
+
+                    agora = time.monotonic()
+                    while self._livres:
+                        candidata, devolvida_em = self._livres.pop()
+                        if self._expirada(candidata, devolvida_em, agora):
+                            self._recicladas += 1
+                            self._descartar(candidata)
+                            continue
+                        conn = candidata
+                        ociosa = agora - devolvida_em
+                        break
+
+                    if conn is not None:
+                        break
+                    if self._abertas < self.maximo:
+                        self._abertas += 1
+                        criar = True
+                        break
+
+                    restante = limite - agora
+                    if restante <= 0:
+                        self._timeouts += 1
+                        raise PoolEsgotado(
+                            f"Nenhuma conexão livre após {timeout:.1f}s "
+                            f"({self.maximo} em uso, {self._aguardando} aguardando).")
+                    self._aguardando += 1
+                    try:
+                        self._condicao.wait(restante)
+                    finally:
+                        self._aguardando -= 1
+
+            if criar:
+                conn = self._conectar()
+            elif self.pre_ping and ociosa > self.ping_ocioso and not self._ping(conn):
+                with self._condicao:
+                    self._quebradas += 1
+                    self._descartar(conn)
+                continue
+
+            with self._condicao:
+                self._em_uso.add(id(conn))
+                self._checkouts += 1
+                self._espera.registrar(time.monotonic() - inicio)
+            return conn
+
+    def putconn(self, conn, close=False):
+        with self._condicao:
+            if id(conn) not in self._em_uso:
+                raise PoolError("Conexão devolvida não pertence a este pool.")
+            self._em_uso.discard(id(conn))
+
+        descartar = close or self._fechado or conn.closed
+        if not descartar:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                descartar = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    descartar = True
+
+        with self._condicao:
+            if descartar:
+                if not close and not self._fechado:
+                    self._quebradas += 1
+                self._descartar(conn)
+            else:
+                self._livres.append((conn, time.monotonic()))
+                self._condicao.notify()
+
+    def closeall(self):
+        with self._condicao:
+            self._fechado = True
+            while self._livres:
+                conn, _ = self._livres.pop()
+                self._descartar(conn)
+            self._condicao.notify_all()
+
+    def estatisticas(self):
+        with self._condicao:
+            return {
+                'minimo': self.minimo,
+                'maximo': self.maximo,
+                'abertas': self._abertas,
+                'em_uso': len(self._em_uso),
+                'livres': len(self._livres),
+                'aguardando': self._aguardando,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'quebradas': self._quebradas,
+                'recicladas': self._recicladas,
+                'criadas': self._conexoes_criadas,
+                'espera_segundos': self._espera.resumo(),
+            }
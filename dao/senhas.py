@@ -0,0 +1,179 @@
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Hash de senhas (scrypt/pbkdf2 do werkzeug) calculado fora da thread da
+# requisição, em um pool de tamanho fixo com fila limitada. hashlib libera o GIL
+# durante o cálculo, então as threads do pool rodam em paralelo de verdade.
+
+CONFIGURACAO_PADRAO = {
+    'SENHA_METODO': 'scrypt:32768:8:1',
+    'SENHA_TRABALHADORES': str(os.cpu_count() or 1),
+    'SENHA_FILA_MAX': '64',
+    'SENHA_ESPERA_MAX': '5',
+}
+
+METODOS_HASH = ('scrypt:', 'pbkdf2:')
+
+
+class SenhasSobrecarregadas(Exception):
+    pass
+
+
+def lerConfiguracao(config=None):
+    config = config or {}
+    valores = {}
+    for chave, padrao in CONFIGURACAO_PADRAO.items():
+        valor = config.get(chave)
+        if valor is None:
+            valor = os.environ.get(chave, padrao)
+        valores[chave] = valor
+
+    return {
+        'metodo': valores['SENHA_METODO'],
+        'trabalhadores': int(valores['SENHA_TRABALHADORES']),
+        'fila_maxima': int(valores['SENHA_FILA_MAX']),
+        'espera_maxima': float(valores['SENHA_ESPERA_MAX']),
+    }
+
+
+class VerificadorSenhas:
+    # Aceita até trabalhadores + fila_maxima tarefas ao mesmo tempo; além disso
+    # espera no máximo espera_maxima por uma vaga e então recusa, em vez de
+    # deixar as requisições se acumularem atrás de um trabalho só de CPU.
+
+    def __init__(self, trabalhadores=1, fila_maxima=64, espera_maxima=5.0):
+        if trabalhadores < 1 or fila_maxima < 0:
+            raise ValueError(f"Limites inválidos: trabalhadores={trabalhadores}, fila_maxima={fila_maxima}")
+        self.trabalhadores = trabalhadores
+        self.fila_maxima = fila_maxima
+        self.espera_maxima = espera_maxima
+        self._executor = ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix='senhas')
+        self._vagas = threading.BoundedSemaphore(trabalhadores + fila_maxima)
+        self._lock = threading.Lock()
+        self._pendentes = 0
+        self._concluidas = 0
+        self._recusadas = 0
+
+    def _liberar(self, _futuro):
+        with self._lock:
+            self._pendentes -= 1
+            self._concluidas += 1
+        self._vagas.release()
+
+    def submeter(self, funcao, *args, espera=None):
+        # espera=0 não bloqueia (usado a partir do event loop da api_async).
+        espera = self.espera_maxima if espera is None else espera
+        if espera > 0:
+            obtida = self._vagas.acquire(timeout=espera)
+        else:
+            obtida = self._vagas.acquire(blocking=False)
+        if not obtida:
+            with self._lock:
+                self._recusadas += 1
+            raise SenhasSobrecarregadas("Muitas verificações de senha em andamento; tente novamente.")
+
+        with self._lock:
+            self._pendentes += 1
+        try:
+            futuro = self._executor.submit(funcao, *args)
+        except Exception:
+            with self._lock:
+                self._pendentes -= 1
+            self._vagas.release()
+            raise
+        futuro.add_done_callback(self._liberar)
+        return futuro
+
+    def executar(self, funcao, *args):
+        return self.submeter(funcao, *args).result()
+
+    def encerrar(self):
+        self._executor.shutdown(wait=False)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'trabalhadores': self.trabalhadores,
+                'fila_maxima': self.fila_maxima,
+                'pendentes': self._pendentes,
+                'concluidas': self._concluidas,
+                'recusadas': self._recusadas,
+            }
+
+
+_metodo = CONFIGURACAO_PADRAO['SENHA_METODO']
+_prefixo_metodo = {}
+_ficticio = {}
+_verificador = None
+_verificador_lock = threading.Lock()
+
+def configurar(config=None):
+    global _metodo, _verificador
+    opcoes = lerConfiguracao(config)
+    _metodo = opcoes.pop('metodo')
+    _prefixo_metodo.clear()
+    _ficticio.clear()
+    with _verificador_lock:
+        antigo = _verificador
+        _verificador = VerificadorSenhas(**opcoes)
+    if antigo is not None:
+        antigo.encerrar()
+
+def obterVerificador():
+    global _verificador
+    if _verificador is None:
+        with _verificador_lock:
+            if _verificador is None:
+                _verificador = VerificadorSenhas(**{
+                    chave: valor for chave, valor in lerConfiguracao().items() if chave != 'metodo'
+                })
+    return _verificador
+
+def ehHash(valor):
+    return isinstance(valor, str) and valor.startswith(METODOS_HASH)
+
+def gerarHash(senha):
+    return generate_password_hash(senha, method=_metodo)
+
+def _prefixoAtual():
+    # 'scrypt' e 'scrypt:32768:8:1' geram o mesmo prefixo; calculado uma vez por método.
+    if _metodo not in _prefixo_metodo:
+        _prefixo_metodo[_metodo] = generate_password_hash('', method=_metodo).split('$', 1)[0]
+    return _prefixo_metodo[_metodo]
+
+def conferir(armazenada, senha):
+    # Devolve (senha_confere, novo_hash). novo_hash vem preenchido quando a senha
+    # confere mas está em texto puro (linhas antigas) ou com outro método/custo.
+    if armazenada is None:
+        # Usuário inexistente: mesmo custo de um hash real, para não revelar quais logins existem.
+        check_password_hash(_hashFicticio(), senha or '')
+        return False, None
+    if senha is None:
+        return False, None
+    if not ehHash(armazenada):
+        confere = hmac.compare_digest(armazenada.encode(), senha.encode())
+        return confere, gerarHash(senha) if confere else None
+    if not check_password_hash(armazenada, senha):
+        return False, None
+    if armazenada.split('$', 1)[0] != _prefixoAtual():
+        return True, gerarHash(senha)
+    return True, None
+
+def _hashFicticio():
+    if _metodo not in _ficticio:
+        _ficticio[_metodo] = gerarHash(os.urandom(16).hex())
+    return _ficticio[_metodo]
+
+def hashSenha(senha):
+    return obterVerificador().executar(gerarHash, senha)
+
+def verificarSenha(armazenada, senha):
+    return obterVerificador().executar(conferir, armazenada, senha)
+
+def estatisticas():
+    return obterVerificador().estatisticas()
@@ -0,0 +1,389 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import dao
+from dao import notificacoes
+from dao.notificacoes import CANAL_TAREFAS
+
+
+# Tarefas demoradas (exportação, agregações do gráfico) executadas fora da
+# thread da requisição. A rota enfileira e devolve o id; um despachante por
+# processo (salvo TAREFAS_DESPACHANTE=0, ex.: scripts e processos que só
+# enfileiram) reserva as pendentes e as executa em threads ou processos.
+#
+# Filas:
+# - FilaPostgres: tabela tarefas, compartilhada entre processos (reserva com
+#   FOR UPDATE SKIP LOCKED). Status e resultado podem ser lidos de qualquer worker.
+#   Cada tarefa nova acorda os despachantes pelo canal tarefas (NOTIFY); a
+#   consulta a cada TAREFAS_INTERVALO só cobre uma notificação perdida.
+# - FilaMemoria: só o processo atual; para testes e desenvolvimento.
+
+PENDENTE = 'pendente'
+EXECUTANDO = 'executando'
+CONCLUIDA = 'concluida'
+FALHOU = 'falhou'
+
+CONFIGURACAO_PADRAO = {
+    'TAREFAS_BACKEND': 'postgres',
+    'TAREFAS_MODO': 'thread',
+    'TAREFAS_TRABALHADORES': '2',
+    'TAREFAS_INTERVALO': '30',
+    'TAREFAS_DESPACHANTE': '1',
+    'TAREFAS_RETENCAO': '3600',
+    'TAREFAS_TEMPO_MAX': '600',
+}
+
+def lerConfiguracao(config=None):
+    config = config or {}
+    valores = {}
+    for chave, padrao in CONFIGURACAO_PADRAO.items():
+        valor = config.get(chave)
+        valores[chave] = os.environ.get(chave, padrao) if valor is None else valor
+    return {
+        'backend': valores['TAREFAS_BACKEND'],
+        'modo': valores['TAREFAS_MODO'],
+        'trabalhadores': int(valores['TAREFAS_TRABALHADORES']),
+        'intervalo': float(valores['TAREFAS_INTERVALO']),
+        'retencao': float(valores['TAREFAS_RETENCAO']),
+        'tempo_max': float(valores['TAREFAS_TEMPO_MAX']),
+        'despachante': str(valores['TAREFAS_DESPACHANTE']).lower() in ('1', 'true', 'sim', 'yes'),
+    }
+
+
+# Tipos de tarefa: funcao(**parametros) -> (conteudo em bytes, tipo de conteúdo).
+# Ficam neste módulo para que os processos do modo "processo" os encontrem ao importá-lo.
+TIPOS = {}
+
+def tipoTarefa(nome):
+    def registrar(funcao):
+        TIPOS[nome] = funcao
+        return funcao
+    return registrar
+
+@tipoTarefa('exportar_produtos_csv')
+def _exportarProdutosCsv():
+    return b''.join(dao.exportarProdutosCsv()), 'text/csv'
+
+@tipoTarefa('grafico_dados')
+def _graficoDados(loginuser=None, top=None):
+    linhas = dao.agregarEstoquePorNome(loginuser=loginuser, limite=top)
+    if linhas is None:
+        raise RuntimeError("Erro ao agregar o estoque.")
+    dados = {"nome": [l[0] for l in linhas], "qtde": [l[1] for l in linhas]}
+    return json.dumps(dados).encode(), 'application/json'
+
+def executarTarefa(tipo, parametros):
+    return TIPOS[tipo](**parametros)
+
+
+def _situacao(id, tipo, estado, dono, erro, criado_em, iniciado_em, concluido_em):
+    return {
+        'id': id, 'tipo': tipo, 'estado': estado, 'dono': dono, 'erro': erro,
+        'criado_em': criado_em, 'iniciado_em': iniciado_em, 'concluido_em': concluido_em,
+    }
+
+
+class FilaMemoria:
+
+    def __init__(self):
+        self._tarefas = {}
+        self._pendentes = deque()
+        self._lock = threading.Lock()
+
+    def preparar(self):
+        pass
+
+    def acompanhar(self, acordar):
+        # Só este processo enfileira: o executor já se acorda sozinho.
+        pass
+
+    def adicionar(self, tipo, parametros, dono=None, chave=None):
+        id = uuid.uuid4().hex
+        with self._lock:
+            self._tarefas[id] = {
+                'id': id, 'tipo': tipo, 'parametros': parametros, 'dono': dono, 'chave': chave,
+                'estado': PENDENTE, 'erro': None, 'resultado': None, 'tipo_conteudo': None,
+                'criado_em': time.time(), 'iniciado_em': None, 'concluido_em': None,
+            }
+            self._pendentes.append(id)
+        return id
+
+    def buscarPorChave(self, chave):
+        with self._lock:
+            for tarefa in self._tarefas.values():
+                if tarefa['chave'] == chave and tarefa['estado'] != FALHOU:
+                    return self._descrever(tarefa)
+        return None
+
+    def reservar(self):
+        with self._lock:
+            while self._pendentes:
+                tarefa = self._tarefas.get(self._pendentes.popleft())
+                if tarefa is not None and tarefa['estado'] == PENDENTE:
+                    tarefa.update(estado=EXECUTANDO, iniciado_em=time.time())
+                    return tarefa['id'], tarefa['tipo'], tarefa['parametros']
+        return None
+
+    def concluir(self, id, resultado, tipo_conteudo):
+        with self._lock:
+            self._tarefas[id].update(estado=CONCLUIDA, resultado=resultado, tipo_conteudo=tipo_conteudo,
+                                     concluido_em=time.time())
+
+    def falhar(self, id, erro):
+        with self._lock:
+            self._tarefas[id].update(estado=FALHOU, erro=erro, concluido_em=time.time())
+
+    def _descrever(self, tarefa):
+        return _situacao(*(tarefa[campo] for campo in (
+            'id', 'tipo', 'estado', 'dono', 'erro', 'criado_em', 'iniciado_em', 'concluido_em')))
+
+    def buscar(self, id):
+        with self._lock:
+            tarefa = self._tarefas.get(id)
+            return self._descrever(tarefa) if tarefa is not None else None
+
+    def resultado(self, id):
+        with self._lock:
+            tarefa = self._tarefas.get(id)
+            if tarefa is None or tarefa['estado'] != CONCLUIDA:
+                return None
+            return tarefa['resultado'], tarefa['tipo_conteudo']
+
+    def limpar(self, retencao, tempo_max):
+        agora = time.time()
+        with self._lock:
+            for id, tarefa in list(self._tarefas.items()):
+                if tarefa['estado'] == EXECUTANDO and tarefa['iniciado_em'] < agora - tempo_max:
+                    tarefa.update(estado=FALHOU, erro="Tempo máximo de execução esgotado.", concluido_em=agora)
+                elif tarefa['concluido_em'] is not None and tarefa['concluido_em'] < agora - retencao:
+                    del self._tarefas[id]
+
+    def contagem(self):
+        with self._lock:
+            contagem = {}
+            for tarefa in self._tarefas.values():
+                contagem[tarefa['estado']] = contagem.get(tarefa['estado'], 0) + 1
+            return contagem
+
+
+COLUNAS_SITUACAO = """
+    id, tipo, estado, dono, erro, extract(epoch FROM criado_em)::float8,
+    extract(epoch FROM iniciado_em)::float8, extract(epoch FROM concluido_em)::float8
+"""
+
+
+class FilaPostgres:
+
+    def __init__(self):
+        self._assinatura = None
+
+    def preparar(self):
+        # A tabela tarefas vem da migração 5 (dao.migracoes).
+        pass
+
+    def acompanhar(self, acordar):
+        # acordar() a cada tarefa enfileirada em qualquer processo (e ao
+        # reconectar o LISTEN). Uma assinatura por processo: sobrevive ao fork.
+        if self._assinatura is None:
+            self._assinatura = notificacoes.ouvinte_tarefas.assinar(lambda evento: acordar())
+
+    def adicionar(self, tipo, parametros, dono=None, chave=None):
+        id = uuid.uuid4().hex
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO tarefas (id, tipo, parametros, dono, chave) VALUES (%s, %s, %s, %s, %s)',
+                (id, tipo, json.dumps(parametros), dono, chave)
+            )
+            cursor.execute('SELECT pg_notify(%s, %s)', (CANAL_TAREFAS, json.dumps({'id': id})))
+        return id
+
+    def buscarPorChave(self, chave):
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {COLUNAS_SITUACAO} FROM tarefas WHERE chave = %s AND estado <> 'falhou' "
+                "ORDER BY criado_em DESC LIMIT 1", (chave,)
+            )
+            linha = cursor.fetchone()
+        return _situacao(*linha) if linha else None
+
+    def reservar(self):
+        # SKIP LOCKED: processos concorrentes nunca reservam a mesma tarefa nem esperam um pelo outro.
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE tarefas SET estado = 'executando', iniciado_em = now()
+                WHERE id = (
+                    SELECT id FROM tarefas WHERE estado = 'pendente'
+                    ORDER BY criado_em FOR UPDATE SKIP LOCKED LIMIT 1
+                )
+                RETURNING id, tipo, parametros
+            """)
+            linha = cursor.fetchone()
+        return linha
+
+    def concluir(self, id, resultado, tipo_conteudo):
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE tarefas SET estado = 'concluida', resultado = %s, tipo_conteudo = %s, concluido_em = now() "
+                "WHERE id = %s", (resultado, tipo_conteudo, id)
+            )
+
+    def falhar(self, id, erro):
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE tarefas SET estado = 'falhou', erro = %s, concluido_em = now() WHERE id = %s", (erro, id)
+            )
+
+    def buscar(self, id):
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute(f'SELECT {COLUNAS_SITUACAO} FROM tarefas WHERE id = %s', (id,))
+            linha = cursor.fetchone()
+        return _situacao(*linha) if linha else None
+
+    def resultado(self, id):
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT resultado, tipo_conteudo FROM tarefas WHERE id = %s AND estado = 'concluida'", (id,))
+            linha = cursor.fetchone()
+        return (bytes(linha[0]), linha[1]) if linha else None
+
+    def limpar(self, retencao, tempo_max):
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE tarefas SET estado = 'falhou', erro = 'Tempo máximo de execução esgotado.', concluido_em = now() "
+                "WHERE estado = 'executando' AND iniciado_em < now() - make_interval(secs => %s)", (tempo_max,)
+            )
+            cursor.execute(
+                'DELETE FROM tarefas WHERE concluido_em < now() - make_interval(secs => %s)', (retencao,)
+            )
+
+    def contagem(self):
+        with dao.transacao() as conn, conn.cursor() as cursor:
+            cursor.execute('SELECT estado, COUNT(*) FROM tarefas GROUP BY estado')
+            return dict(cursor.fetchall())
+
+
+def _iniciarProcesso(config_banco):
+    # Processos novos (spawn): nada de conexões herdadas do processo web.
+    dao.configurarPool(config_banco)
+
+
+class ExecutorTarefas:
+
+    def __init__(self, fila, trabalhadores=2, modo='thread', intervalo=30.0, retencao=3600, tempo_max=600,
+                 config_banco=None, despachante=True):
+        if modo not in ('thread', 'processo'):
+            raise ValueError(f"TAREFAS_MODO inválido: {modo!r}")
+        self.fila = fila
+        self.trabalhadores = trabalhadores
+        self.modo = modo
+        self.intervalo = intervalo
+        self.retencao = retencao
+        self.tempo_max = tempo_max
+        self.config_banco = config_banco
+        self.despachante = despachante
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._pid = None
+        self._executadas = 0
+        self._falhas = 0
+
+    def garantirIniciado(self):
+        # Também depois de um fork (gunicorn --preload): threads não passam para o filho.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._vagas = threading.Semaphore(self.trabalhadores)
+            self._threads = ThreadPoolExecutor(max_workers=self.trabalhadores, thread_name_prefix='tarefa')
+            self._processos = None
+            if self.modo == 'processo':
+                self._processos = ProcessPoolExecutor(
+                    max_workers=self.trabalhadores, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_iniciarProcesso, initargs=(self.config_banco,)
+                )
+            threading.Thread(target=self._despachar, name='tarefas-despachante', daemon=True).start()
+        self.fila.acompanhar(self._acordar.set)
+
+    def enfileirar(self, tipo, parametros=None, dono=None, chave=None):
+        # Com chave, uma tarefa igual ainda pendente, em execução ou concluída (e
+        # não limpa) é reaproveitada em vez de executada de novo.
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo de tarefa desconhecido: {tipo}")
+        if self.despachante:
+            self.garantirIniciado()
+        if chave is not None:
+            existente = self.fila.buscarPorChave(chave)
+            if existente is not None:
+                return existente['id']
+        id = self.fila.adicionar(tipo, parametros or {}, dono, chave)
+        self._acordar.set()
+        return id
+
+    def _despachar(self):
+        ultima_limpeza = 0
+        while True:
+            self._vagas.acquire()
+            tarefa = None
+            while tarefa is None:
+                try:
+                    if time.monotonic() - ultima_limpeza > 60:
+                        ultima_limpeza = time.monotonic()
+                        self.fila.limpar(self.retencao, self.tempo_max)
+                    tarefa = self.fila.reservar()
+                except Exception as ex:
+                    print(f"Erro ao reservar tarefa: {ex}")
+                if tarefa is None:
+                    self._acordar.wait(self.intervalo)
+                    self._acordar.clear()
+            self._threads.submit(self._executar, *tarefa)
+
+    def _executar(self, id, tipo, parametros):
+        try:
+            if self._processos is not None:
+                resultado, tipo_conteudo = self._processos.submit(executarTarefa, tipo, parametros).result()
+            else:
+                resultado, tipo_conteudo = executarTarefa(tipo, parametros)
+            self.fila.concluir(id, resultado, tipo_conteudo)
+            self._executadas += 1
+        except Exception as ex:
+            print(f"Erro na tarefa {tipo} ({id}): {ex}")
+            self._falhas += 1
+            try:
+                self.fila.falhar(id, str(ex))
+            except Exception as ex_falha:
+                print(f"Erro ao registrar falha da tarefa {id}: {ex_falha}")
+        finally:
+            self._vagas.release()
+
+    def estatisticas(self):
+        return {
+            'modo': self.modo,
+            'trabalhadores': self.trabalhadores,
+            'executadas': self._executadas,
+            'falhas': self._falhas,
+            'por_estado': self.fila.contagem(),
+        }
+
+
+executor = None
+
+def configurar(config=None, config_banco=None):
+    global executor
+    opcoes = lerConfiguracao(config)
+    filas = {'postgres': FilaPostgres, 'memoria': FilaMemoria}
+    if opcoes['backend'] not in filas:
+        raise ValueError(f"TAREFAS_BACKEND inválido: {opcoes['backend']!r}")
+    fila = filas[opcoes['backend']]()
+    fila.preparar()
+    notificacoes.ouvinte_tarefas.configurar(config_banco)
+    executor = ExecutorTarefas(
+        fila, trabalhadores=opcoes['trabalhadores'], modo=opcoes['modo'], intervalo=opcoes['intervalo'],
+        retencao=opcoes['retencao'], tempo_max=opcoes['tempo_max'], config_banco=config_banco,
+        despachante=opcoes['despachante']
+    )
+    return executor
@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+# Revogação de tokens JWT consultada em memória, sem ir ao banco:
+# - jti revogados individualmente (logout), guardados até expirarem;
+# - versão mínima de token por usuário: ao mudar o tipo de um usuário a versão
+#   dele sobe no banco (usuario.versao_token) e tokens com versão menor deixam
+#   de valer.
+# As duas coisas ficam no banco (usuario.versao_token e a tabela
+# tokens_revogados): cada processo carrega tudo ao subir e acompanha as
+# mudanças pelo canal tokens (dao.notificacoes.ouvinte_tokens).
+
+class ListaRevogacao:
+
+    def __init__(self, limpeza_a_cada=1024):
+        self._jtis = {}
+        self._versoes = {}
+        self._lock = threading.Lock()
+        self._limpeza_a_cada = limpeza_a_cada
+        self._insercoes = 0
+
+    def revogar(self, jti, expira_em):
+        with self._lock:
+            self._jtis[jti] = expira_em
+            self._insercoes += 1
+            if self._insercoes >= self._limpeza_a_cada:
+                self._insercoes = 0
+                agora = time.time()
+                self._jtis = {j: e for j, e in self._jtis.items() if e > agora}
+
+    def revogado(self, jti):
+        return jti in self._jtis
+
+    def definirVersaoMinima(self, login, versao):
+        with self._lock:
+            if versao > self._versoes.get(login, 0):
+                self._versoes[login] = versao
+
+    def aplicarEvento(self, evento):
+        # Evento do canal tokens; False se não for uma revogação (ex.: REINICIAR).
+        if 'jti' in evento:
+            self.revogar(evento['jti'], float(evento['expira_em']))
+            return True
+        if 'login' in evento:
+            self.definirVersaoMinima(evento['login'], evento['versao'])
+            return True
+        return False
+
+    def versaoMinima(self, login):
+        return self._versoes.get(login, 0)
+
+    def tokenRevogado(self, claims, login=None):
+        # Tokens sem a claim "versao" (emitidos antes dela existir) valem como versão 0.
+        if self.revogado(claims.get('jti')):
+            return True
+        login = claims.get('sub') if login is None else login
+        return claims.get('versao', 0) < self.versaoMinima(login)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'jtis_revogados': len(self._jtis),
+                'usuarios_com_versao': len(self._versoes),
+            }
+
+
+revogacoes = ListaRevogacao()
@@ -0,0 +1,96 @@
+import hashlib
+import importlib.metadata
+import importlib.util
+import os
+import threading
+
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, session, jsonify
+from flask_jwt_extended import verify_jwt_in_request
+
+import dao
+import respostas
+import tarefas
+
+# Gráfico de estoque. Fica fora de app.py para que workers que só servem a API
+# não paguem pelo plotly: o pacote nem é importado, só o bundle JS é localizado.
+
+bp = Blueprint('grafico', __name__)
+
+_grafico_cache = {'versao': None, 'entradas': {}}
+_grafico_lock = threading.Lock()
+_pasta_plotly = {}
+
+def init_app(app):
+    if app.config.get("GRAFICO_HABILITADO", True):
+        app.register_blueprint(bp)
+
+def _plotly():
+    # Só o caminho e a versão do pacote, sem executar plotly/__init__.py.
+    if not _pasta_plotly:
+        spec = importlib.util.find_spec('plotly')
+        pasta = os.path.join(spec.submodule_search_locations[0], 'package_data')
+        _pasta_plotly.update(pasta=pasta, versao=importlib.metadata.version('plotly'))
+    return _pasta_plotly
+
+def _dados_grafico(loginuser=None, top=None):
+    # Cada combinação de filtros é agregada no banco uma vez por versão dos produtos.
+    versao = dao.versaoProdutos()
+    chave = (loginuser, top)
+    # Sem versão (erro ao consultá-la) o resultado não é guardado.
+    if versao is not None:
+        with _grafico_lock:
+            if _grafico_cache['versao'] != versao:
+                _grafico_cache.update(versao=versao, entradas={})
+            elif chave in _grafico_cache['entradas']:
+                return _grafico_cache['entradas'][chave]
+
+    linhas = dao.agregarEstoquePorNome(loginuser=loginuser, limite=top)
+    if linhas is None:
+        return None, None
+
+    dados = {"nome": [l[0] for l in linhas], "qtde": [l[1] for l in linhas]}
+    etag = hashlib.sha1(current_app.json.dumps(dados).encode()).hexdigest()
+    with _grafico_lock:
+        if versao is not None and _grafico_cache['versao'] == versao:
+            _grafico_cache['entradas'][chave] = (dados, etag)
+    return dados, etag
+
+@bp.route('/api/grafico/dados', methods=['GET'])
+def dados_grafico_api():
+    if 'usuario_logado' not in session:
+        verify_jwt_in_request()
+
+    top = request.args.get('top', type=int)
+    loginuser = request.args.get('loginuser') or None
+    top = top if top and top > 0 else None
+    if request.args.get('assincrono') == '1' and tarefas.habilitadas():
+        versao = dao.versaoProdutos()
+        return tarefas.enfileirar('grafico_dados', {"loginuser": loginuser, "top": top},
+                                  chave=f'grafico:{versao[0]}:{loginuser}:{top}' if versao else None)
+
+    dados, etag = _dados_grafico(loginuser, top)
+    if dados is None:
+        return jsonify({"erro": "Erro ao buscar dados do gráfico"}), 500
+
+    resposta = jsonify(dados)
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta.make_conditional(request)
+
+@bp.route('/grafico/plotly.min.js', methods=['GET'])
+def plotly_js():
+    return respostas.enviarEstatico(_plotly()['pasta'], 'plotly.min.js', max_age=31536000)
+
+@bp.route('/grafico', methods=['GET'])
+def visualizacao():
+    if 'usuario_logado' not in session:
+        flash("Você precisa estar logado para acessar esta página.")
+        return redirect(url_for('index'))
+
+    dados, _ = _dados_grafico()
+
+    if not dados or not dados['nome']:
+        flash("Não há produtos cadastrados para serem exibidos ainda.")
+        return redirect(url_for('listar_produtos'))
+
+    return render_template('grafico.html', plotly_versao=_plotly()['versao'])
@@ -0,0 +1,34 @@
+"""Migrações do esquema do banco configurado (DB_HOST, DB_NAME...).
+
+    python migrar.py aplicar      # aplica as pendentes (o app também faz isso ao subir, salvo DB_MIGRAR=0)
+    python migrar.py situacao     # versões e quando foram aplicadas
+    python migrar.py verificar    # EXPLAIN das consultas frequentes do dao: sai com 1 se alguma não usa índice
+"""
+import argparse
+import json
+import sys
+
+from dao import migracoes
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('comando', choices=('aplicar', 'situacao', 'verificar'))
+    parser.add_argument('--ate', type=int, help='aplicar: só até esta versão.')
+    parser.add_argument('--planejador-real', action='store_true',
+                        help='verificar: não desabilita seq scan (o resultado passa a depender do tamanho das tabelas).')
+    args = parser.parse_args(argumentos)
+
+    if args.comando == 'aplicar':
+        print(json.dumps({'aplicadas': migracoes.aplicarMigracoes(ate=args.ate)}))
+        return 0
+    if args.comando == 'situacao':
+        print(json.dumps(migracoes.situacaoMigracoes(), indent=2))
+        return 0
+    resultados = migracoes.verificarIndices(planejador_real=args.planejador_real)
+    print(json.dumps(resultados, indent=2))
+    return 0 if all(item['ok'] for item in resultados.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
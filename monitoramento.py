@@ -0,0 +1,120 @@
+import os
+import time
+
+from flask import Blueprint, Response, g, request
+
+import autenticacao
+import dao
+import renderizacao
+from dao import tarefas
+from dao.metricas import linhasHistograma, linhasValores, registro
+
+# Tempo de cada requisição por rota e o endpoint /metrics (formato texto do
+# Prometheus), com as consultas medidas pelo dao, o pool e os caches.
+
+bp = Blueprint('monitoramento', __name__)
+
+_requisicoes = registro.histograma(
+    'http_requisicao_segundos', 'Duração das requisições HTTP, por método, rota e status.',
+    ('metodo', 'rota', 'status'))
+
+def init_app(app):
+    app.config.setdefault('METRICAS_HABILITADAS', os.environ.get('METRICAS_HABILITADAS', '1') != '0')
+    if not app.config['METRICAS_HABILITADAS']:
+        return
+    # Registrado antes dos outros after_request, então roda por último e mede
+    # também a compressão da resposta.
+    app.before_request(_iniciar)
+    app.after_request(_finalizar)
+    app.register_blueprint(bp)
+
+def _iniciar():
+    g.inicio_requisicao = time.perf_counter()
+
+def _finalizar(resposta):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is None:
+        return resposta
+
+    rota = request.url_rule.rule if request.url_rule is not None else 'sem_rota'
+    rotulos = (request.method, rota, str(resposta.status_code))
+    if resposta.is_streamed:
+        # Respostas em streaming só terminam quando o último bloco é enviado.
+        resposta.call_on_close(lambda: _requisicoes.registrar(rotulos, time.perf_counter() - inicio))
+    else:
+        _requisicoes.registrar(rotulos, time.perf_counter() - inicio)
+    return resposta
+
+def _cabecalho(nome, tipo, ajuda):
+    return [f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}']
+
+@registro.coletor
+def _metricas_pool():
+    if dao.db_pool is None:
+        return []
+    estatisticas = dao.estatisticasPool()
+    linhas = _cabecalho('db_pool_conexoes', 'gauge', 'Conexões do pool por estado.')
+    linhas += linhasValores('db_pool_conexoes', ('estado',), [
+        ((estado,), estatisticas[estado]) for estado in ('abertas', 'em_uso', 'livres', 'aguardando')
+    ])
+    linhas += _cabecalho('db_pool_eventos_total', 'counter', 'Eventos do pool desde o início do processo.')
+    linhas += linhasValores('db_pool_eventos_total', ('evento',), [
+        ((evento,), estatisticas[evento]) for evento in ('checkouts', 'timeouts', 'quebradas', 'recicladas', 'criadas')
+    ])
+    linhas += _cabecalho('db_pool_espera_segundos', 'histogram', 'Espera por uma conexão livre no pool.')
+    linhas += linhasHistograma('db_pool_espera_segundos', (), (), estatisticas['espera_segundos'])
+    return linhas
+
+@registro.coletor
+def _metricas_caches():
+    caches = {
+        'perfis': dao.estatisticasCachePerfis(),
+        'produtos': dao.estatisticasCacheProdutos(),
+        'fragmentos': renderizacao.estatisticasFragmentos(),
+        'claims': autenticacao.estatisticas()['claims'],
+    }
+    linhas = _cabecalho('cache_consultas_total', 'counter', 'Acertos e falhas dos caches em memória.')
+    for nome, estatisticas in caches.items():
+        linhas += linhasValores('cache_consultas_total', ('cache', 'resultado'), [
+            ((nome, resultado), estatisticas[chave])
+            for resultado, chave in (('acerto', 'acertos'), ('falha', 'falhas'))
+            if chave in estatisticas
+        ])
+    return linhas
+
+@registro.coletor
+def _metricas_senhas():
+    estatisticas = dao.estatisticasSenhas()
+    linhas = _cabecalho('senhas_pendentes', 'gauge', 'Verificações de senha em execução ou na fila.')
+    linhas += linhasValores('senhas_pendentes', (), [((), estatisticas['pendentes'])])
+    linhas += _cabecalho('senhas_total', 'counter', 'Verificações de senha concluídas e recusadas por fila cheia.')
+    linhas += linhasValores('senhas_total', ('resultado',), [
+        (('concluida',), estatisticas['concluidas']), (('recusada',), estatisticas['recusadas'])
+    ])
+    return linhas
+
+@registro.coletor
+def _metricas_stream():
+    estatisticas = dao.estatisticasNotificacoes()
+    linhas = _cabecalho('produtos_stream_assinaturas', 'gauge', 'Conexões abertas em /api/produtos/stream.')
+    linhas += linhasValores('produtos_stream_assinaturas', (), [((), estatisticas['assinaturas'])])
+    linhas += _cabecalho('produtos_notificacoes_total', 'counter', 'Notificações recebidas pelo LISTEN de produtos.')
+    linhas += linhasValores('produtos_notificacoes_total', (), [((), estatisticas['recebidas'])])
+    return linhas
+
+@registro.coletor
+def _metricas_tarefas():
+    if tarefas.executor is None:
+        return []
+    estatisticas = tarefas.executor.estatisticas()
+    linhas = _cabecalho('tarefas', 'gauge', 'Tarefas em segundo plano na fila, por estado.')
+    linhas += linhasValores('tarefas', ('estado',), [((estado,), total) for estado, total in sorted(estatisticas['por_estado'].items())])
+    linhas += _cabecalho('tarefas_executadas_total', 'counter', 'Tarefas executadas por este processo.')
+    linhas += linhasValores('tarefas_executadas_total', (), [((), estatisticas['executadas'])])
+    linhas += _cabecalho('tarefas_falhas_total', 'counter', 'Tarefas que falharam neste processo.')
+    linhas += linhasValores('tarefas_falhas_total', (), [((), estatisticas['falhas'])])
+    return linhas
+
+@bp.route('/metrics', methods=['GET'])
+def metricas():
+    return Response(registro.formatoPrometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
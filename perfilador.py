@@ -0,0 +1,153 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import Blueprint, Response, abort, g, jsonify, request, session
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+import autenticacao
+import dao
+
+# Perfilamento sob demanda de uma requisição (cProfile). Só existe com
+# PERFILADOR_HABILITADO: desligado, nenhum hook é registrado. Ligado, só é
+# usado quando a requisição pede (cabeçalho X-Perfilar ou ?perfilar=1) e o
+# usuário, da sessão ou do token, é super.
+
+bp = Blueprint('perfilador', __name__)
+
+_relatorios = OrderedDict()
+_relatorios_lock = threading.Lock()
+# Uma requisição perfilada por vez: o custo do cProfile fica limitado a ela.
+_em_uso = threading.Lock()
+_opcoes = {'max_relatorios': 20, 'linhas': 40}
+
+def init_app(app):
+    app.config.setdefault('PERFILADOR_HABILITADO', os.environ.get('PERFILADOR_HABILITADO', '0') == '1')
+    app.config.setdefault('PERFILADOR_MAX_RELATORIOS', int(os.environ.get('PERFILADOR_MAX_RELATORIOS', 20)))
+    app.config.setdefault('PERFILADOR_LINHAS', int(os.environ.get('PERFILADOR_LINHAS', 40)))
+    if not app.config['PERFILADOR_HABILITADO']:
+        return
+    _opcoes.update(max_relatorios=app.config['PERFILADOR_MAX_RELATORIOS'], linhas=app.config['PERFILADOR_LINHAS'])
+    # Registrado depois de respostas: o relatório devolvido no lugar da página
+    # ainda passa pela compressão.
+    app.before_request(_iniciar)
+    app.after_request(_finalizar)
+    app.teardown_request(_descartar)
+    app.register_blueprint(bp)
+
+def _pedido():
+    valor = request.headers.get('X-Perfilar') or request.args.get('perfilar')
+    return valor if valor and valor != '0' else None
+
+def _usuarioSuper():
+    if 'usuario_logado' in session:
+        return dao.buscarTipoUsuario(session['usuario_logado']) == 'super'
+    try:
+        verify_jwt_in_request(optional=True)
+    except Exception:
+        return False
+    return get_jwt_identity() is not None and autenticacao.tipoUsuarioToken() == 'super'
+
+def _iniciar():
+    pedido = _pedido()
+    if pedido is None or not _usuarioSuper():
+        return
+    if not _em_uso.acquire(blocking=False):
+        return
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        # Outro perfilador já ativo no processo.
+        _em_uso.release()
+        return
+    g.perfil = (perfil, pedido, time.perf_counter())
+
+def _finalizar(resposta):
+    atual = g.pop('perfil', None)
+    if atual is None:
+        return resposta
+    perfil, pedido, inicio = atual
+    descricao = (request.method, request.full_path.rstrip('?'), request.endpoint)
+
+    if resposta.is_streamed:
+        # O corpo é gerado depois deste hook; o perfil vai até o último bloco.
+        identificador = uuid.uuid4().hex
+        resposta.call_on_close(lambda: _guardar(identificador, perfil, inicio, descricao))
+        resposta.headers['X-Perfil-Id'] = identificador
+        return resposta
+
+    identificador = _guardar(uuid.uuid4().hex, perfil, inicio, descricao)
+    if pedido == 'relatorio':
+        return Response(_relatorios[identificador]['relatorio'], content_type='text/plain; charset=utf-8',
+                        headers={'X-Perfil-Id': identificador})
+    resposta.headers['X-Perfil-Id'] = identificador
+    return resposta
+
+def _descartar(erro=None):
+    # Requisição que terminou sem passar por _finalizar.
+    atual = g.pop('perfil', None)
+    if atual is not None:
+        atual[0].disable()
+        _em_uso.release()
+
+def _guardar(identificador, perfil, inicio, descricao):
+    perfil.disable()
+    _em_uso.release()
+    duracao = time.perf_counter() - inicio
+    perfil.create_stats()
+    # pstats.Stats esvazia perfil.stats ao carregar; o formato binário sai antes.
+    binario = marshal.dumps(perfil.stats)
+
+    metodo, caminho, endpoint = descricao
+    texto = io.StringIO()
+    texto.write(f'{metodo} {caminho} ({endpoint}) em {duracao * 1000:.1f} ms\n\n')
+    estatisticas = pstats.Stats(perfil, stream=texto).strip_dirs().sort_stats('cumulative')
+    estatisticas.print_stats(_opcoes['linhas'])
+    # Quem chama quem, para as funções mais caras: a árvore de chamadas resumida.
+    estatisticas.print_callees(_opcoes['linhas'])
+
+    with _relatorios_lock:
+        _relatorios[identificador] = {
+            'id': identificador,
+            'metodo': metodo,
+            'caminho': caminho,
+            'endpoint': endpoint,
+            'duracao_ms': round(duracao * 1000, 1),
+            'criado_em': time.time(),
+            'relatorio': texto.getvalue(),
+            'pstats': binario,
+        }
+        while len(_relatorios) > _opcoes['max_relatorios']:
+            _relatorios.popitem(last=False)
+    return identificador
+
+@bp.route('/api/perfilador', methods=['GET'])
+@autenticacao.papelRequerido('super')
+def listar_relatorios():
+    with _relatorios_lock:
+        itens = [
+            {chave: valor for chave, valor in item.items() if chave not in ('relatorio', 'pstats')}
+            for item in reversed(_relatorios.values())
+        ]
+    return jsonify(itens)
+
+@bp.route('/api/perfilador/<identificador>', methods=['GET'])
+@autenticacao.papelRequerido('super')
+def buscar_relatorio(identificador):
+    with _relatorios_lock:
+        item = _relatorios.get(identificador)
+    if item is None:
+        abort(404)
+    if request.args.get('formato') == 'pstats':
+        # Mesmo formato de pstats.Stats.dump_stats (abre em snakeviz, pstats etc.).
+        return Response(item['pstats'], mimetype='application/octet-stream', headers={
+            'Content-Disposition': f'attachment; filename=perfil-{identificador}.pstats'
+        })
+    return Response(item['relatorio'], content_type='text/plain; charset=utf-8')
@@ -0,0 +1,75 @@
+import os
+import stat
+
+from flask import url_for
+from jinja2 import FileSystemBytecodeCache
+
+from dao.cache import AUSENTE, CacheLRU
+
+# Templates compilados uma vez (e guardados em disco entre reinícios) e cache
+# de fragmentos HTML já renderizados.
+
+_fragmentos = CacheLRU(capacidade=256, ttl=300)
+
+def init_app(app):
+    # Sem JINJA_CACHE_DIR vale a pasta padrão do Jinja (por usuário, 0700, com
+    # checagem de dono); vazio desliga o cache em disco.
+    app.config.setdefault('JINJA_CACHE_DIR', os.environ.get('JINJA_CACHE_DIR'))
+    app.config.setdefault('CACHE_FRAGMENTOS_MAX', int(os.environ.get('CACHE_FRAGMENTOS_MAX', 256)))
+    app.config.setdefault('CACHE_FRAGMENTOS_TTL', float(os.environ.get('CACHE_FRAGMENTOS_TTL', 300)))
+    app.config.setdefault('TEMPLATES_PRECOMPILAR', os.environ.get('TEMPLATES_PRECOMPILAR', '1') != '0')
+
+    pasta = app.config['JINJA_CACHE_DIR']
+    if pasta is None:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+    elif pasta and _pastaSegura(pasta):
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(pasta)
+    if app.config['TEMPLATES_PRECOMPILAR']:
+        # Compila todos os templates já no início, não na primeira requisição de cada um.
+        for nome in app.jinja_env.list_templates(extensions=['html']):
+            app.jinja_env.get_template(nome)
+
+    _fragmentos.configurar(
+        capacidade=app.config['CACHE_FRAGMENTOS_MAX'],
+        ttl=app.config['CACHE_FRAGMENTOS_TTL']
+    )
+
+def _pastaSegura(pasta):
+    # O cache guarda bytecode que é executado: a pasta tem de ser só deste usuário.
+    try:
+        os.makedirs(pasta, mode=0o700, exist_ok=True)
+        info = os.lstat(pasta)
+    except OSError as ex:
+        print(f"Cache de templates desligado: {ex}")
+        return False
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        print(f"Cache de templates desligado: {pasta} não é uma pasta 0700 deste usuário.")
+        return False
+    return True
+
+def fragmento(chave, gerar):
+    # chave deve conter tudo de que o HTML depende (versão dos dados, perfil,
+    # parâmetros); com chave None o fragmento é gerado sem cache.
+    if chave is None:
+        return gerar()
+    valor = _fragmentos.obter(chave)
+    if valor is not AUSENTE:
+        return valor
+    valor = gerar()
+    if valor is not None:
+        _fragmentos.definir(chave, valor)
+    return valor
+
+def estatisticasFragmentos():
+    return _fragmentos.estatisticas()
+
+_MARCADOR = 918273645
+
+def prefixoUrl(endpoint, parametro='id'):
+    # Prefixo de url_for(endpoint, id=...) para rotas em que o id é o último
+    # segmento: a URL de cada linha vira prefixo + id, sem url_for por linha.
+    url = url_for(endpoint, **{parametro: _MARCADOR})
+    prefixo, marcador, sufixo = url.rpartition(str(_MARCADOR))
+    if not marcador or sufixo:
+        raise ValueError(f"{endpoint} não termina em <{parametro}>: {url}")
+    return prefixo
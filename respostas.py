@@ -0,0 +1,186 @@
+import gzip
+import os
+import threading
+import zlib
+from decimal import Decimal
+
+from flask import current_app, request, send_from_directory
+from werkzeug.security import safe_join
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Serialização JSON (orjson) e compressão das respostas (gzip/brotli).
+# As duas dependências são opcionais: sem elas o app segue com o encoder
+# padrão do Flask e só com gzip.
+
+TIPOS_COMPRIMIVEIS = {
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'text/html', 'text/css', 'text/csv', 'text/javascript', 'text/plain',
+}
+
+def _padrao(obj):
+    # Decimal vira string, como no provider padrão do Flask (preços não perdem precisão).
+    if isinstance(obj, Decimal):
+        return str(obj)
+    return DefaultJSONProvider.default(obj)
+
+class ProvedorJSONRapido(DefaultJSONProvider):
+    # Mesmo formato do provider padrão (chaves ordenadas, Decimal como string);
+    # datetime, date e UUID são serializados nativamente pelo orjson (ISO 8601).
+
+    def _opcoes(self):
+        opcoes = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            opcoes |= orjson.OPT_SORT_KEYS
+        return opcoes
+
+    def dumps(self, obj, **kwargs):
+        # Argumentos do json da stdlib (indent, cls...) ficam com o provider padrão.
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_padrao, option=self._opcoes()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        opcoes = self._opcoes() | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            opcoes |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, default=_padrao, option=opcoes), mimetype=self.mimetype
+        )
+
+def _codificacao(aceitas):
+    # brotli quando o cliente o aceita com qualidade igual ou maior que gzip.
+    qualidade_br = aceitas['br'] if brotli is not None else 0
+    qualidade_gzip = aceitas['gzip']
+    if qualidade_br and qualidade_br >= qualidade_gzip:
+        return 'br'
+    if qualidade_gzip:
+        return 'gzip'
+    return None
+
+def _comprimir(dados, codificacao, config):
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=config['COMPRESSAO_NIVEL_BROTLI'])
+    return gzip.compress(dados, compresslevel=config['COMPRESSAO_NIVEL_GZIP'], mtime=0)
+
+def _comprimirFluxo(partes, codificacao, config):
+    # Cada bloco do gerador sai comprimido e descarregado, para não segurar o streaming.
+    if codificacao == 'br':
+        compressor = brotli.Compressor(quality=config['COMPRESSAO_NIVEL_BROTLI'])
+        comprimir, descarregar, finalizar = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(config['COMPRESSAO_NIVEL_GZIP'], zlib.DEFLATED, 31)
+        comprimir = compressor.compress
+        descarregar = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        finalizar = compressor.flush
+
+    try:
+        for parte in partes:
+            if isinstance(parte, str):
+                parte = parte.encode()
+            bloco = comprimir(parte) + descarregar()
+            if bloco:
+                yield bloco
+        yield finalizar()
+    finally:
+        # Repassa o fechamento (ex.: cliente desconectou) ao gerador original.
+        if hasattr(partes, 'close'):
+            partes.close()
+
+def comprimirResposta(resposta):
+    config = current_app.config
+    if (resposta.status_code < 200 or resposta.status_code in (204, 206, 304)
+            or resposta.direct_passthrough
+            or 'Content-Encoding' in resposta.headers
+            or resposta.mimetype not in TIPOS_COMPRIMIVEIS):
+        return resposta
+
+    resposta.vary.add('Accept-Encoding')
+    codificacao = _codificacao(request.accept_encodings)
+    if codificacao is None:
+        return resposta
+
+    if resposta.is_streamed:
+        resposta.response = _comprimirFluxo(resposta.response, codificacao, config)
+        resposta.headers.pop('Content-Length', None)
+    else:
+        dados = resposta.get_data()
+        if len(dados) < config['COMPRESSAO_MINIMO']:
+            return resposta
+        resposta.set_data(_comprimir(dados, codificacao, config))
+
+    resposta.headers['Content-Encoding'] = codificacao
+    # O corpo comprimido não é idêntico byte a byte ao original: o ETag forte
+    # passa a fraco, o que ainda vale para If-None-Match (comparação fraca).
+    etag, fraco = resposta.get_etag()
+    if etag and not fraco:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+# Arquivos estáticos grandes (ex.: o plotly.min.js do gráfico) saem de
+# send_from_directory com direct_passthrough, que comprimirResposta não toca:
+# cada variante é comprimida uma vez por processo e guardada em memória.
+_estaticos = {}
+_estaticos_lock = threading.Lock()
+
+def _estaticoComprimido(caminho, codificacao, config):
+    estado = os.stat(caminho)
+    chave = (caminho, estado.st_mtime_ns, estado.st_size, codificacao)
+    with _estaticos_lock:
+        dados = _estaticos.get(chave)
+        if dados is None:
+            with open(caminho, 'rb') as arquivo:
+                dados = _comprimir(arquivo.read(), codificacao, config)
+            _estaticos[chave] = dados
+    return dados
+
+def enviarEstatico(pasta, nome, max_age=None):
+    # send_from_directory com o corpo em gzip/brotli conforme o Accept-Encoding.
+    resposta = send_from_directory(pasta, nome, max_age=max_age)
+    config = current_app.config
+    if (not config.get('COMPRESSAO_HABILITADA') or resposta.status_code != 200
+            or resposta.mimetype not in TIPOS_COMPRIMIVEIS):
+        return resposta
+
+    resposta.vary.add('Accept-Encoding')
+    codificacao = _codificacao(request.accept_encodings)
+    if codificacao is None:
+        return resposta
+
+    dados = _estaticoComprimido(safe_join(pasta, nome), codificacao, config)
+    resposta.close()
+    resposta.direct_passthrough = False
+    resposta.set_data(dados)
+    resposta.headers['Content-Encoding'] = codificacao
+    # Faixas (Range) valeriam sobre o corpo comprimido: só o arquivo original as aceita.
+    resposta.headers.pop('Accept-Ranges', None)
+    etag, fraco = resposta.get_etag()
+    if etag and not fraco:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+def init_app(app):
+    app.config.setdefault('COMPRESSAO_HABILITADA', os.environ.get('COMPRESSAO_HABILITADA', '1') != '0')
+    app.config.setdefault('COMPRESSAO_MINIMO', int(os.environ.get('COMPRESSAO_MINIMO', 1024)))
+    app.config.setdefault('COMPRESSAO_NIVEL_GZIP', int(os.environ.get('COMPRESSAO_NIVEL_GZIP', 6)))
+    app.config.setdefault('COMPRESSAO_NIVEL_BROTLI', int(os.environ.get('COMPRESSAO_NIVEL_BROTLI', 4)))
+
+    if orjson is not None:
+        app.json = ProvedorJSONRapido(app)
+    if app.config['COMPRESSAO_HABILITADA']:
+        app.after_request(comprimirResposta)
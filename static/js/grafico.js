@@ -0,0 +1,52 @@
+document.addEventListener("DOMContentLoaded", function() {
+    const grafico = document.getElementById('grafico');
+    const fonte = (tamanho, cor) => ({ size: tamanho, color: cor, family: "Dancing Script, cursive" });
+
+    fetch(grafico.dataset.url, { credentials: 'same-origin' })
+        .then(resposta => resposta.json())
+        .then(dados => {
+            const barras = {
+                type: 'bar',
+                x: dados.nome,
+                y: dados.qtde,
+                marker: {
+                    color: 'pink',
+                    line: { color: 'rgb(119,67,22)', width: 1 }
+                },
+                hovertemplate: 'Nome do Produto=%{x}<br>Quantidade=%{y}<extra></extra>'
+            };
+
+            const layout = {
+                title: {
+                    text: "Quantidade de Produtos por Nome",
+                    x: 0.5,
+                    font: fonte(32, "rgb(119,67,22)")
+                },
+                xaxis: {
+                    tickangle: 45,
+                    title: { text: "Nome do Produto", font: fonte(20, "#703c15") },
+                    tickfont: fonte(20, "#703c15")
+                },
+                yaxis: {
+                    title: { text: "Quantidade", font: fonte(20, "#703c15") },
+                    tickfont: fonte(20, "#703c15")
+                },
+                plot_bgcolor: "#c8f3f5",
+                paper_bgcolor: "#fd92c6",
+                showlegend: false,
+                images: [{
+                    source: grafico.dataset.imagem,
+                    xref: 'paper',
+                    yref: 'paper',
+                    x: 0.3,
+                    y: 1,
+                    sizex: 1.0,
+                    sizey: 1.0,
+                    opacity: 0.5,
+                    layer: 'below'
+                }]
+            };
+
+            Plotly.newPlot(grafico, [barras], layout, { responsive: true });
+        });
+});
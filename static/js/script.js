@@ -10,73 +10,23 @@ document.addEventListener("DOMContentLoaded", function() {
         });
     });
 
-    const searchBar = document.getElementById('searchBar');
-    const productTable = document.getElementById('productTable');
-    let productRows = Array.from(productTable.getElementsByTagName('tr'));
-
-    let filteredRows = [...productRows];
-
-    function updatePagination() {
-        const rowsPerPage = 5;
-        let currentPage = 1;
-
-        const totalRows = filteredRows.length;
-        const totalPages = Math.ceil(totalRows / rowsPerPage);
-
-        if (totalRows === 0) {
-            document.getElementById('pageDisplay').textContent = `Nenhum produto encontrado`;
-            document.getElementById('prevPage').disabled = true;
-            document.getElementById('nextPage').disabled = true;
-            return;
-        }
-
-        function displayPage(page) {
-            const startRow = (page - 1) * rowsPerPage;
-            const endRow = startRow + rowsPerPage;
-
-            filteredRows.forEach((row, index) => {
-                if (index >= startRow && index < endRow) {
-                    row.style.display = '';
-                } else {
-                    row.style.display = 'none';
-                }
-            });
-
-            document.getElementById('pageDisplay').textContent = `Página ${page} de ${totalPages}`;
-            document.getElementById('prevPage').disabled = page === 1;
-            document.getElementById('nextPage').disabled = page === totalPages;
-        }
-
-        displayPage(currentPage);
-
-        document.getElementById('prevPage').addEventListener('click', function() {
-            if (currentPage > 1) {
-                currentPage--;
-                displayPage(currentPage);
-            }
-        });
-
-        document.getElementById('nextPage').addEventListener('click', function() {
-            if (currentPage < totalPages) {
-                currentPage++;
-                displayPage(currentPage);
-            }
+    const ordem = document.getElementById('ordem');
+    if (ordem) {
+        ordem.addEventListener('change', function() {
+            ordem.form.submit();
         });
     }
 
-    searchBar.addEventListener('keyup', function(event) {
-        const searchTerm = event.target.value.toLowerCase();
-
-        filteredRows = productRows.filter(row => {
-            const productName = row.querySelector('.product-name') ? row.querySelector('.product-name').textContent.toLowerCase() : '';
-            const isVisible = productName.includes(searchTerm);
-            row.style.display = isVisible ? '' : 'none';
-            return isVisible;
-        });
-
-        updatePagination();
-    });
-    updatePagination();
+    const tabela = document.getElementById('productTable');
+    if (tabela && tabela.dataset.stream && window.EventSource) {
+        const eventos = new EventSource(tabela.dataset.stream);
+        const avisar = function() {
+            eventos.close();
+            document.querySelector('.message p').innerHTML = 'A lista de produtos mudou. <a href="">Atualizar</a>';
+        };
+        eventos.addEventListener('produtos', avisar);
+        eventos.addEventListener('reiniciar', avisar);
+    }
 });
 
 document.addEventListener('keydown', function(event) {
@@ -0,0 +1,97 @@
+import os
+
+from flask import Blueprint, Response, jsonify, request, session, url_for
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+import autenticacao
+import dao
+from dao import tarefas
+from dao.pool import CONFIGURACAO_PADRAO as CONFIGURACAO_BANCO
+
+# Rotas de status e resultado das tarefas em segundo plano (dao.tarefas). As
+# rotas pesadas enfileiram com enfileirar() e respondem 202 com a URL da tarefa.
+
+bp = Blueprint('tarefas', __name__)
+
+def init_app(app):
+    app.config.setdefault('TAREFAS_HABILITADAS', os.environ.get('TAREFAS_HABILITADAS', '1') != '0')
+    if not app.config['TAREFAS_HABILITADAS']:
+        return
+    config_banco = {chave: app.config[chave] for chave in CONFIGURACAO_BANCO if app.config.get(chave) is not None}
+    executor = tarefas.configurar(app.config, config_banco=config_banco)
+    # Com TAREFAS_DESPACHANTE=0 o processo só enfileira; outro executa.
+    if executor.despachante:
+        executor.garantirIniciado()
+    app.register_blueprint(bp)
+
+def habilitadas():
+    return tarefas.executor is not None
+
+def _usuarioAtual():
+    if 'usuario_logado' in session:
+        login = session['usuario_logado']
+        return login, dao.buscarTipoUsuario(login)
+    verify_jwt_in_request()
+    return get_jwt_identity(), autenticacao.tipoUsuarioToken()
+
+def _descrever(situacao):
+    situacao = dict(situacao)
+    situacao['url'] = url_for('tarefas.situacao_tarefa', id=situacao['id'])
+    if situacao['estado'] == tarefas.CONCLUIDA:
+        situacao['resultado'] = url_for('tarefas.resultado_tarefa', id=situacao['id'])
+    return situacao
+
+def enfileirar(tipo, parametros=None, chave=None):
+    # Resposta 202 para a rota que delegou o trabalho; chave reaproveita uma tarefa igual.
+    dono, _ = _usuarioAtual()
+    id = tarefas.executor.enfileirar(tipo, parametros, dono=dono, chave=f'{dono}:{chave}' if chave else None)
+    situacao = _descrever(tarefas.executor.fila.buscar(id))
+    resposta = jsonify(situacao)
+    resposta.status_code = 202
+    resposta.headers['Location'] = situacao['url']
+    return resposta
+
+def _tarefaDoUsuario(id):
+    login, tipo = _usuarioAtual()
+    situacao = tarefas.executor.fila.buscar(id)
+    # Tarefas de outro usuário aparecem como inexistentes (exceto para super).
+    if situacao is None or (situacao['dono'] != login and tipo != 'super'):
+        return None
+    return situacao
+
+@bp.route('/api/tarefas', methods=['POST'])
+def criar_tarefa():
+    dados = request.get_json(silent=True) or {}
+    tipo = dados.get('tipo')
+    parametros = dados.get('parametros') or {}
+    if tipo not in tarefas.TIPOS or not isinstance(parametros, dict):
+        return jsonify({"erro": f"Informe tipo (um de {sorted(tarefas.TIPOS)}) e parametros (objeto)."}), 400
+    return enfileirar(tipo, parametros)
+
+@bp.route('/api/tarefas/<id>', methods=['GET'])
+def situacao_tarefa(id):
+    situacao = _tarefaDoUsuario(id)
+    if situacao is None:
+        return jsonify({"erro": "Tarefa não encontrada"}), 404
+    return jsonify(_descrever(situacao))
+
+@bp.route('/api/tarefas/<id>/resultado', methods=['GET'])
+def resultado_tarefa(id):
+    situacao = _tarefaDoUsuario(id)
+    if situacao is None:
+        return jsonify({"erro": "Tarefa não encontrada"}), 404
+    if situacao['estado'] != tarefas.CONCLUIDA:
+        return jsonify(_descrever(situacao)), 409
+
+    conteudo, tipo_conteudo = tarefas.executor.fila.resultado(id)
+    resposta = Response(conteudo, mimetype=tipo_conteudo)
+    if tipo_conteudo == 'text/csv':
+        resposta.headers['Content-Disposition'] = f'attachment; filename={situacao["tipo"]}.csv'
+    # O resultado de uma tarefa não muda depois de concluída.
+    resposta.headers['Cache-Control'] = 'private, max-age=3600'
+    return resposta
+
+@bp.route('/api/tarefas', methods=['GET'])
+@autenticacao.papelRequerido('super')
+def estatisticas_tarefas():
+    return jsonify(tarefas.executor.estatisticas())